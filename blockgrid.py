@@ -0,0 +1,163 @@
+import random
+import sys
+import time
+import tracemalloc
+
+# Compact block storage: one byte per cell in a single bytearray instead of a
+# Python list per column. Cells are stored column-major (x * rows + y) so a
+# column is one contiguous slice, like the old grid[x][y] layout.
+
+class BlockGrid:
+    def __init__(self, columns, rows, fill=0, data=None):
+        self.columns = columns
+        self.rows = rows
+        if data is None:
+            data = bytearray([fill]) * (columns * rows)
+        elif len(data) != columns * rows:
+            raise ValueError(f"expected {columns * rows} bytes of block data, got {len(data)}")
+        self.data = bytearray(data)
+
+    def in_bounds(self, x, y):
+        return 0 <= x < self.columns and 0 <= y < self.rows
+
+    def get_block(self, x, y):
+        if 0 <= x < self.columns and 0 <= y < self.rows:
+            return self.data[x * self.rows + y]
+        return None
+
+    def set_block(self, x, y, block_type):
+        if 0 <= x < self.columns and 0 <= y < self.rows:
+            self.data[x * self.rows + y] = block_type
+
+    def clip_region(self, x, y, width, height):
+        # Intersect a region with the grid, returns (x0, y0, x1, y1) or None
+        x0, y0 = max(x, 0), max(y, 0)
+        x1, y1 = min(x + width, self.columns), min(y + height, self.rows)
+        if x0 >= x1 or y0 >= y1:
+            return None
+        return x0, y0, x1, y1
+
+    def fill_region(self, x, y, width, height, block_type):
+        region = self.clip_region(x, y, width, height)
+        if region is None:
+            return
+        x0, y0, x1, y1 = region
+        span = bytes([block_type]) * (y1 - y0)
+        rows = self.rows
+        for column_x in range(x0, x1):
+            start = column_x * rows + y0
+            self.data[start:start + len(span)] = span
+
+    def copy_region(self, x, y, width, height):
+        # Returns a new BlockGrid holding the region; cells outside the grid are air
+        region = BlockGrid(width, height)
+        clipped = self.clip_region(x, y, width, height)
+        if clipped is None:
+            return region
+        x0, y0, x1, y1 = clipped
+        rows = self.rows
+        for column_x in range(x0, x1):
+            start = column_x * rows + y0
+            dest = (column_x - x) * height + (y0 - y)
+            region.data[dest:dest + y1 - y0] = self.data[start:start + y1 - y0]
+        return region
+
+    def paste_region(self, region, x, y):
+        clipped = self.clip_region(x, y, region.columns, region.rows)
+        if clipped is None:
+            return
+        x0, y0, x1, y1 = clipped
+        rows = self.rows
+        for column_x in range(x0, x1):
+            start = column_x * rows + y0
+            source = (column_x - x) * region.rows + (y0 - y)
+            self.data[start:start + y1 - y0] = region.data[source:source + y1 - y0]
+
+    def column(self, x):
+        start = x * self.rows
+        return bytes(self.data[start:start + self.rows])
+
+    def set_column(self, x, blocks):
+        if len(blocks) != self.rows:
+            raise ValueError(f"column needs {self.rows} blocks, got {len(blocks)}")
+        start = x * self.rows
+        self.data[start:start + self.rows] = bytes(blocks)
+
+    def row(self, y):
+        return bytes(self.data[y::self.rows])
+
+    def set_row(self, y, blocks):
+        if len(blocks) != self.columns:
+            raise ValueError(f"row needs {self.columns} blocks, got {len(blocks)}")
+        self.data[y::self.rows] = bytes(blocks)
+
+    def count(self, block_type):
+        return self.data.count(block_type)
+
+# Benchmark against the original list-of-lists grid
+
+class ListGrid:
+    # The storage and access path World used before BlockGrid
+    def __init__(self, columns, rows):
+        self.columns = columns
+        self.rows = rows
+        self.grid = [[0 for _ in range(rows)] for _ in range(columns)]
+
+    def in_bounds(self, x, y):
+        return 0 <= x < self.columns and 0 <= y < self.rows
+
+    def get_block(self, x, y):
+        if not self.in_bounds(x, y):
+            return None
+        return self.grid[x][y]
+
+    def set_block(self, x, y, block_type):
+        if self.in_bounds(x, y):
+            self.grid[x][y] = block_type
+
+def measure_memory(build):
+    tracemalloc.start()
+    grid = build()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return grid, size
+
+def benchmark(columns, rows, accesses=1_000_000):
+    rng = random.Random(0)
+    points = [(rng.randrange(columns), rng.randrange(rows)) for _ in range(accesses)]
+
+    grid, list_bytes = measure_memory(lambda: ListGrid(columns, rows))
+    start = time.perf_counter()
+    for x, y in points:
+        grid.set_block(x, y, 1)
+    for x, y in points:
+        grid.get_block(x, y)
+    list_time = time.perf_counter() - start
+    start = time.perf_counter()
+    for x in range(columns // 4):
+        for y in range(rows // 2, rows):
+            grid.set_block(x, y, 2)
+    list_fill = time.perf_counter() - start
+    del grid
+
+    blocks, grid_bytes = measure_memory(lambda: BlockGrid(columns, rows))
+    start = time.perf_counter()
+    for x, y in points:
+        blocks.set_block(x, y, 1)
+    for x, y in points:
+        blocks.get_block(x, y)
+    grid_time = time.perf_counter() - start
+    start = time.perf_counter()
+    blocks.fill_region(0, rows // 2, columns // 4, rows - rows // 2, 2)
+    grid_fill = time.perf_counter() - start
+
+    print(f"{columns} x {rows} cells, {accesses} random sets + gets")
+    print(f"  list of lists: {list_bytes / 2**20:8.1f} MiB  access {list_time:6.3f} s  fill {list_fill:6.3f} s")
+    print(f"  BlockGrid:     {grid_bytes / 2**20:8.1f} MiB  access {grid_time:6.3f} s  fill {grid_fill:6.3f} s")
+
+if __name__ == "__main__":
+    sizes = [(1000, 1000), (10000, 1000)]
+    if len(sys.argv) > 1:
+        sizes = [tuple(int(v) for v in arg.split("x")) for arg in sys.argv[1:]]
+    for columns, rows in sizes:
+        benchmark(columns, rows)
@@ -0,0 +1,192 @@
+import sys
+import time
+
+import numpy as np
+import pygame
+
+import car_game
+import cores
+
+# Lane-dodging environment with car_game's rules, for reinforcement
+# learning. K games are stepped in lockstep: all state lives in NumPy arrays
+# with one row per game, so a step is a fixed number of array operations no
+# matter how many games there are. Nothing is drawn unless render() is
+# called.
+#
+#   env = CarEnv(1024, seed=0)
+#   observations = env.reset()
+#   observations, rewards, dones, info = env.step(actions)
+#
+# actions holds one of STAY, LEFT, RIGHT per game. Finished games start a
+# new episode right away; their observation is the first one of the new
+# episode and info describes the episodes that just ended.
+#
+# Observation per game (float32):
+#   player lane, one-hot                      LANES values
+#   distance to the next car in each lane,    LANES values, 1.0 if none
+#   as a fraction of the screen height
+#   lane occupancy grid from the top of the   GRID_ROWS * LANES values
+#   screen down to the player, row major
+
+STAY, LEFT, RIGHT = 0, 1, 2
+LANES = 3
+GRID_ROWS = 8
+OBSERVATION_SIZE = LANES + LANES + GRID_ROWS * LANES
+
+SURVIVE_REWARD = 1.0
+CRASH_REWARD = -10.0
+
+# Car centers, shared with the rules in cores.py
+PLAYER_Y = cores.CAR_PLAYER_Y
+PLAYER_TOP = PLAYER_Y - car_game.CAR_HEIGHT // 2
+SPAWN_Y = cores.CAR_SPAWN_Y
+
+class CarEnv:
+    def __init__(self, count, seed=None, obstacle_delay=1500, wave_size=1, speed=5, max_enemies=car_game.MAX_ENEMIES, max_ticks=None):
+        self.count = count
+        self.obstacle_delay = obstacle_delay
+        self.wave_size = wave_size
+        self.speed = speed
+        self.max_enemies = max_enemies
+        self.max_ticks = max_ticks
+        # Same timer arithmetic as car_game.Game.update
+        self.tick_ms = 1 / car_game.FPS * 1000
+        self.rng = np.random.default_rng(seed)
+
+        self.lane = np.ones(count, dtype=np.int64)
+        self.timer = np.zeros(count, dtype=np.float64)
+        self.ticks = np.zeros(count, dtype=np.int64)
+        self.score = np.zeros(count, dtype=np.int64)
+        # Enemy slots; inactive slots are ignored
+        self.enemy_y = np.zeros((count, max_enemies), dtype=np.int64)
+        self.enemy_lane = np.zeros((count, max_enemies), dtype=np.int64)
+        self.active = np.zeros((count, max_enemies), dtype=bool)
+
+        self.rows = np.arange(count)
+        self.observations = np.zeros((count, OBSERVATION_SIZE), dtype=np.float32)
+        # Drawing is set up on the first render()
+        self.road = None
+        self.sprites = None
+
+    def reset(self):
+        self.reset_games(np.ones(self.count, dtype=bool))
+        return self.observe()
+
+    def reset_games(self, mask):
+        self.lane[mask] = 1
+        self.timer[mask] = 0
+        self.ticks[mask] = 0
+        self.score[mask] = 0
+        self.active[mask] = False
+
+    def spawn(self, games):
+        # One car in a random lane for each game in `games` that has a free slot
+        free = ~self.active[games]
+        has_free = free.any(axis=1)
+        games = games[has_free]
+        slots = free[has_free].argmax(axis=1)
+        self.active[games, slots] = True
+        self.enemy_y[games, slots] = SPAWN_Y
+        self.enemy_lane[games, slots] = self.rng.integers(0, LANES, len(games))
+
+    def step(self, actions):
+        actions = np.asarray(actions)
+        lane = self.lane
+        lane += (actions == RIGHT) & (lane < LANES - 1)
+        lane -= (actions == LEFT) & (lane > 0)
+
+        # Spawn waves, then move, drop the cars that left the screen and test
+        # collisions, in the same order as car_game.Game.update
+        self.timer += self.tick_ms
+        spawning = self.timer > self.obstacle_delay
+        if spawning.any():
+            self.timer[spawning] = 0
+            games = np.flatnonzero(spawning)
+            for _ in range(self.wave_size):
+                self.spawn(games)
+
+        active = self.active
+        enemy_y = self.enemy_y
+        np.add(enemy_y, self.speed, out=enemy_y, where=active)
+        passed = active & (enemy_y > car_game.ENEMY_DESPAWN_Y)
+        self.score += passed.sum(axis=1)
+        active &= ~passed
+
+        # Cars in different lanes never overlap, so a hit is a car in the
+        # player's lane whose center is less than a car length away
+        crashed = (active & (self.enemy_lane == lane[:, None]) & (np.abs(enemy_y - PLAYER_Y) < car_game.CAR_HEIGHT)).any(axis=1)
+        self.ticks += 1
+        dones = crashed.copy()
+        if self.max_ticks is not None:
+            dones |= self.ticks >= self.max_ticks
+        rewards = np.where(crashed, CRASH_REWARD, SURVIVE_REWARD).astype(np.float32)
+
+        info = {}
+        if dones.any():
+            info = {
+                "games": np.flatnonzero(dones),
+                "episode_ticks": self.ticks[dones].copy(),
+                "episode_scores": self.score[dones].copy(),
+                "crashed": crashed[dones],
+            }
+            self.reset_games(dones)
+        return self.observe(), rewards, dones, info
+
+    def observe(self):
+        observations = self.observations
+        observations[:] = 0
+        observations[self.rows, self.lane] = 1
+
+        active = self.active
+        enemy_y = self.enemy_y
+        # Cars still ahead of the player: gap between their bottom and the
+        # player's top
+        ahead = active & (enemy_y < PLAYER_Y)
+        gaps = np.where(ahead, np.maximum(PLAYER_TOP - (enemy_y + car_game.CAR_HEIGHT // 2), 0), car_game.HEIGHT)
+        for lane in range(LANES):
+            nearest = np.where(self.enemy_lane == lane, gaps, car_game.HEIGHT).min(axis=1)
+            observations[:, LANES + lane] = nearest / car_game.HEIGHT
+
+        # Occupancy by car center, only the part of the road above the player
+        row_height = PLAYER_TOP / GRID_ROWS
+        visible = active & (enemy_y >= 0) & (enemy_y < PLAYER_TOP)
+        games, slots = np.nonzero(visible)
+        rows = (enemy_y[games, slots] / row_height).astype(np.int64)
+        observations[games, 2 * LANES + rows * LANES + self.enemy_lane[games, slots]] = 1
+        return observations
+
+    def render(self, game=0, surface=None):
+        # Draws one of the games like car_game does and returns the surface
+        if self.road is None:
+            self.road = car_game.road_background()
+            self.sprites = car_game.CarSprites()
+        if surface is None:
+            surface = pygame.Surface((car_game.WIDTH, car_game.HEIGHT))
+        surface.blit(self.road, (0, 0))
+        half_width = car_game.CAR_WIDTH // 2
+        half_height = car_game.CAR_HEIGHT // 2
+        cars = [((self.lane_x(self.lane[game]) - half_width, PLAYER_TOP), (0, 0, 255))]
+        for slot in np.flatnonzero(self.active[game]):
+            cars.append(((self.lane_x(self.enemy_lane[game, slot]) - half_width, int(self.enemy_y[game, slot]) - half_height), (255, 0, 0)))
+        self.sprites.draw(surface, cars)
+        return surface
+
+    @staticmethod
+    def lane_x(lane):
+        return car_game.LANE_WIDTH * int(lane) + car_game.LANE_WIDTH // 2
+
+def benchmark(counts=(1, 64, 1024, 8192), steps=2000):
+    print(f"{'games':>8} {'steps/s':>14}")
+    for count in counts:
+        env = CarEnv(count, seed=0)
+        env.reset()
+        rng = np.random.default_rng(0)
+        actions = rng.integers(0, 3, (steps, count))
+        start = time.perf_counter()
+        for step in range(steps):
+            env.step(actions[step])
+        seconds = time.perf_counter() - start
+        print(f"{count:>8} {count * steps / seconds:>14,.0f}")
+
+if __name__ == "__main__":
+    benchmark(tuple(int(arg) for arg in sys.argv[1:]) or (1, 64, 1024, 8192))
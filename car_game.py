@@ -1,122 +1,144 @@
 import pygame
 import sys
-import random
 
-WIDTH, HEIGHT = 480, 640
-FPS = 60
-LANE_WIDTH = WIDTH // 3
-
-pygame.init()
-screen = pygame.display.set_mode((WIDTH, HEIGHT))
-pygame.display.set_caption("Çizimle Basit Araba Yarışı")
-clock = pygame.time.Clock()
-
-def draw_road():
-    screen.fill((50, 50, 50))
+import cores
+import engine
+
+# Oyunun kuralları cores.py'de (pygame'siz); bu modül girişi okur ve çizer
+WIDTH, HEIGHT = cores.CAR_ROAD_WIDTH, cores.CAR_ROAD_HEIGHT
+FPS = cores.TICK_RATE
+LANE_WIDTH = cores.CAR_LANE_WIDTH
+# Aynı anda ekranda olabilecek en fazla düşman araba
+MAX_ENEMIES = cores.CAR_MAX_ENEMIES
+CAR_WIDTH, CAR_HEIGHT = cores.CAR_WIDTH, cores.CAR_HEIGHT
+# Ekrandan bu kadar çıkan düşman silinir
+ENEMY_DESPAWN_Y = cores.CAR_DESPAWN_Y
+PLAYER_COLOR = (0, 0, 255)
+ENEMY_COLOR = (255, 0, 0)
+
+def draw_road(surface):
+    surface.fill((50, 50, 50))
     for i in range(1, 3):
-        pygame.draw.line(screen, (255, 255, 255), (LANE_WIDTH * i, 0), (LANE_WIDTH * i, HEIGHT), 5)
-
-class Car:
-    def __init__(self, lane, color):
-        self.lane = lane
-        self.color = color
-        self.width = 60
-        self.height = 120
-        self.x = LANE_WIDTH * lane + LANE_WIDTH // 2
-        self.y = HEIGHT - self.height - 10
-        self.rect = pygame.Rect(0,0,self.width,self.height)
-        self.update_rect()
-
-    def update_rect(self):
-        self.rect.center = (self.x, self.y)
-
-    def move_left(self):
-        if self.lane > 0:
-            self.lane -= 1
-            self.x = LANE_WIDTH * self.lane + LANE_WIDTH // 2
-            self.update_rect()
-
-    def move_right(self):
-        if self.lane < 2:
-            self.lane += 1
-            self.x = LANE_WIDTH * self.lane + LANE_WIDTH // 2
-            self.update_rect()
-
-    def draw(self, surface):
-        # Araba gövdesi
-        pygame.draw.rect(surface, self.color, self.rect, border_radius=10)
-        # Tekerlekler
-        wheel_w, wheel_h = 15, 30
-        offset_x = self.width//2 - wheel_w//2
-        offset_y = 10
-        # Sol ön tekerlek
-        pygame.draw.rect(surface, (0,0,0), (self.rect.left, self.rect.top + offset_y, wheel_w, wheel_h), border_radius=5)
-        # Sağ ön tekerlek
-        pygame.draw.rect(surface, (0,0,0), (self.rect.right - wheel_w, self.rect.top + offset_y, wheel_w, wheel_h), border_radius=5)
-        # Sol arka tekerlek
-        pygame.draw.rect(surface, (0,0,0), (self.rect.left, self.rect.bottom - offset_y - wheel_h, wheel_w, wheel_h), border_radius=5)
-        # Sağ arka tekerlek
-        pygame.draw.rect(surface, (0,0,0), (self.rect.right - wheel_w, self.rect.bottom - offset_y - wheel_h, wheel_w, wheel_h), border_radius=5)
-
-class EnemyCar(Car):
-    def __init__(self, lane, speed, color):
-        super().__init__(lane, color)
-        self.y = -120
-        self.speed = speed
-        self.update_rect()
-
-    def update(self):
-        self.y += self.speed
-        self.update_rect()
-
-def main():
-    player = Car(lane=1, color=(0,0,255))
-    enemies = []
-    obstacle_timer = 0
-    obstacle_delay = 1500
-    speed = 5
-
-    running = True
-    while running:
-        dt = clock.tick(FPS)
-
-        for event in pygame.event.get():
-            if event.type == pygame.QUIT:
-                running = False
-
-            elif event.type == pygame.KEYDOWN:
-                if event.key == pygame.K_LEFT:
-                    player.move_left()
-                elif event.key == pygame.K_RIGHT:
-                    player.move_right()
-
-        obstacle_timer += dt
-        if obstacle_timer > obstacle_delay:
-            obstacle_timer = 0
-            lane = random.randint(0,2)
-            enemy = EnemyCar(lane, speed, (255,0,0))
-            enemies.append(enemy)
-
-        # Güncelle
-        for enemy in enemies[:]:
-            enemy.update()
-            if enemy.y > HEIGHT + 100:
-                enemies.remove(enemy)
-
-        # Çarpışma kontrolü
-        for enemy in enemies:
-            if player.rect.colliderect(enemy.rect):
+        pygame.draw.line(surface, (255, 255, 255), (LANE_WIDTH * i, 0), (LANE_WIDTH * i, HEIGHT), 5)
+
+def prepare(surface):
+    # Ekranla aynı piksel formatına çevrilen yüzeyler en hızlı yoldan blit edilir
+    if pygame.display.get_surface() is None:
+        return surface
+    if surface.get_flags() & pygame.SRCALPHA:
+        return surface.convert_alpha()
+    return surface.convert()
+
+def road_background():
+    # Yol hiç değişmediği için bir kez çizilip saklanır
+    surface = pygame.Surface((WIDTH, HEIGHT))
+    draw_road(surface)
+    return prepare(surface)
+
+def draw_car(surface, rect, color):
+    # Araba gövdesi
+    pygame.draw.rect(surface, color, rect, border_radius=10)
+    # Tekerlekler
+    wheel_w, wheel_h = 15, 30
+    offset_y = 10
+    # Sol ön tekerlek
+    pygame.draw.rect(surface, (0,0,0), (rect.left, rect.top + offset_y, wheel_w, wheel_h), border_radius=5)
+    # Sağ ön tekerlek
+    pygame.draw.rect(surface, (0,0,0), (rect.right - wheel_w, rect.top + offset_y, wheel_w, wheel_h), border_radius=5)
+    # Sol arka tekerlek
+    pygame.draw.rect(surface, (0,0,0), (rect.left, rect.bottom - offset_y - wheel_h, wheel_w, wheel_h), border_radius=5)
+    # Sağ arka tekerlek
+    pygame.draw.rect(surface, (0,0,0), (rect.right - wheel_w, rect.bottom - offset_y - wheel_h, wheel_w, wheel_h), border_radius=5)
+
+class CarSprites:
+    # Her (renk, boyut) araba bir kez çizilir ve hepsi tek bir atlas yüzeyinde
+    # yan yana durur. Bütün arabalar tek bir Surface.blits çağrısıyla çizilir.
+    def __init__(self):
+        self.atlas = None
+        self.areas = {}
+
+    def add_variant(self, color, size):
+        width, height = size
+        left = self.atlas.get_width() if self.atlas is not None else 0
+        atlas = pygame.Surface((left + width, max(height, self.atlas.get_height() if self.atlas else 0)), pygame.SRCALPHA)
+        if self.atlas is not None:
+            atlas.blit(self.atlas, (0, 0))
+        draw_car(atlas, pygame.Rect(left, 0, width, height), color)
+        self.atlas = prepare(atlas)
+        area = self.areas[(color, size)] = pygame.Rect(left, 0, width, height)
+        return area
+
+    def draw(self, surface, cars):
+        # cars: (sol üst köşe, renk) çiftleri
+        areas = self.areas
+        blits = []
+        for position, color in cars:
+            area = areas.get((color, (CAR_WIDTH, CAR_HEIGHT)))
+            if area is None:
+                area = self.add_variant(color, (CAR_WIDTH, CAR_HEIGHT))
+            blits.append((self.atlas, position, area))
+        surface.blits(blits, doreturn=False)
+
+def car_topleft(lane, y):
+    # Şeridin ortasında, merkezi y olan arabanın sol üst köşesi
+    return (LANE_WIDTH * lane + LANE_WIDTH // 2 - CAR_WIDTH // 2, y - CAR_HEIGHT // 2)
+
+class Game(engine.Game):
+    size = (WIDTH, HEIGHT)
+    caption = "Çizimle Basit Araba Yarışı"
+
+    def __init__(self, obstacle_delay=1500, max_enemies=MAX_ENEMIES, wave_size=1, seed=None):
+        super().__init__(seed)
+        # Yoğun test için obstacle_delay küçültülüp max_enemies ve wave_size
+        # (her seferde çıkan araba sayısı) büyütülebilir
+        self.core = cores.CarState(obstacle_delay, max_enemies, wave_size, seed=self.seed)
+        # Bu tick basılan tuşlar
+        self.presses = []
+        # Çizim önbellekleri, ilk çizimde oluşturulur
+        self.road = None
+        self.sprites = CarSprites()
+        # Sadece arabaların eski ve yeni yerleri yeniden çizilir
+        self.dirty = engine.DirtyRects(self.size)
+
+    def handle_event(self, event):
+        if event.type == pygame.KEYDOWN:
+            if event.key == pygame.K_LEFT:
+                self.presses.append(cores.LEFT)
+            elif event.key == pygame.K_RIGHT:
+                self.presses.append(cores.RIGHT)
+
+    def update(self, dt, keys):
+        core = self.core
+        presses, self.presses = self.presses, []
+        collisions = core.collisions
+        cores.car_step(core, cores.Input(presses=presses), dt, self.profiler)
+        if core.collisions > collisions:
+            # Pencere yoksa (headless) binlerce oturum konsolu doldurmasın
+            if pygame.display.get_surface() is not None:
                 print("Çarpışma! Oyun bitti.")
-                running = False
+        if not core.running:
+            self.running = False
 
-        # Çizimler
-        draw_road()
-        player.draw(screen)
-        for enemy in enemies:
-            enemy.draw(screen)
+    def stats(self):
+        return {"score": self.core.score, "collisions": self.core.collisions}
 
-        pygame.display.update()
+    def draw(self, surface):
+        # Çizimler
+        if self.road is None:
+            self.road = road_background()
+        core = self.core
+        cars = [(car_topleft(core.lane, cores.CAR_PLAYER_Y), PLAYER_COLOR)]
+        cars.extend((car_topleft(lane, y), ENEMY_COLOR) for lane, y in core.enemies.positions())
+        self.dirty.track_group("cars", [(position, (CAR_WIDTH, CAR_HEIGHT)) for position, _ in cars])
+        rects = self.dirty.collect()
+        # Değişen yerlerde yolu geri koy, sonra bütün arabaları çiz
+        for rect in rects:
+            surface.blit(self.road, rect, rect)
+        self.sprites.draw(surface, cars)
+        return rects
 
+def main():
+    engine.run(Game())
     pygame.quit()
     sys.exit()
 
@@ -0,0 +1,125 @@
+import heapq
+import threading
+from collections import deque
+
+# Background chunk loading for fakemc. The main loop says which chunks it
+# wants and how urgently (lower priority first, e.g. distance to the player);
+# worker threads build the most urgent ones and queue the results, which the
+# main loop picks up with collect() between ticks. Only the main thread ever
+# touches the world, the workers only see their arguments.
+#
+#   prepare(key) runs on the main thread when a key is queued and returns
+#   whatever the worker needs (e.g. saved block data)
+#   build(key, prepared) runs on a worker and returns the result
+#
+# The request queue is bounded: each request() replaces the pending requests
+# with the `capacity` most urgent ones, so chunks the player has moved away
+# from are dropped instead of piling up.
+
+class ChunkLoader:
+    def __init__(self, build, prepare=None, workers=1, capacity=64):
+        self.build = build
+        self.prepare = prepare
+        self.capacity = capacity
+        self.condition = threading.Condition()
+        # key -> (priority, prepared) for requests not taken by a worker yet
+        self.pending = {}
+        self.heap = []
+        self.in_flight = set()
+        # Keys with a result waiting in self.results
+        self.ready = set()
+        # Keys whose result must be thrown away, see cancel()
+        self.cancelled = set()
+        self.results = deque()
+        self.closed = False
+        self.built = 0
+        self.dropped = 0
+        self.threads = [threading.Thread(target=self.work, name=f"chunk-loader-{i}", daemon=True) for i in range(workers)]
+        for thread in self.threads:
+            thread.start()
+
+    def __contains__(self, key):
+        with self.condition:
+            return key in self.pending or key in self.in_flight or key in self.ready
+
+    def request(self, requests):
+        # requests: (priority, key) pairs for the chunks wanted right now
+        with self.condition:
+            busy = self.in_flight | self.ready
+            wanted = heapq.nsmallest(self.capacity, (request for request in requests if request[1] not in busy))
+            pending = {}
+            for priority, key in wanted:
+                entry = self.pending.get(key)
+                if entry is None:
+                    prepared = self.prepare(key) if self.prepare is not None else None
+                else:
+                    prepared = entry[1]
+                pending[key] = (priority, prepared)
+            self.dropped += sum(1 for key in self.pending if key not in pending)
+            self.pending = pending
+            self.heap = [(priority, key) for priority, key in wanted]
+            heapq.heapify(self.heap)
+            self.condition.notify_all()
+
+    def cancel(self, key):
+        # The main loop loaded the chunk itself, so a queued, running or
+        # finished build of it is stale
+        with self.condition:
+            if self.pending.pop(key, None) is None and (key in self.in_flight or key in self.ready):
+                self.cancelled.add(key)
+
+    def work(self):
+        while True:
+            with self.condition:
+                while not self.heap and not self.closed:
+                    self.condition.wait()
+                if self.closed:
+                    return
+                priority, key = heapq.heappop(self.heap)
+                entry = self.pending.pop(key, None)
+                if entry is None:
+                    # Cancelled after the heap was built
+                    continue
+                self.in_flight.add(key)
+            try:
+                result = (key, self.build(key, entry[1]), None)
+            except Exception as error:
+                result = (key, None, error)
+            with self.condition:
+                self.results.append(result)
+                self.in_flight.discard(key)
+                self.ready.add(key)
+                self.built += 1
+
+    def collect(self, limit=None):
+        # Finished (key, result) pairs, at most `limit` of them. Errors raised
+        # by build are raised here, on the main thread.
+        collected = []
+        while self.results and (limit is None or len(collected) < limit):
+            with self.condition:
+                key, result, error = self.results.popleft()
+                self.ready.discard(key)
+                if key in self.cancelled:
+                    self.cancelled.discard(key)
+                    continue
+            if error is not None:
+                raise error
+            collected.append((key, result))
+        return collected
+
+    def close(self):
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+        for thread in self.threads:
+            thread.join()
+
+    def stats(self):
+        with self.condition:
+            return {
+                "pending": len(self.pending),
+                "in_flight": len(self.in_flight),
+                "ready": len(self.results),
+                "built": self.built,
+                "dropped": self.dropped,
+            }
@@ -0,0 +1,606 @@
+import os
+
+import pygame
+
+import engine
+import levels
+import sweep
+from pool import EntityPool
+from spatial import SpatialHash
+
+# The rules of car_game, fakemario and fakesonic as the games ran them before
+# cores.py: pygame.Rect and sprite state, keys read in update, enemy cars in
+# NumPy arrays when available. Drawing and its caches are left out.
+#
+# This is the baseline cores.py is measured against:
+#
+#   python cores.py --check      the cores reproduce these games tick by tick
+#   python cores.py              core steps/s against these pygame-bound loops
+#
+# Only change the rules here together with a deliberate rule change in
+# cores.py, never to make a check pass.
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+LEVEL_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "levels")
+
+# car_game
+
+WIDTH, HEIGHT = 480, 640
+LANE_WIDTH = WIDTH // 3
+MAX_ENEMIES = 64
+CAR_WIDTH, CAR_HEIGHT = 60, 120
+ENEMY_DESPAWN_Y = HEIGHT + 100
+
+class Car:
+    def __init__(self, lane, color):
+        self.lane = lane
+        self.color = color
+        self.width = CAR_WIDTH
+        self.height = CAR_HEIGHT
+        self.x = LANE_WIDTH * lane + LANE_WIDTH // 2
+        self.y = HEIGHT - self.height - 10
+        self.rect = pygame.Rect(0, 0, self.width, self.height)
+        self.update_rect()
+
+    def update_rect(self):
+        self.rect.center = (self.x, self.y)
+
+    def move_left(self):
+        if self.lane > 0:
+            self.lane -= 1
+            self.x = LANE_WIDTH * self.lane + LANE_WIDTH // 2
+            self.update_rect()
+
+    def move_right(self):
+        if self.lane < 2:
+            self.lane += 1
+            self.x = LANE_WIDTH * self.lane + LANE_WIDTH // 2
+            self.update_rect()
+
+class EnemyCar(Car):
+    def __init__(self, lane, speed, color):
+        super().__init__(lane, color)
+        self.y = -120
+        self.speed = speed
+        self.update_rect()
+
+    def respawn(self, lane, speed, color):
+        self.lane = lane
+        self.color = color
+        self.x = LANE_WIDTH * lane + LANE_WIDTH // 2
+        self.y = -120
+        self.speed = speed
+        self.update_rect()
+
+    def update(self):
+        self.y += self.speed
+        self.update_rect()
+
+class PooledEnemies:
+    def __init__(self, capacity):
+        self.pool = EntityPool(lambda: EnemyCar(1, 0, (0, 0, 0)), EnemyCar.respawn, capacity)
+
+    def spawn(self, lane, speed, color):
+        return self.pool.acquire(lane, speed, color) is not None
+
+    def update(self):
+        passed = 0
+        for enemy in self.pool:
+            enemy.update()
+            if enemy.y > ENEMY_DESPAWN_Y:
+                self.pool.release(enemy)
+                passed += 1
+        return passed
+
+    def collides(self, rect):
+        for enemy in self.pool:
+            if rect.colliderect(enemy.rect):
+                return True
+        return False
+
+    def positions(self):
+        return [(enemy.lane, enemy.y) for enemy in self.pool]
+
+class EnemyBatch:
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.count = 0
+        self.lane = np.zeros(capacity, dtype=np.int32)
+        self.x = np.zeros(capacity, dtype=np.int32)
+        self.y = np.zeros(capacity, dtype=np.int32)
+        self.speed = np.zeros(capacity, dtype=np.int32)
+        self.color = np.zeros((capacity, 3), dtype=np.uint8)
+
+    def spawn(self, lane, speed, color):
+        if self.count >= self.capacity:
+            return False
+        i = self.count
+        self.lane[i] = lane
+        self.x[i] = LANE_WIDTH * lane + LANE_WIDTH // 2
+        self.y[i] = -120
+        self.speed[i] = speed
+        self.color[i] = color
+        self.count += 1
+        return True
+
+    def update(self):
+        n = self.count
+        y = self.y[:n]
+        y += self.speed[:n]
+        keep = y <= ENEMY_DESPAWN_Y
+        kept = int(np.count_nonzero(keep))
+        if kept < n:
+            for array in (self.lane, self.x, self.y, self.speed, self.color):
+                array[:kept] = array[:n][keep]
+            self.count = kept
+        return n - kept
+
+    def collides(self, rect):
+        n = self.count
+        left = self.x[:n] - CAR_WIDTH // 2
+        top = self.y[:n] - CAR_HEIGHT // 2
+        hit = (left < rect.right) & (left + CAR_WIDTH > rect.left) & (top < rect.bottom) & (top + CAR_HEIGHT > rect.top)
+        return bool(hit.any())
+
+    def positions(self):
+        n = self.count
+        return list(zip(self.lane[:n].tolist(), self.y[:n].tolist()))
+
+class CarGame(engine.Game):
+    def __init__(self, obstacle_delay=1500, max_enemies=MAX_ENEMIES, wave_size=1, seed=None):
+        super().__init__(seed)
+        self.player = Car(lane=1, color=(0, 0, 255))
+        self.enemies = EnemyBatch(max_enemies) if np is not None else PooledEnemies(max_enemies)
+        self.obstacle_timer = 0
+        self.obstacle_delay = obstacle_delay
+        self.wave_size = wave_size
+        self.speed = 5
+        self.score = 0
+        self.collisions = 0
+
+    def handle_event(self, event):
+        if event.type == pygame.KEYDOWN:
+            if event.key == pygame.K_LEFT:
+                self.player.move_left()
+            elif event.key == pygame.K_RIGHT:
+                self.player.move_right()
+
+    def update(self, dt, keys):
+        self.obstacle_timer += dt * 1000
+        if self.obstacle_timer > self.obstacle_delay:
+            self.obstacle_timer = 0
+            for _ in range(self.wave_size):
+                lane = self.rng.randint(0, 2)
+                self.enemies.spawn(lane, self.speed, (255, 0, 0))
+
+        self.score += self.enemies.update()
+
+        if self.enemies.collides(self.player.rect):
+            self.collisions += 1
+            self.running = False
+
+    def snapshot(self):
+        # Same layout as cores.car_snapshot
+        return (self.player.lane, sorted(self.enemies.positions()), self.obstacle_timer, self.score, self.collisions, self.running)
+
+# fakemario
+
+MARIO_LEVEL_FILE = os.path.join(LEVEL_DIR, "mario_1.json")
+MARIO_VIEW_WIDTH = 800
+GRAVITY = 0.6
+PLAYER_SPEED = 5
+JUMP_POWER = 14
+
+class Player(pygame.sprite.Sprite):
+    def __init__(self, x, y):
+        super().__init__()
+        self.width = 32
+        self.height = 48
+        self.image = pygame.Surface((self.width, self.height))
+        self.rect = self.image.get_rect()
+        self.rect.topleft = (x, y)
+        self.vel_y = 0
+        self.on_ground = False
+        self.score = 0
+
+    def update(self, platforms, keys):
+        dx = 0
+        if keys[pygame.K_LEFT] or keys[pygame.K_a]:
+            dx = -PLAYER_SPEED
+        if keys[pygame.K_RIGHT] or keys[pygame.K_d]:
+            dx = PLAYER_SPEED
+
+        self.vel_y += GRAVITY
+        if self.vel_y > 15:
+            self.vel_y = 15
+        dy = self.vel_y
+
+        self.move(dx, 0, platforms)
+        self.on_ground = False
+        self.move(0, dy, platforms)
+
+    def move(self, dx, dy, platforms):
+        start = self.rect.copy()
+        self.rect.x += dx
+        self.rect.y += dy
+        moved_x, moved_y = self.rect.x - start.x, self.rect.y - start.y
+        candidates = platforms.query(sweep.swept_bounds(start, moved_x, moved_y))
+        hit = sweep.first_hit(start, moved_x, moved_y, candidates, key=platform_rect)
+        if hit is not None:
+            self.rect.topleft = start.topleft
+            self.hit_platform(hit[2], dx, dy)
+        for platform in platforms.query(self.rect):
+            if self.rect.colliderect(platform.rect):
+                self.hit_platform(platform, dx, dy)
+
+    def hit_platform(self, platform, dx, dy):
+        if dy > 0:
+            self.rect.bottom = platform.rect.top
+            self.vel_y = 0
+            self.on_ground = True
+        elif dy < 0:
+            self.rect.top = platform.rect.bottom
+            self.vel_y = 0
+        if dx > 0:
+            self.rect.right = platform.rect.left
+        elif dx < 0:
+            self.rect.left = platform.rect.right
+
+    def jump(self):
+        if self.on_ground:
+            self.vel_y = -JUMP_POWER
+
+def platform_rect(platform):
+    return platform.rect
+
+class Platform(pygame.sprite.Sprite):
+    def __init__(self, x, y, width, height=20):
+        super().__init__()
+        self.image = pygame.Surface((width, height))
+        self.rect = self.image.get_rect()
+        self.rect.topleft = (x, y)
+
+class Enemy(pygame.sprite.Sprite):
+    def __init__(self, x, y, patrol_width):
+        super().__init__()
+        self.width = 32
+        self.height = 32
+        self.image = pygame.Surface((self.width, self.height))
+        self.rect = self.image.get_rect()
+        self.rect.topleft = (x, y)
+        self.start_x = x
+        self.patrol_width = patrol_width
+        self.speed = 2
+
+    def update(self):
+        self.rect.x += self.speed
+        if self.rect.x > self.start_x + self.patrol_width:
+            self.speed = -self.speed
+        if self.rect.x < self.start_x:
+            self.speed = -self.speed
+
+class Coin(pygame.sprite.Sprite):
+    def __init__(self, x, y):
+        super().__init__()
+        self.radius = 10
+        self.image = pygame.Surface((self.radius * 2, self.radius * 2), pygame.SRCALPHA)
+        self.rect = self.image.get_rect()
+        self.rect.center = (x, y)
+
+class MarioGame(engine.Game):
+    def __init__(self, level_file=MARIO_LEVEL_FILE, seed=None):
+        super().__init__(seed)
+        self.level = levels.LevelStream(level_file, MARIO_VIEW_WIDTH)
+        self.spawn = tuple(self.level.metadata["spawn"])
+        # The camera follows the player like cores.mario_camera_x; the
+        # pre-core game never scrolled, so its level never streamed
+        self.camera_x = max(0, self.spawn[0] - MARIO_VIEW_WIDTH // 2)
+        self.player = Player(*self.spawn)
+        self.platforms = pygame.sprite.Group()
+        self.platform_index = SpatialHash()
+        self.enemies = pygame.sprite.Group()
+        self.coins = pygame.sprite.Group()
+        self.coin_index = SpatialHash()
+        self.segment_sprites = {}
+        self.collected = set()
+        self.collisions = 0
+        self.stream_level()
+
+    def load_segment(self, segment, records):
+        sprites = []
+        for number, (kind, x, y, width, height, extra) in enumerate(records):
+            if (segment, number) in self.collected:
+                continue
+            if kind == levels.PLATFORM:
+                sprite = Platform(x, y, width, height)
+                self.platforms.add(sprite)
+                self.platform_index.insert(sprite, sprite.rect)
+            elif kind == levels.ENEMY:
+                sprite = Enemy(x, y, extra)
+                self.enemies.add(sprite)
+            elif kind == levels.COIN:
+                sprite = Coin(x + width // 2, y + height // 2)
+                sprite.key = (segment, number)
+                self.coins.add(sprite)
+                self.coin_index.insert(sprite, sprite.rect)
+            else:
+                continue
+            sprites.append(sprite)
+        self.segment_sprites[segment] = sprites
+
+    def unload_segment(self, segment):
+        for sprite in self.segment_sprites.pop(segment, ()):
+            sprite.kill()
+            self.platform_index.remove(sprite)
+            self.coin_index.remove(sprite)
+
+    def stream_level(self):
+        loaded, unloaded = self.level.update(self.camera_x)
+        for segment, records in unloaded:
+            self.unload_segment(segment)
+        for segment, records in loaded:
+            self.load_segment(segment, records)
+
+    def handle_event(self, event):
+        if event.type == pygame.KEYDOWN:
+            if event.key == pygame.K_SPACE or event.key == pygame.K_w or event.key == pygame.K_UP:
+                self.player.jump()
+
+    def update(self, dt, keys):
+        player = self.player
+        player.update(self.platform_index, keys)
+        self.enemies.update()
+
+        coin_hit = pygame.sprite.spritecollideany(player, self.coin_index.query(player.rect))
+        if coin_hit:
+            player.score += 1
+            self.coins.remove(coin_hit)
+            self.coin_index.remove(coin_hit)
+            self.collected.add(coin_hit.key)
+
+        if pygame.sprite.spritecollideany(player, self.enemies):
+            player.rect.topleft = self.spawn
+            player.score = 0
+            self.collisions += 1
+
+        self.camera_x = max(0, player.rect.x - MARIO_VIEW_WIDTH // 2)
+        self.stream_level()
+
+    def close(self):
+        self.level.close()
+
+    def snapshot(self):
+        # Same layout as cores.mario_snapshot
+        player = self.player
+        enemies = [(enemy.rect.x, enemy.rect.y, enemy.speed) for enemy in self.enemies]
+        coins = [tuple(coin.rect) for coin, cells in self.coin_index.objects.values()]
+        return (tuple(player.rect), player.vel_y, player.on_ground, player.score, enemies, coins, sorted(self.collected), self.collisions)
+
+# fakesonic
+
+SONIC_LEVEL_FILE = os.path.join(LEVEL_DIR, "sonic_1.json")
+SONIC_VIEW_WIDTH = 800
+acceleration = 0.5
+max_speed = 8
+friction = 0.3
+jump_power = -12
+gravity = 0.6
+GAME_OVER_TICKS = 120
+MAX_FIREBALLS = 32
+
+class SonicGame(engine.Game):
+    def __init__(self, level_file=SONIC_LEVEL_FILE, seed=None):
+        super().__init__(seed)
+        self.ticks = 0
+        self.level = levels.LevelStream(level_file, SONIC_VIEW_WIDTH)
+        metadata = self.level.metadata
+        self.spawn = tuple(metadata["spawn"])
+        self.boss_arena_x = metadata["boss_arena_x"]
+        self.camera_x = self.spawn[0] - SONIC_VIEW_WIDTH // 2
+
+        self.player = pygame.Rect(self.spawn[0], self.spawn[1], 40, 40)
+        self.vel_x = 0
+        self.vel_y = 0
+        self.on_ground = False
+        self.lives = 3
+        self.score = 0
+        self.enemies = []
+
+        self.platform_index = SpatialHash()
+        self.ring_index = SpatialHash()
+        self.enemy_index = SpatialHash()
+        self.fireball_index = SpatialHash()
+
+        self.segment_objects = {}
+        self.ring_keys = {}
+        self.collected = set()
+        self.boss = None
+
+        scatter = metadata.get("ring_scatter")
+        if scatter:
+            size = scatter["size"]
+            for _ in range(scatter["count"]):
+                ring = pygame.Rect(self.rng.randint(*scatter["x"]), self.rng.randint(*scatter["y"]), size, size)
+                self.ring_index.insert(ring, ring)
+
+        self.stream_level()
+        self.boss_alive = True
+        self.boss_health = 3
+        self.boss_fireballs = EntityPool(lambda: pygame.Rect(0, 0, 15, 15), pygame.Rect.update, MAX_FIREBALLS)
+        self.boss_timer = 0
+        self.fight_started = False
+        self.win = False
+        self.game_over_timer = 0
+
+    def load_segment(self, segment, records):
+        objects = []
+        for number, (kind, x, y, width, height, extra) in enumerate(records):
+            key = (segment, number)
+            if key in self.collected:
+                continue
+            rect = pygame.Rect(x, y, width, height)
+            if kind == levels.PLATFORM:
+                self.platform_index.insert(rect, rect)
+            elif kind == levels.RING:
+                self.ring_index.insert(rect, rect)
+                self.ring_keys[id(rect)] = key
+            elif kind == levels.ENEMY:
+                self.enemies.append(rect)
+                self.enemy_index.insert(rect, rect)
+            elif kind == levels.BOSS:
+                if self.boss is None:
+                    self.boss = rect
+                continue
+            objects.append((kind, rect))
+        self.segment_objects[segment] = objects
+
+    def unload_segment(self, segment):
+        removed = set()
+        for kind, rect in self.segment_objects.pop(segment, ()):
+            if kind == levels.PLATFORM:
+                self.platform_index.remove(rect)
+            elif kind == levels.RING:
+                if id(rect) in self.ring_keys:
+                    self.ring_index.remove(rect)
+                    del self.ring_keys[id(rect)]
+            elif kind == levels.ENEMY:
+                self.enemy_index.remove(rect)
+                removed.add(id(rect))
+        if removed:
+            self.enemies = [enemy for enemy in self.enemies if id(enemy) not in removed]
+
+    def stream_level(self):
+        loaded, unloaded = self.level.update(self.camera_x)
+        for segment, records in unloaded:
+            self.unload_segment(segment)
+        for segment, records in loaded:
+            self.load_segment(segment, records)
+
+    def reset_player(self):
+        self.player.x, self.player.y = self.spawn
+        self.vel_x = self.vel_y = 0
+
+    def update(self, dt, keys):
+        self.ticks += 1
+        player = self.player
+
+        if self.lives <= 0:
+            self.game_over_timer += 1
+            if self.game_over_timer >= GAME_OVER_TICKS:
+                self.running = False
+            return
+
+        if keys[pygame.K_RIGHT]: self.vel_x += acceleration
+        elif keys[pygame.K_LEFT]: self.vel_x -= acceleration
+        else:
+            self.vel_x -= friction if self.vel_x > 0 else -friction if self.vel_x < 0 else 0
+
+        self.vel_x = max(-max_speed, min(max_speed, self.vel_x))
+
+        if keys[pygame.K_SPACE] and self.on_ground:
+            self.vel_y = jump_power
+
+        self.vel_y += gravity
+        start = player.copy()
+        player.x += self.vel_x
+        player.y += self.vel_y
+        self.on_ground = False
+
+        dx, dy = player.x - start.x, player.y - start.y
+        if dy > 0:
+            candidates = self.platform_index.query(sweep.swept_bounds(start, dx, dy))
+            hit = sweep.first_hit(start, dx, dy, candidates, one_way=True)
+            if hit is not None:
+                player.bottom = hit[2].top
+                self.vel_y = 0
+                self.on_ground = True
+        for plat in self.platform_index.query(player):
+            if player.colliderect(plat):
+                if self.vel_y > 0 and player.bottom <= plat.bottom:
+                    player.bottom = plat.top
+                    self.vel_y = 0
+                    self.on_ground = True
+
+        self.camera_x = player.x - SONIC_VIEW_WIDTH // 2
+
+        for ring in self.ring_index.query(player):
+            if player.colliderect(ring):
+                self.ring_index.remove(ring)
+                key = self.ring_keys.pop(id(ring), None)
+                if key is not None:
+                    self.collected.add(key)
+                self.score += 1
+
+        step = 2 if self.ticks // 30 % 2 == 0 else -2
+        for enemy in self.enemies:
+            enemy.x += step
+            self.enemy_index.move(enemy, enemy)
+        for enemy in self.enemy_index.query(player):
+            if player.colliderect(enemy):
+                self.lives -= 1
+                self.reset_player()
+
+        if player.y > 1000:
+            self.lives -= 1
+            self.reset_player()
+
+        if player.x >= self.boss_arena_x:
+            self.fight_started = True
+        if self.fight_started and self.boss_alive and self.boss is not None:
+            self.update_boss()
+
+        self.stream_level()
+
+    def update_boss(self):
+        player = self.player
+        boss = self.boss
+        self.boss_timer += 1
+        boss.x += 2 if self.boss_timer // 60 % 2 == 0 else -2
+
+        if self.boss_timer % 90 == 0:
+            fireball = self.boss_fireballs.acquire(boss.centerx, boss.centery, 15, 15)
+            if fireball is not None:
+                self.fireball_index.insert(fireball, fireball)
+
+        for fireball in self.boss_fireballs:
+            fireball.x -= 6
+            if fireball.x < player.x - 500:
+                self.boss_fireballs.release(fireball)
+                self.fireball_index.remove(fireball)
+            else:
+                self.fireball_index.move(fireball, fireball)
+
+        for fireball in self.fireball_index.query(player):
+            if fireball.colliderect(player):
+                self.boss_fireballs.release(fireball)
+                self.fireball_index.remove(fireball)
+                self.lives -= 1
+                self.reset_player()
+
+        if player.colliderect(boss) and self.vel_y > 0:
+            self.vel_y = jump_power
+            self.boss_health -= 1
+            if self.boss_health <= 0:
+                self.boss_alive = False
+                self.win = True
+
+    def close(self):
+        self.level.close()
+
+    def snapshot(self):
+        # Same layout as cores.sonic_snapshot
+        boss = tuple(self.boss) if self.boss is not None else None
+        return (tuple(self.player), self.vel_x, self.vel_y, self.on_ground, self.lives, self.score, self.camera_x,
+                [tuple(enemy) for enemy in self.enemies], len(self.ring_index), sorted(self.collected),
+                boss, self.boss_health, [tuple(fireball) for fireball in self.boss_fireballs], self.win, self.running)
+
+# Game module -> reference game
+GAMES = {
+    "car_game": CarGame,
+    "fakemario": MarioGame,
+    "fakesonic": SonicGame,
+}
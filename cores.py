@@ -0,0 +1,932 @@
+import argparse
+import os
+import random
+import sys
+import time
+
+import levels
+import sweep
+from pool import EntityPool
+from profiler import NULL_PROFILER
+from spatial import SpatialHash
+
+# With NumPy the enemy cars are updated as a batch, otherwise one by one
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Game rules of car_game, fakemario and fakesonic without pygame. Each game
+# is a state object and a step function:
+#
+#   state = CarState(seed=1)
+#   car_step(state, Input(presses=(LEFT,)))
+#
+# The step functions only read the Input snapshot they are given, so the
+# rules run anywhere plain Python does: no SDL, no display, no event queue.
+# They time their parts (enemies, collisions, streaming, ...) in the profiler
+# they are passed, NULL_PROFILER by default.
+# The game modules are the pygame side: their Game classes turn key state
+# and key events into an Input, step the state and draw it.
+#
+#   python cores.py                 steps/s of the cores and of the pygame-bound games
+#   python cores.py --check         compare the cores with those games tick by tick
+#
+# Positions are integers rounded like pygame.Rect rounds them.
+
+TICK_RATE = 60
+DT = 1 / TICK_RATE
+
+LEVEL_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "levels")
+
+# Input actions
+LEFT, RIGHT, JUMP = 1, 2, 3
+
+class Input:
+    # Held directions and jump, and the actions pressed during the tick in
+    # the order they were pressed
+    __slots__ = ("left", "right", "jump", "presses")
+
+    def __init__(self, left=False, right=False, jump=False, presses=()):
+        self.left = left
+        self.right = right
+        self.jump = jump
+        self.presses = presses
+
+NO_INPUT = Input()
+
+def to_int(value):
+    # pygame.Rect rounds coordinates half away from zero
+    if value >= 0:
+        return int(value + 0.5)
+    return -int(0.5 - value)
+
+class Box:
+    # Axis aligned box with the parts of pygame.Rect the rules use. Iterates
+    # and indexes as (x, y, width, height), which is what SpatialHash, SortedXIndex
+    # and sweep expect.
+    __slots__ = ("x", "y", "width", "height")
+
+    def __init__(self, x=0, y=0, width=0, height=0):
+        self.x = x
+        self.y = y
+        self.width = width
+        self.height = height
+
+    def __iter__(self):
+        return iter((self.x, self.y, self.width, self.height))
+
+    def __getitem__(self, index):
+        return (self.x, self.y, self.width, self.height)[index]
+
+    def __repr__(self):
+        return f"Box({self.x}, {self.y}, {self.width}, {self.height})"
+
+    def update(self, x, y, width, height):
+        self.x = x
+        self.y = y
+        self.width = width
+        self.height = height
+
+    def copy(self):
+        return Box(self.x, self.y, self.width, self.height)
+
+    @property
+    def left(self):
+        return self.x
+
+    @property
+    def top(self):
+        return self.y
+
+    @property
+    def right(self):
+        return self.x + self.width
+
+    @property
+    def bottom(self):
+        return self.y + self.height
+
+    def overlaps(self, other):
+        return self.x < other.x + other.width and other.x < self.x + self.width and self.y < other.y + other.height and other.y < self.y + self.height
+
+# car_game
+
+CAR_ROAD_WIDTH, CAR_ROAD_HEIGHT = 480, 640
+CAR_LANES = 3
+CAR_LANE_WIDTH = CAR_ROAD_WIDTH // CAR_LANES
+CAR_WIDTH, CAR_HEIGHT = 60, 120
+# Car centers: the player drives at a fixed height, enemies come from above
+# the road and are dropped this far below it
+CAR_PLAYER_Y = CAR_ROAD_HEIGHT - CAR_HEIGHT - 10
+CAR_SPAWN_Y = -120
+CAR_DESPAWN_Y = CAR_ROAD_HEIGHT + 100
+# Most enemy cars on the road at the same time
+CAR_MAX_ENEMIES = 64
+CAR_SPEED = 5
+
+class CarEnemy:
+    __slots__ = ("lane", "y", "speed")
+
+    def __init__(self, lane, y, speed):
+        self.reset(lane, y, speed)
+
+    def reset(self, lane, y, speed):
+        self.lane = lane
+        self.y = y
+        self.speed = speed
+
+class CarEnemyPool:
+    # Enemies as objects; the pool is walked backwards so releasing during
+    # the loop is safe
+    def __init__(self, capacity):
+        self.pool = EntityPool(lambda: CarEnemy(0, 0, 0), CarEnemy.reset, capacity)
+
+    def __len__(self):
+        return len(self.pool)
+
+    def spawn(self, lane, speed):
+        return self.pool.acquire(lane, CAR_SPAWN_Y, speed) is not None
+
+    def update(self):
+        # Returns the number of cars that left the road (were passed)
+        passed = 0
+        for enemy in self.pool:
+            enemy.y += enemy.speed
+            if enemy.y > CAR_DESPAWN_Y:
+                self.pool.release(enemy)
+                passed += 1
+        return passed
+
+    def hits(self, lane):
+        for enemy in self.pool:
+            if enemy.lane == lane and abs(enemy.y - CAR_PLAYER_Y) < CAR_HEIGHT:
+                return True
+        return False
+
+    def positions(self):
+        return [(enemy.lane, enemy.y) for enemy in self.pool]
+
+    def stats(self):
+        return self.pool.stats()
+
+class CarEnemyBatch:
+    # All enemies in arrays (structure of arrays): moving them and testing
+    # them against the player are single vector operations. Live enemies are
+    # the first `count` elements.
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.count = 0
+        self.lane = np.zeros(capacity, dtype=np.int32)
+        self.y = np.zeros(capacity, dtype=np.int32)
+        self.speed = np.zeros(capacity, dtype=np.int32)
+        self.spawned = 0
+        self.peak = 0
+
+    def __len__(self):
+        return self.count
+
+    def spawn(self, lane, speed):
+        if self.count >= self.capacity:
+            return False
+        i = self.count
+        self.lane[i] = lane
+        self.y[i] = CAR_SPAWN_Y
+        self.speed[i] = speed
+        self.count += 1
+        self.spawned += 1
+        self.peak = max(self.peak, self.count)
+        return True
+
+    def update(self):
+        n = self.count
+        y = self.y[:n]
+        y += self.speed[:n]
+        keep = y <= CAR_DESPAWN_Y
+        kept = int(np.count_nonzero(keep))
+        if kept < n:
+            # Drop the cars that left the road, keep the rest in order at the front
+            for array in (self.lane, self.y, self.speed):
+                array[:kept] = array[:n][keep]
+            self.count = kept
+        return n - kept
+
+    def hits(self, lane):
+        n = self.count
+        return bool(((self.lane[:n] == lane) & (np.abs(self.y[:n] - CAR_PLAYER_Y) < CAR_HEIGHT)).any())
+
+    def positions(self):
+        n = self.count
+        return list(zip(self.lane[:n].tolist(), self.y[:n].tolist()))
+
+    def stats(self):
+        return {
+            "live": self.count,
+            "peak": self.peak,
+            "spawned": self.spawned,
+            "capacity": self.capacity,
+        }
+
+class CarState:
+    __slots__ = ("lane", "enemies", "timer", "obstacle_delay", "wave_size", "speed",
+                 "score", "collisions", "running", "rng")
+
+    def __init__(self, obstacle_delay=1500, max_enemies=CAR_MAX_ENEMIES, wave_size=1, seed=None):
+        self.lane = 1
+        # For stress tests obstacle_delay can be lowered and max_enemies and
+        # wave_size (cars per spawn) raised
+        self.enemies = CarEnemyBatch(max_enemies) if np is not None else CarEnemyPool(max_enemies)
+        self.timer = 0
+        self.obstacle_delay = obstacle_delay
+        self.wave_size = wave_size
+        self.speed = CAR_SPEED
+        # Cars passed and collisions
+        self.score = 0
+        self.collisions = 0
+        self.running = True
+        self.rng = random.Random(seed)
+
+def car_step(state, inputs, dt=DT, profiler=NULL_PROFILER):
+    for press in inputs.presses:
+        if press == LEFT and state.lane > 0:
+            state.lane -= 1
+        elif press == RIGHT and state.lane < CAR_LANES - 1:
+            state.lane += 1
+
+    # dt is in seconds, the timer in milliseconds
+    state.timer += dt * 1000
+    if state.timer > state.obstacle_delay:
+        state.timer = 0
+        for _ in range(state.wave_size):
+            lane = state.rng.randint(0, CAR_LANES - 1)
+            state.enemies.spawn(lane, state.speed)
+
+    with profiler.section("enemies"):
+        state.score += state.enemies.update()
+    # Cars in different lanes never overlap, so a hit is an enemy in the
+    # player's lane whose center is less than a car length away
+    with profiler.section("collisions"):
+        if state.enemies.hits(state.lane):
+            state.collisions += 1
+            state.running = False
+
+# fakemario
+
+MARIO_LEVEL_FILE = os.path.join(LEVEL_DIR, "mario_1.json")
+# Width of the view; the camera keeps the player in its middle, but does not
+# scroll left of the level's start
+MARIO_VIEW_WIDTH = 800
+MARIO_GRAVITY = 0.6
+MARIO_SPEED = 5
+MARIO_JUMP_POWER = 14
+MARIO_MAX_FALL = 15
+MARIO_PLAYER_SIZE = (32, 48)
+MARIO_ENEMY_SIZE = (32, 32)
+MARIO_COIN_RADIUS = 10
+
+class MarioPlayer:
+    __slots__ = ("box", "vel_y", "on_ground", "score")
+
+    def __init__(self, x, y):
+        self.box = Box(x, y, *MARIO_PLAYER_SIZE)
+        self.vel_y = 0
+        self.on_ground = False
+        self.score = 0
+
+class MarioEnemy:
+    __slots__ = ("box", "start_x", "patrol_width", "speed")
+
+    def __init__(self, x, y, patrol_width):
+        self.box = Box(x, y, *MARIO_ENEMY_SIZE)
+        self.start_x = x
+        self.patrol_width = patrol_width
+        self.speed = 2
+
+class MarioCoin:
+    __slots__ = ("box", "key")
+
+    def __init__(self, center_x, center_y, key):
+        radius = MARIO_COIN_RADIUS
+        self.box = Box(center_x - radius, center_y - radius, radius * 2, radius * 2)
+        self.key = key
+
+class MarioState:
+    __slots__ = ("level", "spawn", "camera_x", "player", "platform_index", "enemies", "coin_index",
+                 "segment_objects", "collected", "collisions", "running")
+
+    def __init__(self, level_file=MARIO_LEVEL_FILE):
+        # Level objects are streamed in by segment around the camera
+        self.level = levels.LevelStream(level_file, MARIO_VIEW_WIDTH)
+        self.spawn = tuple(self.level.metadata["spawn"])
+        self.camera_x = mario_camera_x(self.spawn[0])
+        self.player = MarioPlayer(*self.spawn)
+        # Platforms never move, so they are bucketed once when loaded.
+        # Platforms are indexed as their Box, coins as the coin.
+        self.platform_index = SpatialHash()
+        self.enemies = []
+        self.coin_index = SpatialHash()
+        # Objects of each loaded segment, and coins that were already picked up
+        self.segment_objects = {}
+        self.collected = set()
+        self.collisions = 0
+        self.running = True
+        mario_stream(self)
+
+    def close(self):
+        self.level.close()
+
+def mario_camera_x(player_x):
+    return max(0, player_x - MARIO_VIEW_WIDTH // 2)
+
+def mario_stream(state):
+    loaded, unloaded = state.level.update(state.camera_x)
+    for segment, records in unloaded:
+        for kind, obj in state.segment_objects.pop(segment, ()):
+            if kind == levels.PLATFORM:
+                state.platform_index.remove(obj)
+            elif kind == levels.ENEMY:
+                state.enemies.remove(obj)
+            else:
+                state.coin_index.remove(obj)
+    for segment, records in loaded:
+        objects = []
+        for number, (kind, x, y, width, height, extra) in enumerate(records):
+            if (segment, number) in state.collected:
+                continue
+            if kind == levels.PLATFORM:
+                obj = Box(x, y, width, height)
+                state.platform_index.insert(obj, obj)
+            elif kind == levels.ENEMY:
+                obj = MarioEnemy(x, y, extra)
+                state.enemies.append(obj)
+            elif kind == levels.COIN:
+                obj = MarioCoin(x + width // 2, y + height // 2, (segment, number))
+                state.coin_index.insert(obj, obj.box)
+            else:
+                continue
+            objects.append((kind, obj))
+        state.segment_objects[segment] = objects
+
+def mario_hit(player, platform, dx, dy):
+    box = player.box
+    if dy > 0:
+        box.y = platform.y - box.height
+        player.vel_y = 0
+        player.on_ground = True
+    elif dy < 0:
+        box.y = platform.y + platform.height
+        player.vel_y = 0
+    if dx > 0:
+        box.x = platform.x - box.width
+    elif dx < 0:
+        box.x = platform.x + platform.width
+
+def mario_move(state, dx, dy):
+    # Swept move: stop at the first platform in the way, so fast moves
+    # cannot skip over a thin platform; then push out of overlapping ones
+    player = state.player
+    box = player.box
+    platforms = state.platform_index
+    start = box.copy()
+    box.x = to_int(box.x + dx)
+    box.y = to_int(box.y + dy)
+    moved_x, moved_y = box.x - start.x, box.y - start.y
+    hit = sweep.first_hit(start, moved_x, moved_y, platforms.query(sweep.swept_bounds(start, moved_x, moved_y)))
+    if hit is not None:
+        box.x, box.y = start.x, start.y
+        mario_hit(player, hit[2], dx, dy)
+    for platform in platforms.query(box):
+        if box.overlaps(platform):
+            mario_hit(player, platform, dx, dy)
+
+def mario_step(state, inputs, profiler=NULL_PROFILER):
+    player = state.player
+    for press in inputs.presses:
+        if press == JUMP and player.on_ground:
+            player.vel_y = -MARIO_JUMP_POWER
+
+    dx = 0
+    if inputs.left:
+        dx = -MARIO_SPEED
+    if inputs.right:
+        dx = MARIO_SPEED
+    with profiler.section("physics"):
+        player.vel_y += MARIO_GRAVITY
+        if player.vel_y > MARIO_MAX_FALL:
+            player.vel_y = MARIO_MAX_FALL
+        mario_move(state, dx, 0)
+        player.on_ground = False
+        mario_move(state, 0, player.vel_y)
+
+        for enemy in state.enemies:
+            enemy.box.x += enemy.speed
+            if enemy.box.x > enemy.start_x + enemy.patrol_width:
+                enemy.speed = -enemy.speed
+            if enemy.box.x < enemy.start_x:
+                enemy.speed = -enemy.speed
+
+    box = player.box
+    with profiler.section("collisions"):
+        for coin in state.coin_index.query(box):
+            if box.overlaps(coin.box):
+                player.score += 1
+                state.coin_index.remove(coin)
+                state.collected.add(coin.key)
+                break
+
+        for enemy in state.enemies:
+            if box.overlaps(enemy.box):
+                # Simple reset on collision
+                box.x, box.y = state.spawn
+                player.score = 0
+                state.collisions += 1
+                break
+
+    state.camera_x = mario_camera_x(box.x)
+    with profiler.section("streaming"):
+        mario_stream(state)
+
+# fakesonic
+
+SONIC_LEVEL_FILE = os.path.join(LEVEL_DIR, "sonic_1.json")
+# Width of the view; the camera keeps the player in its middle
+SONIC_VIEW_WIDTH = 800
+SONIC_PLAYER_SIZE = 40
+SONIC_ACCELERATION = 0.5
+SONIC_MAX_SPEED = 8
+SONIC_FRICTION = 0.3
+SONIC_JUMP_POWER = -12
+SONIC_GRAVITY = 0.6
+# Falling below this line costs a life
+SONIC_DEATH_Y = 1000
+# Ticks the game over screen stays before the game ends
+SONIC_GAME_OVER_TICKS = 120
+# Most boss fireballs at the same time
+SONIC_MAX_FIREBALLS = 32
+SONIC_FIREBALL_SIZE = 15
+
+class SonicState:
+    # listeners are called as listener(kind, box, added) when a platform or
+    # ring is added or removed, e.g. to keep a renderer's caches in step
+    __slots__ = ("level", "spawn", "boss_arena_x", "ticks", "camera_x", "player", "vel_x", "vel_y", "on_ground",
+                 "lives", "score", "collisions", "enemies", "platform_index", "ring_index", "enemy_index", "fireball_index",
+                 "segment_objects", "ring_keys", "collected", "boss", "boss_alive", "boss_health", "boss_fireballs",
+                 "boss_timer", "fight_started", "win", "game_over_timer", "running", "listeners", "rng")
+
+    def __init__(self, level_file=SONIC_LEVEL_FILE, seed=None, listeners=()):
+        self.rng = random.Random(seed)
+        self.listeners = list(listeners)
+        self.ticks = 0
+
+        # The level is loaded piece by piece as the camera moves
+        self.level = levels.LevelStream(level_file, SONIC_VIEW_WIDTH)
+        metadata = self.level.metadata
+        self.spawn = tuple(metadata["spawn"])
+        self.boss_arena_x = metadata["boss_arena_x"]
+        self.camera_x = self.spawn[0] - SONIC_VIEW_WIDTH // 2
+
+        self.player = Box(self.spawn[0], self.spawn[1], SONIC_PLAYER_SIZE, SONIC_PLAYER_SIZE)
+        self.vel_x = 0
+        self.vel_y = 0
+        self.on_ground = False
+        self.lives = 3
+        self.score = 0
+        # Hits by enemies, fireballs and falls, each costing a life
+        self.collisions = 0
+
+        # Enemies of the loaded segments
+        self.enemies = []
+        # Platforms and rings are indexed once, moving enemies and fireballs
+        # are re-bucketed every tick
+        self.platform_index = SpatialHash()
+        self.ring_index = SpatialHash()
+        self.enemy_index = SpatialHash()
+        self.fireball_index = SpatialHash()
+
+        # Objects of the loaded segments and the keys of collected level rings
+        self.segment_objects = {}
+        self.ring_keys = {}
+        self.collected = set()
+        self.boss = None
+
+        # Scattered rings belong to the game, not to the level
+        scatter = metadata.get("ring_scatter")
+        if scatter:
+            size = scatter["size"]
+            for _ in range(scatter["count"]):
+                ring = Box(self.rng.randint(*scatter["x"]), self.rng.randint(*scatter["y"]), size, size)
+                sonic_add(self, levels.RING, ring)
+
+        sonic_stream(self)
+        self.boss_alive = True
+        self.boss_health = 3
+        # Fireballs come from a pool and go back when they hit or fly off
+        self.boss_fireballs = EntityPool(lambda: Box(0, 0, SONIC_FIREBALL_SIZE, SONIC_FIREBALL_SIZE), Box.update, SONIC_MAX_FIREBALLS)
+        self.boss_timer = 0
+        self.fight_started = False
+        self.win = False
+        self.game_over_timer = 0
+        self.running = True
+
+    def close(self):
+        self.level.close()
+
+def sonic_add(state, kind, box):
+    if kind == levels.PLATFORM:
+        state.platform_index.insert(box, box)
+    else:
+        state.ring_index.insert(box, box)
+    for listener in state.listeners:
+        listener(kind, box, True)
+
+def sonic_remove(state, kind, box):
+    if kind == levels.PLATFORM:
+        state.platform_index.remove(box)
+    else:
+        state.ring_index.remove(box)
+    for listener in state.listeners:
+        listener(kind, box, False)
+
+def sonic_stream(state):
+    # Load the level segments near the camera, drop the ones it left behind
+    loaded, unloaded = state.level.update(state.camera_x)
+    for segment, records in unloaded:
+        removed = set()
+        for kind, box in state.segment_objects.pop(segment, ()):
+            if kind == levels.PLATFORM:
+                sonic_remove(state, kind, box)
+            elif kind == levels.RING:
+                if id(box) in state.ring_keys:
+                    sonic_remove(state, kind, box)
+                    del state.ring_keys[id(box)]
+            elif kind == levels.ENEMY:
+                state.enemy_index.remove(box)
+                removed.add(id(box))
+        if removed:
+            state.enemies = [enemy for enemy in state.enemies if id(enemy) not in removed]
+    for segment, records in loaded:
+        objects = []
+        for number, (kind, x, y, width, height, _) in enumerate(records):
+            key = (segment, number)
+            if key in state.collected:
+                continue
+            box = Box(x, y, width, height)
+            if kind == levels.PLATFORM:
+                sonic_add(state, kind, box)
+            elif kind == levels.RING:
+                sonic_add(state, kind, box)
+                state.ring_keys[id(box)] = key
+            elif kind == levels.ENEMY:
+                state.enemies.append(box)
+                state.enemy_index.insert(box, box)
+            elif kind == levels.BOSS:
+                # The boss is made once and stays when its segment unloads
+                if state.boss is None:
+                    state.boss = box
+                continue
+            objects.append((kind, box))
+        state.segment_objects[segment] = objects
+
+def sonic_reset_player(state):
+    state.player.x, state.player.y = state.spawn
+    state.vel_x = state.vel_y = 0
+
+def sonic_step(state, inputs, profiler=NULL_PROFILER):
+    state.ticks += 1
+    player = state.player
+    # Game over: keep the screen for a while, then stop
+    if state.lives <= 0:
+        state.game_over_timer += 1
+        if state.game_over_timer >= SONIC_GAME_OVER_TICKS:
+            state.running = False
+        return
+
+    if inputs.right:
+        state.vel_x += SONIC_ACCELERATION
+    elif inputs.left:
+        state.vel_x -= SONIC_ACCELERATION
+    else:
+        state.vel_x -= SONIC_FRICTION if state.vel_x > 0 else -SONIC_FRICTION if state.vel_x < 0 else 0
+    state.vel_x = max(-SONIC_MAX_SPEED, min(SONIC_MAX_SPEED, state.vel_x))
+    if inputs.jump and state.on_ground:
+        state.vel_y = SONIC_JUMP_POWER
+
+    state.vel_y += SONIC_GRAVITY
+    start = player.copy()
+    player.x = to_int(player.x + state.vel_x)
+    player.y = to_int(player.y + state.vel_y)
+    state.on_ground = False
+
+    # Land on the first platform crossed while falling, so a fast fall does
+    # not pass through thin platforms, then on platforms the player overlaps
+    with profiler.section("collisions"):
+        dx, dy = player.x - start.x, player.y - start.y
+        if dy > 0:
+            hit = sweep.first_hit(start, dx, dy, state.platform_index.query(sweep.swept_bounds(start, dx, dy)), one_way=True)
+            if hit is not None:
+                player.y = hit[2].y - player.height
+                state.vel_y = 0
+                state.on_ground = True
+        for platform in state.platform_index.query(player):
+            if player.overlaps(platform):
+                if state.vel_y > 0 and player.bottom <= platform.bottom:
+                    player.y = platform.y - player.height
+                    state.vel_y = 0
+                    state.on_ground = True
+
+    state.camera_x = player.x - SONIC_VIEW_WIDTH // 2
+
+    for ring in state.ring_index.query(player):
+        if player.overlaps(ring):
+            sonic_remove(state, levels.RING, ring)
+            # A level ring must not come back when its segment reloads
+            key = state.ring_keys.pop(id(ring), None)
+            if key is not None:
+                state.collected.add(key)
+            state.score += 1
+
+    # Enemies turn around every half second
+    step = 2 if state.ticks // 30 % 2 == 0 else -2
+    with profiler.section("enemies"):
+        for enemy in state.enemies:
+            enemy.x += step
+            state.enemy_index.move(enemy, enemy)
+        for enemy in state.enemy_index.query(player):
+            if player.overlaps(enemy):
+                state.lives -= 1
+                state.collisions += 1
+                sonic_reset_player(state)
+
+    if player.y > SONIC_DEATH_Y:
+        state.lives -= 1
+        state.collisions += 1
+        sonic_reset_player(state)
+
+    if player.x >= state.boss_arena_x:
+        state.fight_started = True
+    if state.fight_started and state.boss_alive and state.boss is not None:
+        with profiler.section("boss"):
+            sonic_boss_step(state)
+
+    with profiler.section("streaming"):
+        sonic_stream(state)
+
+def sonic_boss_step(state):
+    player = state.player
+    boss = state.boss
+    state.boss_timer += 1
+    boss.x += 2 if state.boss_timer // 60 % 2 == 0 else -2
+
+    if state.boss_timer % 90 == 0:
+        fireball = state.boss_fireballs.acquire(boss.x + boss.width // 2, boss.y + boss.height // 2, SONIC_FIREBALL_SIZE, SONIC_FIREBALL_SIZE)
+        if fireball is not None:
+            state.fireball_index.insert(fireball, fireball)
+
+    for fireball in state.boss_fireballs:
+        fireball.x -= 6
+        if fireball.x < player.x - 500:
+            state.boss_fireballs.release(fireball)
+            state.fireball_index.remove(fireball)
+        else:
+            state.fireball_index.move(fireball, fireball)
+
+    # Only fireballs near the player are tested
+    for fireball in state.fireball_index.query(player):
+        if fireball.overlaps(player):
+            state.boss_fireballs.release(fireball)
+            state.fireball_index.remove(fireball)
+            state.lives -= 1
+            state.collisions += 1
+            sonic_reset_player(state)
+
+    # Jumping on the boss hurts it
+    if player.overlaps(boss) and state.vel_y > 0:
+        state.vel_y = SONIC_JUMP_POWER
+        state.boss_health -= 1
+        if state.boss_health <= 0:
+            state.boss_alive = False
+            state.win = True
+
+# Benchmark and check against core_reference.py, the pygame-bound games as
+# they were before these cores. Both feed the same Input to the core and, as
+# key state and key events, to the reference game through the engine.
+
+def car_snapshot(state):
+    # Comparable state of each game, in the layout of core_reference's snapshot()
+    return (state.lane, sorted(state.enemies.positions()), state.timer, state.score, state.collisions, state.running)
+
+def mario_snapshot(state):
+    player = state.player
+    enemies = [(enemy.box.x, enemy.box.y, enemy.speed) for enemy in state.enemies]
+    coins = [tuple(coin.box) for coin, cells in state.coin_index.objects.values()]
+    return (tuple(player.box), player.vel_y, player.on_ground, player.score, enemies, coins, sorted(state.collected), state.collisions)
+
+def sonic_snapshot(state):
+    boss = tuple(state.boss) if state.boss is not None else None
+    return (tuple(state.player), state.vel_x, state.vel_y, state.on_ground, state.lives, state.score, state.camera_x,
+            [tuple(enemy) for enemy in state.enemies], len(state.ring_index), sorted(state.collected),
+            boss, state.boss_health, [tuple(fireball) for fireball in state.boss_fireballs], state.win, state.running)
+
+def sonic_boss_start(state, seed):
+    # Starts next to the boss arena with lives to spare, so checks reach the
+    # boss fight. Works on a SonicState and on the reference game alike.
+    state.lives = 60
+    state.player.x = state.boss_arena_x + random.Random(seed).randint(-200, 300)
+    state.player.y = 100
+    state.spawn = (state.player.x, state.player.y)
+
+def car_policy(state, tick, lookahead=CAR_HEIGHT):
+    # Changes lane when a car is coming down the player's lane
+    blocked = [False] * CAR_LANES
+    player_top = CAR_PLAYER_Y - CAR_HEIGHT // 2
+    for lane, y in state.enemies.positions():
+        top = y - CAR_HEIGHT // 2
+        if top + CAR_HEIGHT > player_top - lookahead and top < player_top + CAR_HEIGHT:
+            blocked[lane] = True
+    if blocked[state.lane]:
+        for lane, press in ((state.lane - 1, LEFT), (state.lane + 1, RIGHT)):
+            if 0 <= lane < CAR_LANES and not blocked[lane]:
+                return Input(presses=(press,))
+    return NO_INPUT
+
+def mario_policy(state, tick):
+    # Runs right and jumps every 40 ticks
+    return Input(right=True, presses=(JUMP,) if tick % 40 == 0 else ())
+
+def sonic_policy(state, tick):
+    # Runs right and holds jump for 12 ticks out of every 50
+    return Input(right=True, jump=tick % 50 < 12)
+
+def idle_policy(state, tick):
+    return NO_INPUT
+
+class RandomPolicy:
+    # Holds random directions and jump for random stretches and presses a
+    # random action now and then
+    def __init__(self, seed, change=0.05, press=0.05):
+        self.rng = random.Random(seed)
+        self.change = change
+        self.press = press
+        self.held = NO_INPUT
+
+    def __call__(self, state, tick):
+        rng = self.rng
+        if rng.random() < self.change:
+            self.held = Input(rng.random() < 0.3, rng.random() < 0.7, rng.random() < 0.3)
+        presses = (rng.choice((LEFT, RIGHT, JUMP)),) if rng.random() < self.press else ()
+        held = self.held
+        return Input(held.left, held.right, held.jump, presses)
+
+# Game module -> new state for a seed, step, snapshot and scripted policy
+GAMES = {
+    "car_game": (lambda seed: CarState(seed=seed), car_step, car_snapshot, car_policy),
+    "fakemario": (lambda seed: MarioState(), mario_step, mario_snapshot, mario_policy),
+    "fakesonic": (lambda seed: SonicState(seed=seed), sonic_step, sonic_snapshot, sonic_policy),
+}
+
+def make_policy(name, game_name, seed):
+    if name == "idle":
+        return idle_policy
+    if name == "random":
+        return RandomPolicy(seed)
+    if name == "scripted":
+        return GAMES[game_name][3]
+    raise ValueError(f"unknown policy {name!r}")
+
+def reference_frames(inputs):
+    # Inputs as (key state, key events) for the engine
+    import pygame
+    import engine
+
+    keys_of = {LEFT: pygame.K_LEFT, RIGHT: pygame.K_RIGHT, JUMP: pygame.K_SPACE}
+    frames = []
+    for tick_input in inputs:
+        held = [key for key, down in ((pygame.K_LEFT, tick_input.left), (pygame.K_RIGHT, tick_input.right), (pygame.K_SPACE, tick_input.jump)) if down]
+        events = [pygame.event.Event(pygame.KEYDOWN, key=keys_of[press]) for press in tick_input.presses]
+        frames.append((engine.KeyState(held), events))
+    return frames
+
+def record_session(game_name, seed, policy, ticks):
+    make_state, step = GAMES[game_name][:2]
+    state = make_state(seed)
+    inputs = []
+    for tick in range(ticks):
+        if not state.running:
+            break
+        inputs.append(policy(state, tick))
+        step(state, inputs[-1])
+    getattr(state, "close", lambda: None)()
+    return inputs
+
+def time_core(game_name, seed, inputs, repeats):
+    make_state, step = GAMES[game_name][:2]
+    best = float("inf")
+    for _ in range(repeats):
+        state = make_state(seed)
+        start = time.perf_counter()
+        for tick_input in inputs:
+            step(state, tick_input)
+        best = min(best, time.perf_counter() - start)
+        getattr(state, "close", lambda: None)()
+    return best
+
+def time_engine(make_game, frames, repeats):
+    import engine
+
+    best = float("inf")
+    for _ in range(repeats):
+        stats = engine.Engine(make_game()).run_headless(len(frames), lambda tick, game: frames[tick])
+        best = min(best, stats.seconds)
+    return best
+
+def benchmark(ticks=3600, repeats=5):
+    # Cores first: pygame is not imported until the games are timed
+    sessions = []
+    for name, (make_state, step, snapshot, policy) in GAMES.items():
+        inputs = record_session(name, 0, policy, ticks)
+        sessions.append((name, inputs, time_core(name, 0, inputs, repeats)))
+    print(f"cores stepped without pygame: {'pygame' not in sys.modules}")
+
+    import importlib
+    import engine
+    import core_reference
+
+    engine.init(headless=True)
+    # "pre-core" is the pygame-bound game the core replaced, "adapter" the
+    # game module driving the core through the engine
+    print(f"{'game':>10} {'ticks':>6} {'core':>14} {'pre-core':>14} {'speedup':>8} {'adapter':>14}")
+    for name, inputs, core_time in sessions:
+        frames = reference_frames(inputs)
+        module = importlib.import_module(name)
+        reference_time = time_engine(lambda: core_reference.GAMES[name](seed=0), frames, repeats)
+        adapter_time = time_engine(lambda: module.Game(seed=0), frames, repeats)
+        count = len(inputs)
+        print(f"{name:>10} {count:>6} {count / core_time:>10,.0f} t/s {count / reference_time:>10,.0f} t/s "
+              f"{reference_time / core_time:>7.1f}x {count / adapter_time:>10,.0f} t/s")
+
+def check_session(game_name, policy_name, seed, ticks, setup=None):
+    # Returns None when the core matched the reference game on every tick,
+    # else (tick, expected, actual) for the first tick that differs
+    import engine
+    import core_reference
+
+    make_state, step, snapshot = GAMES[game_name][:3]
+    state = make_state(seed)
+    reference = core_reference.GAMES[game_name](seed=seed)
+    if setup is not None:
+        setup(state, seed)
+        setup(reference, seed)
+    policy = make_policy(policy_name, game_name, seed)
+    reference_engine = engine.Engine(reference)
+    try:
+        for tick in range(ticks):
+            if not state.running:
+                break
+            tick_input = policy(state, tick)
+            step(state, tick_input)
+            reference_engine.step(*reference_frames((tick_input,))[0])
+            expected, actual = reference.snapshot(), snapshot(state)
+            if expected != actual:
+                return tick, expected, actual
+    finally:
+        getattr(state, "close", lambda: None)()
+        reference.close()
+    return None
+
+def check(ticks=3600, seeds=6):
+    # Every game under every policy, and the sonic boss fight; returns the
+    # number of sessions that differed
+    import engine
+
+    engine.init(headless=True)
+    cases = [(name, policy, None) for name in GAMES for policy in ("idle", "random", "scripted")]
+    cases += [("fakesonic", "random", sonic_boss_start), ("fakesonic", "scripted", sonic_boss_start)]
+    failures = 0
+    for name, policy, setup in cases:
+        label = f"{name} {policy}" + (" from the boss arena" if setup is not None else "")
+        for seed in range(seeds):
+            mismatch = check_session(name, policy, seed, ticks, setup)
+            if mismatch is not None:
+                failures += 1
+                tick, expected, actual = mismatch
+                print(f"{label}, seed {seed}: differs at tick {tick}")
+                print(f"  reference {expected}")
+                print(f"  core      {actual}")
+        print(f"{label}: {seeds} seeds checked")
+    return failures
+
+def main():
+    parser = argparse.ArgumentParser(description="Time the pygame-free cores against the pygame-bound games they replaced.")
+    parser.add_argument("--ticks", type=int, default=3600, help="ticks per session")
+    parser.add_argument("--repeats", type=int, default=5, help="timed runs per session, the best one counts")
+    parser.add_argument("--check", action="store_true", help="instead compare each core with core_reference.py tick by tick")
+    parser.add_argument("--seeds", type=int, default=6, help="seeds per game and policy for --check")
+    args = parser.parse_args()
+    if args.check:
+        failures = check(args.ticks, args.seeds)
+        print("cores match the reference games" if not failures else f"{failures} sessions differ from the reference games")
+        sys.exit(1 if failures else 0)
+    benchmark(args.ticks, args.repeats)
+
+if __name__ == "__main__":
+    main()
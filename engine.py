@@ -0,0 +1,370 @@
+import time
+
+# Reference point for the startup benchmark (engine.py GAME --startup). Taken
+# before the other imports on purpose so their cost, pygame's above all, is
+# part of the measured startup; hence the E402 exemptions below.
+STARTED = time.perf_counter()
+
+import argparse  # noqa: E402
+import importlib  # noqa: E402
+import json  # noqa: E402
+import os  # noqa: E402
+import random  # noqa: E402
+
+import pygame  # noqa: E402
+
+from profiler import NULL_PROFILER, Profiler  # noqa: E402
+
+# Shared game loop. Game logic always advances in fixed steps of 1 / TICK_RATE
+# seconds; rendering happens once per displayed frame and is skipped entirely
+# in headless mode, where ticks run as fast as the CPU allows.
+
+TICK_RATE = 60
+# Longest real frame we try to catch up on, avoids a spiral of death after a stall
+MAX_FRAME_TIME = 0.25
+# Font name -> font file, kept between runs because finding a system font
+# scans every installed font. Lives in the user's cache directory
+# (%LOCALAPPDATA% on Windows, $XDG_CACHE_HOME or ~/.cache elsewhere).
+CACHE_DIR = os.path.join(
+    (os.environ.get("LOCALAPPDATA") if os.name == "nt" else os.environ.get("XDG_CACHE_HOME"))
+    or os.path.join(os.path.expanduser("~"), ".cache"),
+    "pygames",
+)
+FONT_CACHE = os.path.join(CACHE_DIR, "fontcache.json")
+
+class KeyState:
+    # Stand-in for pygame.key.get_pressed() built from a set of key codes
+    def __init__(self, pressed=()):
+        self.pressed = frozenset(pressed)
+
+    def __getitem__(self, key):
+        return key in self.pressed
+
+NO_KEYS = KeyState()
+
+class Game:
+    # Base class for the games. Subclasses set size/caption and override
+    # handle_event, update and draw; update must only depend on dt, the key
+    # state passed in and the game's own state so it can run headless.
+    # Randomness must come from self.rng so a seed reproduces a session.
+    size = (800, 600)
+    caption = "Pygame"
+    # Keyword arguments for Game() when a session is recorded or replayed
+    replay_options = {}
+    # Set by the engine; games time their own parts with profiler.section()
+    profiler = NULL_PROFILER
+
+    def __init__(self, seed=None):
+        self.running = True
+        if seed is None:
+            seed = random.randrange(2 ** 32)
+        self.seed = seed
+        self.rng = random.Random(seed)
+
+    def handle_event(self, event):
+        pass
+
+    def update(self, dt, keys):
+        pass
+
+    def draw(self, surface):
+        # Return a list of changed rects to update only those parts of the
+        # window, or None to flip the whole frame
+        pass
+
+    def close(self):
+        pass
+
+    def stats(self):
+        # Per-session results for tools that run many sessions (runner.py)
+        return {"score": 0, "collisions": 0}
+
+class RunStats:
+    def __init__(self, ticks, frames, seconds):
+        self.ticks = ticks
+        self.frames = frames
+        self.seconds = seconds
+
+    @property
+    def ticks_per_second(self):
+        return self.ticks / self.seconds if self.seconds > 0 else 0.0
+
+    def __str__(self):
+        return f"{self.ticks} ticks, {self.frames} frames in {self.seconds:.3f} s ({self.ticks_per_second:,.0f} ticks/s)"
+
+def init(headless=False):
+    # Nothing happens at import time; the games only need the display (which
+    # also brings up events and input). Fonts are initialized on first use
+    # and sound is never started.
+    if headless:
+        # Must be set before the display module is initialized
+        os.environ["SDL_VIDEODRIVER"] = "dummy"
+    pygame.display.init()
+
+_fonts = {}
+_font_paths = None
+
+def find_font(name):
+    # Font file for a system font name, None for pygame's default font
+    global _font_paths
+    if name is None:
+        return None
+    if _font_paths is None:
+        try:
+            with open(FONT_CACHE) as file:
+                _font_paths = json.load(file)
+        except (OSError, ValueError):
+            _font_paths = {}
+    if name in _font_paths:
+        path = _font_paths[name]
+        if path is None or os.path.exists(path):
+            return path
+    path = _font_paths[name] = pygame.font.match_font(name)
+    try:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        with open(FONT_CACHE, "w") as file:
+            json.dump(_font_paths, file)
+    except OSError:
+        pass
+    return path
+
+def get_font(name, size):
+    # Same font as SysFont(name, size) without scanning the system fonts
+    # every run; each font object is only made once
+    key = (name, size)
+    font = _fonts.get(key)
+    if font is None:
+        if not pygame.font.get_init():
+            pygame.font.init()
+        font = _fonts[key] = pygame.font.Font(find_font(name), size)
+    return font
+
+class CachedText:
+    # Rendered text that is only re-rendered when the string changes
+    def __init__(self, font_name, size, color, antialias=True):
+        self.font_name = font_name
+        self.size = size
+        self.color = color
+        self.antialias = antialias
+        self.text = None
+        self.surface = None
+
+    def render(self, text):
+        if text != self.text:
+            self.surface = get_font(self.font_name, self.size).render(text, self.antialias, self.color)
+            self.text = text
+        return self.surface
+
+class DirtyRects:
+    # Collects the screen regions that changed this frame. Sprites are
+    # tracked by key: when a sprite's rect differs from last frame both the
+    # old and the new rect are dirty. collect() merges overlapping rects and
+    # falls back to the whole screen when most of it changed anyway.
+    def __init__(self, size, full_screen_ratio=0.5):
+        self.screen_rect = pygame.Rect((0, 0), size)
+        self.full_screen_ratio = full_screen_ratio
+        self.rects = []
+        self.previous = {}
+        self.full = True
+
+    def invalidate_all(self):
+        self.full = True
+
+    def add(self, rect):
+        rect = pygame.Rect(rect).clip(self.screen_rect)
+        if rect.width and rect.height:
+            self.rects.append(rect)
+
+    def track(self, key, rect):
+        # rect is None when the sprite is not drawn this frame
+        old = self.previous.get(key)
+        if old == rect:
+            return
+        if old is not None:
+            self.add(old)
+        if rect is None:
+            self.previous.pop(key, None)
+        else:
+            rect = pygame.Rect(rect)
+            self.add(rect)
+            self.previous[key] = rect
+
+    def track_group(self, key, rects):
+        # Unordered sprites (e.g. every enemy): last frame's and this frame's
+        # rects are all dirty
+        for rect in self.previous.get(key, ()):
+            self.add(rect)
+        rects = [pygame.Rect(rect) for rect in rects]
+        for rect in rects:
+            self.add(rect)
+        self.previous[key] = rects
+
+    def collect(self):
+        rects, self.rects = self.rects, []
+        if self.full:
+            self.full = False
+            return [self.screen_rect.copy()]
+        merged = []
+        for rect in rects:
+            # Grow the rect by swallowing everything it overlaps
+            i = rect.collidelist(merged)
+            while i != -1:
+                rect.union_ip(merged.pop(i))
+                i = rect.collidelist(merged)
+            merged.append(rect)
+        area = sum(rect.width * rect.height for rect in merged)
+        if area > self.screen_rect.width * self.screen_rect.height * self.full_screen_ratio:
+            return [self.screen_rect.copy()]
+        return merged
+
+class Engine:
+    def __init__(self, game, tick_rate=TICK_RATE, profiler=None):
+        self.game = game
+        self.tick_rate = tick_rate
+        self.dt = 1 / tick_rate
+        self.ticks = 0
+        self.profiler = profiler or NULL_PROFILER
+        game.profiler = self.profiler
+
+    def step(self, keys, events=()):
+        profiler = self.profiler
+        with profiler.section("input"):
+            for event in events:
+                self.game.handle_event(event)
+        with profiler.section("update"):
+            self.game.update(self.dt, keys)
+        self.ticks += 1
+
+    def run(self, max_fps=None, recorder=None):
+        # Real-time loop with a window. With a recorder (see replay.py) the
+        # key state comes from the recorded key events instead of
+        # pygame.key.get_pressed(), so a replay sees exactly the same input.
+        game = self.game
+        profiler = self.profiler
+        screen = pygame.display.set_mode(game.size)
+        pygame.display.set_caption(game.caption)
+        clock = pygame.time.Clock()
+        accumulator = 0.0
+        frames = 0
+        # Events not delivered yet; a frame without a tick keeps them for the next one
+        pending = []
+        start = time.perf_counter()
+        while game.running:
+            accumulator += min(clock.tick(max_fps or self.tick_rate) / 1000, MAX_FRAME_TIME)
+            # The profiler's frame starts after the wait for the next frame
+            profiler.start_frame()
+            with profiler.section("events"):
+                for event in pygame.event.get():
+                    if event.type == pygame.QUIT:
+                        game.running = False
+                    else:
+                        pending.append(event)
+            keys = pygame.key.get_pressed() if recorder is None else None
+            # Events are delivered with the next tick, which may be in a later frame
+            while accumulator >= self.dt and game.running:
+                events = pending
+                if recorder is not None:
+                    keys, events = recorder.record(self.ticks, events)
+                self.step(keys, events)
+                pending = []
+                accumulator -= self.dt
+            with profiler.section("draw"):
+                dirty = game.draw(screen)
+            overlay = profiler.draw(screen)
+            if overlay is not None and dirty is not None:
+                dirty = list(dirty) + [overlay]
+            with profiler.section("flip"):
+                if dirty is None:
+                    pygame.display.flip()
+                elif dirty:
+                    pygame.display.update(dirty)
+            profiler.end_frame()
+            frames += 1
+        game.close()
+        return RunStats(self.ticks, frames, time.perf_counter() - start)
+
+    def run_headless(self, ticks, inputs=None, render=False):
+        # Steps up to `ticks` ticks without waiting for the clock. inputs is
+        # an optional callable (tick, game) -> (keys, events).
+        game = self.game
+        profiler = self.profiler
+        surface = pygame.Surface(game.size) if render else None
+        frames = 0
+        start = time.perf_counter()
+        for tick in range(ticks):
+            if not game.running:
+                break
+            if inputs is None:
+                self.step(NO_KEYS)
+            else:
+                keys, events = inputs(tick, game)
+                self.step(keys, events)
+            if surface is not None:
+                with profiler.section("draw"):
+                    game.draw(surface)
+                frames += 1
+            profiler.end_frame()
+        game.close()
+        return RunStats(self.ticks, frames, time.perf_counter() - start)
+
+def run(game):
+    init()
+    return Engine(game).run()
+
+def startup_benchmark(module_name, headless=False):
+    # Time of each startup stage, from importing the engine to the first
+    # frame on screen
+    marks = [("imports", time.perf_counter())]
+    init(headless)
+    marks.append(("init", time.perf_counter()))
+    module = importlib.import_module(module_name)
+    marks.append(("game import", time.perf_counter()))
+    game = module.Game()
+    marks.append(("game setup", time.perf_counter()))
+    screen = pygame.display.set_mode(game.size)
+    game.draw(screen)
+    pygame.display.flip()
+    marks.append(("first frame", time.perf_counter()))
+    game.close()
+    lines = []
+    previous = STARTED
+    for name, mark in marks:
+        lines.append(f"{name:>12} {(mark - previous) * 1000:8.1f} ms")
+        previous = mark
+    lines.append(f"{'total':>12} {(previous - STARTED) * 1000:8.1f} ms")
+    return "\n".join(lines)
+
+def main():
+    parser = argparse.ArgumentParser(description="Run one of the games through the shared engine loop.")
+    parser.add_argument("game", help="game module, e.g. car_game, fakemario, fakesonic, fakemc")
+    parser.add_argument("--headless", action="store_true", help="no window, step ticks as fast as possible")
+    parser.add_argument("--ticks", type=int, default=10000, help="ticks to simulate in headless mode")
+    parser.add_argument("--render", action="store_true", help="also draw every tick to an offscreen surface")
+    parser.add_argument("--seed", type=int, help="seed for the game's random number generator")
+    parser.add_argument("--profile", action="store_true", help="time engine and game sections, show an overlay and print a report")
+    parser.add_argument("--profile-out", metavar="PATH", help="write the profile to PATH (.csv, .json or .trace.json for Chrome tracing)")
+    parser.add_argument("--startup", action="store_true", help="time startup up to the first frame and exit")
+    args = parser.parse_args()
+
+    if args.startup:
+        print(startup_benchmark(args.game, args.headless))
+        pygame.quit()
+        return
+
+    init(headless=args.headless)
+    game = importlib.import_module(args.game).Game(seed=args.seed)
+    profiler = Profiler() if args.profile or args.profile_out else None
+    engine = Engine(game, profiler=profiler)
+    if args.headless:
+        stats = engine.run_headless(args.ticks, render=args.render)
+    else:
+        stats = engine.run()
+    print(stats)
+    if profiler is not None:
+        print(profiler.report())
+        if args.profile_out:
+            profiler.export(args.profile_out)
+    pygame.quit()
+
+if __name__ == "__main__":
+    main()
@@ -1,19 +1,25 @@
 import pygame
+import os
 import sys
+import zlib
+from collections import OrderedDict
+from blockgrid import BlockGrid
+from chunkloader import ChunkLoader
+from worldfile import WorldFile
 
-# Initialize pygame
-pygame.init()
+import engine
 
 # Window settings
 SCREEN_WIDTH, SCREEN_HEIGHT = 800, 600
-SCREEN = pygame.display.set_mode((SCREEN_WIDTH, SCREEN_HEIGHT))
-pygame.display.set_caption("Mini Minecraft - Pygame Edition")
 
 # Colors
 COLOR_SKY = (135, 206, 235)
 COLOR_GRASS = (80, 200, 120)
 COLOR_DIRT = (134, 96, 67)
 COLOR_STONE = (125, 125, 125)
+COLOR_TORCH = (255, 190, 60)
+COLOR_SAND = (219, 200, 130)
+COLOR_WATER = (50, 100, 220)
 COLOR_PLAYER = (255, 50, 50)
 COLOR_UI_BG = (30, 30, 30, 180)
 COLOR_TEXT = (220, 220, 220)
@@ -29,65 +35,435 @@ BLOCK_AIR = 0
 BLOCK_GRASS = 1
 BLOCK_DIRT = 2
 BLOCK_STONE = 3
+BLOCK_TORCH = 4
+BLOCK_SAND = 5
+BLOCK_WATER = 6
 
 BLOCK_TYPES = {
     BLOCK_GRASS: COLOR_GRASS,
     BLOCK_DIRT: COLOR_DIRT,
     BLOCK_STONE: COLOR_STONE,
+    BLOCK_TORCH: COLOR_TORCH,
+    BLOCK_SAND: COLOR_SAND,
+    BLOCK_WATER: COLOR_WATER,
 }
 
 # Player movement speed (tiles per second)
 PLAYER_SPEED = 5
 
+# Render cache settings: the world is pre-rendered in square chunks of tiles
+CHUNK_SIZE = 8
+COLOR_BLOCK_BORDER = (50, 50, 50)
+
+# Infinite world settings
+WORLD_SEED = 1337
+MAX_RESIDENT_CHUNKS = 256
+SAVE_FILE = "fakemc_world.fmcw"
+# Background chunk loading: worker threads, most chunks queued at once and
+# most finished chunks installed per tick
+LOADER_THREADS = 1
+LOADER_CAPACITY = 64
+LOADER_INSTALLS_PER_TICK = 8
+TERRAIN_FEATURE_WIDTH = 16  # tiles between terrain height control points
+
 # Fonts
-FONT = pygame.font.SysFont("Consolas", 20)
+FONT_NAME = "Consolas"
+FONT_SIZE = 20
+
+# UI panel at the bottom of the screen
+PANEL_HEIGHT = 60
+PANEL_RECT = pygame.Rect(0, SCREEN_HEIGHT - PANEL_HEIGHT, SCREEN_WIDTH, PANEL_HEIGHT)
+
+def render_blocks(blocks):
+    # Surface for a square BlockGrid of chunk-local blocks, None if it is all
+    # air. Only reads its argument, so loader threads can call it too.
+    size = blocks.columns
+    pixels = size * TILE_SIZE
+    data = blocks.data
+    surface = None
+    for local_x in range(size):
+        for local_y in range(size):
+            block = data[local_x * size + local_y]
+            if block == BLOCK_AIR:
+                continue
+            if surface is None:
+                # Transparent background so the sky shows through air blocks
+                surface = pygame.Surface((pixels, pixels), pygame.SRCALPHA)
+            rect = pygame.Rect(local_x * TILE_SIZE, local_y * TILE_SIZE, TILE_SIZE, TILE_SIZE)
+            surface.fill(BLOCK_TYPES.get(block, COLOR_GRASS), rect)
+            pygame.draw.rect(surface, COLOR_BLOCK_BORDER, rect, 1)
+    return surface
+
+class ChunkRenderCache:
+    # Keeps one pre-rendered Surface per chunk so a frame is a few blits
+    # instead of two draw calls per block. Chunks are redrawn lazily after
+    # invalidate() marks them stale.
+    def __init__(self, world, chunk_size=CHUNK_SIZE):
+        self.world = world
+        self.chunk_size = chunk_size
+        self.chunk_pixels = chunk_size * TILE_SIZE
+        self.surfaces = {}
+
+    def invalidate(self, x, y):
+        self.surfaces.pop((x // self.chunk_size, y // self.chunk_size), None)
+
+    def clear(self):
+        self.surfaces.clear()
+
+    def render_chunk(self, chunk_x, chunk_y):
+        # Chunks that are all air are cached as None and never blitted
+        return render_blocks(self.world.chunk_blocks(chunk_x, chunk_y, self.chunk_size))
+
+    def get_chunk(self, chunk_x, chunk_y):
+        key = (chunk_x, chunk_y)
+        if key not in self.surfaces:
+            self.surfaces[key] = self.render_chunk(chunk_x, chunk_y)
+        return self.surfaces[key]
+
+    def visible_chunks(self, surface, camera_x=0, camera_y=0):
+        view = surface.get_clip()
+        pixels = self.chunk_pixels
+        first_x = (view.left + camera_x) // pixels
+        last_x = (view.right - 1 + camera_x) // pixels
+        first_y = (view.top + camera_y) // pixels
+        last_y = (view.bottom - 1 + camera_y) // pixels
+        # Clamp to the chunks that actually contain world cells. Worlds
+        # without a column count are endless horizontally.
+        if self.world.columns is not None:
+            first_x = max(first_x, 0)
+            last_x = min(last_x, (self.world.columns - 1) // self.chunk_size)
+        first_y = max(first_y, 0)
+        last_y = min(last_y, (self.world.rows - 1) // self.chunk_size)
+        for chunk_x in range(first_x, last_x + 1):
+            for chunk_y in range(first_y, last_y + 1):
+                yield chunk_x, chunk_y
+
+    def draw(self, surface, camera_x=0, camera_y=0):
+        pixels = self.chunk_pixels
+        blits = []
+        surfaces = self.surfaces
+        for chunk_x, chunk_y in self.visible_chunks(surface, camera_x, camera_y):
+            # Chunks still being loaded in the background are skipped
+            if (chunk_x, chunk_y) not in surfaces and not self.world.chunk_ready(chunk_x, chunk_y):
+                continue
+            chunk_surface = self.get_chunk(chunk_x, chunk_y)
+            if chunk_surface is not None:
+                blits.append((chunk_surface, (chunk_x * pixels - camera_x, chunk_y * pixels - camera_y)))
+        surface.blits(blits, doreturn=False)
+
+class Chunk:
+    def __init__(self, blocks):
+        # CHUNK_SIZE x CHUNK_SIZE BlockGrid in chunk-local coordinates
+        self.blocks = blocks
+        # Dirty chunks have changes that are neither in the save file nor
+        # reproducible from the seed
+        self.dirty = False
+
+def terrain_noise(seed, n):
+    # Deterministic pseudo random value in [0, 1) for an integer lattice point
+    h = (n * 374761393 + seed * 668265263) & 0xFFFFFFFF
+    h = ((h ^ (h >> 13)) * 1274126177) & 0xFFFFFFFF
+    return ((h ^ (h >> 16)) & 0xFFFF) / 65536
+
+def terrain_height(seed, x, rows):
+    # Smoothly interpolated 1D value noise, returns the ground height in tiles
+    cell, offset = divmod(x, TERRAIN_FEATURE_WIDTH)
+    t = offset / TERRAIN_FEATURE_WIDTH
+    t = t * t * (3 - 2 * t)
+    a = terrain_noise(seed, cell)
+    b = terrain_noise(seed, cell + 1)
+    value = a + (b - a) * t
+    lowest = rows // 5
+    highest = rows // 2
+    return lowest + int(value * (highest - lowest + 1))
+
+class InfiniteWorld:
+    # Endless (horizontally) world split into CHUNK_SIZE x CHUNK_SIZE chunks.
+    # Chunks are generated from the seed the first time they are needed and
+    # at most max_chunks stay resident (LRU). Dirty chunks are appended to
+    # the save file when evicted (see WorldFile.append_chunks), which is
+    # created at `path` for that if need be, or as a temporary file for a
+    # world without one; clean ones are reloaded from the save file or
+    # regenerated.
+    def __init__(self, rows, seed=WORLD_SEED, max_chunks=MAX_RESIDENT_CHUNKS, store=None, path=None):
+        self.columns = None
+        self.rows = rows
+        self.seed = seed
+        self.chunk_size = CHUNK_SIZE
+        self.max_chunks = max_chunks
+        self.chunks = OrderedDict()
+        self.store = store
+        self.path = path
+        self.render_cache = ChunkRenderCache(self)
+        # Called as listener(x, y, old_block, new_block) after a block changes
+        self.listeners = []
+        # Background loader, see start_loader
+        self.loader = None
+        # Bumped whenever a chunk becomes resident, so views know to redraw
+        # chunks they skipped while they were loading
+        self.chunk_loads = 0
+
+    @classmethod
+    def open(cls, path, max_chunks=MAX_RESIDENT_CHUNKS):
+        # Opening only reads the header and chunk index, chunk payloads are
+        # streamed from the memory-mapped file as they are needed
+        store = WorldFile(path)
+        if store.chunk_size != CHUNK_SIZE:
+            store.close()
+            raise ValueError(f"{path} uses {store.chunk_size} tile chunks, expected {CHUNK_SIZE}")
+        return cls(store.rows, store.seed, max_chunks, store, path)
+
+    def writable_store(self):
+        # The store, created the first time something has to be written
+        if self.store is None:
+            if self.path is None:
+                self.store = WorldFile.create_temporary(self.chunk_size, self.rows, self.seed)
+            else:
+                self.store = WorldFile.create(self.path, self.chunk_size, self.rows, self.seed)
+        return self.store
+
+    def save(self, path=None):
+        # Incremental: only chunks changed since the last save are written,
+        # returns how many
+        payloads = {}
+        for key, chunk in self.chunks.items():
+            if chunk.dirty:
+                payloads[key] = zlib.compress(chunk.blocks.data)
+                chunk.dirty = False
+        store = self.store
+        saved = len(payloads.keys() | store.uncommitted) if store is not None else len(payloads)
+        if not saved:
+            return 0
+        if store is None or store.path is None:
+            self.path = path or self.path or SAVE_FILE
+            if store is not None:
+                # Evicted chunks went to a temporary file so far
+                self.store = store.save_as(self.path)
+        store = self.writable_store()
+        store.append_chunks(payloads)
+        store.commit()
+        return saved
+
+    def close(self):
+        if self.loader is not None:
+            self.loader.close()
+            self.loader = None
+        if self.store is not None:
+            self.store.close()
+            self.store = None
+
+    def start_loader(self, threads=LOADER_THREADS, capacity=LOADER_CAPACITY):
+        # From now on load_around only queues chunks; loader threads generate
+        # and pre-render them and pump_loader() installs the finished ones.
+        # Blocks that are needed right away (get_block, set_block) are still
+        # loaded on the spot.
+        self.loader = ChunkLoader(self.build_chunk, self.prepare_chunk, threads, capacity)
+
+    def store_entry(self, key):
+        # Where the store has the chunk, None if it has never been written
+        return None if self.store is None else self.store.index.get(key)
+
+    def prepare_chunk(self, key):
+        # Main thread: (store entry, block data) for a saved chunk, None for
+        # a new one. The entry is passed along so pump_loader can tell
+        # whether the chunk was evicted again in the meantime.
+        entry = self.store_entry(key)
+        if entry is None:
+            return None
+        return entry, self.store.read_chunk(key)
+
+    def build_chunk(self, key, prepared):
+        # Loader thread: only reads the seed, the sizes and its arguments
+        if prepared is None:
+            chunk = self.generate_chunk(*key)
+        else:
+            size = self.chunk_size
+            chunk = Chunk(BlockGrid(size, size, data=prepared[1]))
+        return chunk, render_blocks(chunk.blocks), prepared
+
+    def pump_loader(self, limit=LOADER_INSTALLS_PER_TICK):
+        # Main thread, between ticks: installs finished chunks and returns
+        # their keys
+        installed = []
+        for key, (chunk, surface, prepared) in self.loader.collect(limit):
+            if key in self.chunks:
+                continue
+            # Changed, evicted and written again since; loaded on the spot
+            # or requested again when it is needed
+            if self.store_entry(key) != (None if prepared is None else prepared[0]):
+                continue
+            self.chunks[key] = chunk
+            self.render_cache.surfaces[key] = surface
+            self.chunk_loads += 1
+            installed.append(key)
+        while len(self.chunks) > self.max_chunks:
+            self.evict_chunk()
+        return installed
+
+    def generate_chunk(self, chunk_x, chunk_y):
+        size = self.chunk_size
+        top = chunk_y * size
+        blocks = BlockGrid(size, size, BLOCK_AIR)
+        for local_x in range(size):
+            surface_y = self.rows - terrain_height(self.seed, chunk_x * size + local_x, self.rows)
+            # Grass on top, a few layers of dirt, stone below and on the bottom row
+            blocks.fill_region(local_x, surface_y - top, 1, 1, BLOCK_GRASS)
+            blocks.fill_region(local_x, surface_y + 1 - top, 1, 3, BLOCK_DIRT)
+            stone_top = max(surface_y + 4 - top, 0)
+            blocks.fill_region(local_x, stone_top, 1, size - stone_top, BLOCK_STONE)
+            blocks.fill_region(local_x, self.rows - 1 - top, 1, 1, BLOCK_STONE)
+        return Chunk(blocks)
+
+    def load_chunk(self, key):
+        size = self.chunk_size
+        if self.store is not None:
+            data = self.store.read_chunk(key)
+            if data is not None:
+                return Chunk(BlockGrid(size, size, data=data))
+        return self.generate_chunk(*key)
+
+    def evict_chunk(self):
+        key, chunk = self.chunks.popitem(last=False)
+        if chunk.dirty:
+            self.writable_store().append_chunks({key: zlib.compress(chunk.blocks.data)})
+        self.render_cache.surfaces.pop(key, None)
+
+    def get_chunk(self, chunk_x, chunk_y):
+        key = (chunk_x, chunk_y)
+        chunk = self.chunks.get(key)
+        if chunk is None:
+            if self.loader is not None:
+                self.loader.cancel(key)
+            chunk = self.load_chunk(key)
+            self.chunks[key] = chunk
+            self.chunk_loads += 1
+            while len(self.chunks) > self.max_chunks:
+                self.evict_chunk()
+        else:
+            self.chunks.move_to_end(key)
+        return chunk
+
+    def load_around(self, x, y, radius):
+        # Touch every chunk within radius tiles so the area around the
+        # player/camera is generated ahead of time and stays resident. With
+        # a loader, missing chunks are queued nearest first instead.
+        size = self.chunk_size
+        first_y = max(y - radius, 0) // size
+        last_y = min(y + radius, self.rows - 1) // size
+        requests = []
+        for chunk_x in range((x - radius) // size, (x + radius) // size + 1):
+            for chunk_y in range(first_y, last_y + 1):
+                key = (chunk_x, chunk_y)
+                if self.loader is None or key in self.chunks:
+                    self.get_chunk(chunk_x, chunk_y)
+                else:
+                    distance_x = chunk_x * size + size // 2 - x
+                    distance_y = chunk_y * size + size // 2 - y
+                    requests.append((distance_x * distance_x + distance_y * distance_y, key))
+        if self.loader is not None:
+            self.loader.request(requests)
+
+    def chunk_ready(self, chunk_x, chunk_y):
+        return self.loader is None or (chunk_x, chunk_y) in self.chunks
+
+    def chunk_blocks(self, chunk_x, chunk_y, size):
+        # The render cache uses the world's own chunks
+        return self.get_chunk(chunk_x, chunk_y).blocks
+
+    def draw(self, surface, camera_x=0, camera_y=0):
+        self.render_cache.draw(surface, camera_x, camera_y)
+
+    def in_bounds(self, x, y):
+        return 0 <= y < self.rows
+
+    def get_block(self, x, y):
+        if not 0 <= y < self.rows:
+            return None
+        size = self.chunk_size
+        chunk = self.get_chunk(x // size, y // size)
+        return chunk.blocks.data[(x % size) * size + y % size]
+
+    def set_block(self, x, y, block_type):
+        if not 0 <= y < self.rows:
+            return
+        size = self.chunk_size
+        chunk = self.get_chunk(x // size, y // size)
+        index = (x % size) * size + y % size
+        old_block = chunk.blocks.data[index]
+        if old_block != block_type:
+            chunk.blocks.data[index] = block_type
+            chunk.dirty = True
+            self.render_cache.invalidate(x, y)
+            for listener in self.listeners:
+                listener(x, y, old_block, block_type)
 
 class World:
     def __init__(self, columns, rows):
         self.columns = columns
         self.rows = rows
-        # Initialize grid with air blocks
-        self.grid = [[BLOCK_AIR for _ in range(self.rows)] for _ in range(self.columns)]
+        # Initialize grid with air blocks, one byte per cell
+        self.grid = BlockGrid(columns, rows, BLOCK_AIR)
 
         # Create some ground layers
         ground_height = self.rows // 3
-        for x in range(self.columns):
-            for y in range(self.rows - ground_height, self.rows):
-                # Bottom layer stone, upper layers dirt, top dirt replaced by grass
-                if y == self.rows - 1:
-                    self.grid[x][y] = BLOCK_STONE
-                elif y >= self.rows - ground_height + 2:
-                    self.grid[x][y] = BLOCK_DIRT
-                else:
-                    self.grid[x][y] = BLOCK_GRASS
+        ground_top = self.rows - ground_height
+        # Bottom layer stone, upper layers dirt, top two layers grass
+        self.grid.fill_region(0, ground_top, columns, 2, BLOCK_GRASS)
+        self.grid.fill_region(0, ground_top + 2, columns, ground_height - 2, BLOCK_DIRT)
+        self.grid.fill_region(0, rows - 1, columns, 1, BLOCK_STONE)
+
+        self.render_cache = ChunkRenderCache(self)
+        # Called as listener(x, y, old_block, new_block) after a block changes
+        self.listeners = []
+        # The whole world is resident from the start
+        self.chunk_loads = 0
     
-    def draw(self, surface):
-        for x in range(self.columns):
-            for y in range(self.rows):
-                block = self.grid[x][y]
-                if block != BLOCK_AIR:
-                    color = BLOCK_TYPES.get(block, COLOR_GRASS)
-                    rect = pygame.Rect(x * TILE_SIZE, y * TILE_SIZE, TILE_SIZE, TILE_SIZE)
-                    pygame.draw.rect(surface, color, rect)
-                    # Draw block borders for nicer look
-                    pygame.draw.rect(surface, (50, 50, 50), rect, 1)
+    def draw(self, surface, camera_x=0, camera_y=0):
+        # Blocks are drawn from cached chunk surfaces, see ChunkRenderCache
+        self.render_cache.draw(surface, camera_x, camera_y)
         
+    def load_around(self, x, y, radius):
+        # The whole world is always resident
+        pass
+
+    def close(self):
+        # Nothing is loaded in the background or kept open
+        pass
+
+    def chunk_ready(self, chunk_x, chunk_y):
+        return True
+
+    def chunk_blocks(self, chunk_x, chunk_y, size):
+        # Cells outside the world come back as air
+        return self.grid.copy_region(chunk_x * size, chunk_y * size, size, size)
+
     def in_bounds(self, x, y):
-        return 0 <= x < self.columns and 0 <= y < self.rows
+        return self.grid.in_bounds(x, y)
     
     def get_block(self, x, y):
-        if not self.in_bounds(x, y):
-            return None
-        return self.grid[x][y]
+        return self.grid.get_block(x, y)
     
     def set_block(self, x, y, block_type):
-        if self.in_bounds(x, y):
-            self.grid[x][y] = block_type
+        old_block = self.grid.get_block(x, y)
+        if old_block not in (None, block_type):
+            self.grid.set_block(x, y, block_type)
+            # Only the chunk holding this cell has to be redrawn
+            self.render_cache.invalidate(x, y)
+            for listener in self.listeners:
+                listener(x, y, old_block, block_type)
+
+def can_move(world, x, y, target_x, target_y):
+    # Check collision with blocks. Can only move if target block is air
+    if not world.in_bounds(target_x, target_y) or world.get_block(target_x, target_y) != BLOCK_AIR:
+        return False
+    # Basic gravity support: Player can only move if the block below target is not air (we stand on blocks)
+    # or player can move on block itself if the target_block is air
+    return target_y == y or target_y == world.rows - 1 or world.get_block(target_x, target_y + 1) != BLOCK_AIR
 
 class Player:
-    def __init__(self, world):
+    def __init__(self, world, x=None):
         # Start position on top of grass layer near center
-        self.x = world.columns // 2
+        self.x = world.columns // 2 if x is None else x
         self.y = 0
         # Find surface y position starting from top
         for y_check in range(world.rows):
@@ -118,15 +494,9 @@ class Player:
         if self.move_x != 0 or self.move_y != 0:
             target_x = self.x + self.move_x
             target_y = self.y + self.move_y
-            # Check collision with blocks. Can only move if target block is air
-            if self.world.in_bounds(target_x, target_y):
-                target_block = self.world.get_block(target_x, target_y)
-                below_block = self.world.get_block(target_x, target_y + 1)
-                # Basic gravity support: Player can only move if the block below target is not air (we stand on blocks)
-                # or player can move on block itself if the target_block is air
-                if (target_block == BLOCK_AIR and (below_block != BLOCK_AIR or target_y == self.world.rows - 1)) or (target_block == BLOCK_AIR and target_y == self.y):
-                    self.x = target_x
-                    self.y = target_y
+            if can_move(self.world, self.x, self.y, target_x, target_y):
+                self.x = target_x
+                self.y = target_y
 
         # Smooth position update for nicer movement
         target_pos_x = self.x * TILE_SIZE
@@ -136,11 +506,15 @@ class Player:
         self.pos_x += (target_pos_x - self.pos_x) * min(lerp_speed * dt, 1)
         self.pos_y += (target_pos_y - self.pos_y) * min(lerp_speed * dt, 1)
 
-    def draw(self, surface):
-        rect = pygame.Rect(self.pos_x, self.pos_y, TILE_SIZE, TILE_SIZE)
+    def screen_rect(self, camera_x=0, camera_y=0):
+        # Where the player is drawn; the shadow is inside it
+        return pygame.Rect(self.pos_x - camera_x, self.pos_y - camera_y, TILE_SIZE, TILE_SIZE)
+
+    def draw(self, surface, camera_x=0, camera_y=0):
+        rect = self.screen_rect(camera_x, camera_y)
         pygame.draw.rect(surface, COLOR_PLAYER, rect)
         # Draw subtle shadow
-        shadow_rect = pygame.Rect(self.pos_x + 5, self.pos_y + TILE_SIZE - 8, TILE_SIZE - 10, 5)
+        shadow_rect = pygame.Rect(rect.x + 5, rect.y + TILE_SIZE - 8, TILE_SIZE - 10, 5)
         pygame.draw.ellipse(surface, (0, 0, 0, 100), shadow_rect)
 
 def draw_grid(surface, columns, rows, tile_size):
@@ -149,18 +523,21 @@ def draw_grid(surface, columns, rows, tile_size):
     for y in range(rows):
         pygame.draw.line(surface, (200, 200, 200, 20), (0, y * tile_size), (columns * tile_size, y * tile_size))
 
-def draw_ui(surface, selected_block):
+# Text is only rendered again when it changes
+CONTROLS_TEXT = engine.CachedText(FONT_NAME, FONT_SIZE, COLOR_TEXT)
+SELECTED_TEXT = engine.CachedText(FONT_NAME, FONT_SIZE, COLOR_TEXT)
+
+def draw_ui(surface, selected_block, block_keys):
     # Panel background
-    panel_height = 60
-    panel_rect = pygame.Rect(0, SCREEN_HEIGHT - panel_height, SCREEN_WIDTH, panel_height)
-    pygame.draw.rect(surface, COLOR_UI_BG, panel_rect)
+    pygame.draw.rect(surface, COLOR_UI_BG, PANEL_RECT)
 
     # Text: controls and selected block
-    text1 = FONT.render("Arrow keys or WASD to move. Left-click to place block. Right-click to remove block.", True, COLOR_TEXT)
-    surface.blit(text1, (10, SCREEN_HEIGHT - panel_height + 5))
+    text1 = CONTROLS_TEXT.render("Arrow keys or WASD to move. Left-click to place block. Right-click to remove block.")
+    surface.blit(text1, (10, PANEL_RECT.top + 5))
 
-    text2 = FONT.render(f"Selected block: {block_name(selected_block)} (press keys 1-3 to change)", True, COLOR_TEXT)
-    surface.blit(text2, (10, SCREEN_HEIGHT - panel_height + 30))
+    keys = ", ".join(pygame.key.name(key) for key in sorted(block_keys))
+    text2 = SELECTED_TEXT.render(f"Selected block: {block_name(selected_block)} (press keys {keys} to change)")
+    surface.blit(text2, (10, PANEL_RECT.top + 30))
 
 def block_name(block_type):
     if block_type == BLOCK_GRASS:
@@ -169,65 +546,179 @@ def block_name(block_type):
         return "Dirt"
     elif block_type == BLOCK_STONE:
         return "Stone"
+    elif block_type == BLOCK_TORCH:
+        return "Torch"
+    elif block_type == BLOCK_SAND:
+        return "Sand"
+    elif block_type == BLOCK_WATER:
+        return "Water"
     return "None"
 
-def main():
-    clock = pygame.time.Clock()
-    world = World(GRID_COLUMNS, GRID_ROWS)
-    player = Player(world)
-    selected_block = BLOCK_GRASS
-
-    running = True
-    while running:
-        dt = clock.tick(60) / 1000  # delta time in seconds
-
-        for event in pygame.event.get():
-            if event.type == pygame.QUIT:
-                running = False
-            elif event.type == pygame.KEYDOWN:
-                # Change selected block
-                if event.key == pygame.K_1:
-                    selected_block = BLOCK_GRASS
-                elif event.key == pygame.K_2:
-                    selected_block = BLOCK_DIRT
-                elif event.key == pygame.K_3:
-                    selected_block = BLOCK_STONE
-            elif event.type == pygame.MOUSEBUTTONDOWN:
-                mouse_x, mouse_y = pygame.mouse.get_pos()
-                grid_x = mouse_x // TILE_SIZE
-                grid_y = mouse_y // TILE_SIZE
-                # Left click to place block if space is empty and not player stands there
-                if event.button == 1:
-                    if world.in_bounds(grid_x, grid_y):
-                        if world.get_block(grid_x, grid_y) == BLOCK_AIR and not (grid_x == player.x and grid_y == player.y):
-                            world.set_block(grid_x, grid_y, selected_block)
-                # Right click to remove block if block is not air and not under player
-                elif event.button == 3:
-                    if world.in_bounds(grid_x, grid_y):
-                        if world.get_block(grid_x, grid_y) != BLOCK_AIR and not (grid_x == player.x and grid_y == player.y):
-                            world.set_block(grid_x, grid_y, BLOCK_AIR)
-
-        keys = pygame.key.get_pressed()
+class Game(engine.Game):
+    size = (SCREEN_WIDTH, SCREEN_HEIGHT)
+    caption = "Mini Minecraft - Pygame Edition"
+    # Recorded sessions start from a fresh world and never touch the save
+    replay_options = {"save_file": None}
+    # Keys that select a block type. Games that give more block types a use
+    # extend it.
+    BLOCK_KEYS = {
+        pygame.K_1: BLOCK_GRASS,
+        pygame.K_2: BLOCK_DIRT,
+        pygame.K_3: BLOCK_STONE,
+    }
+
+    def __init__(self, world=None, save_file=SAVE_FILE, seed=None, loader_threads=LOADER_THREADS):
+        super().__init__(seed)
+        if world is None:
+            if save_file is not None and os.path.exists(save_file):
+                world = InfiniteWorld.open(save_file)
+            else:
+                world = InfiniteWorld(GRID_ROWS, path=save_file)
+            # Exploring never waits for terrain generation or chunk rendering
+            if loader_threads:
+                world.start_loader(loader_threads)
+        self.world = world
+        self.save_file = save_file
+        self.player = Player(world, x=0)
+        self.selected_block = BLOCK_GRASS
+        self.camera_x = 0
+
+        # Only regions that changed since the last frame are redrawn
+        self.dirty = engine.DirtyRects(self.size)
+        self.drawn_camera_x = None
+        self.drawn_chunk_loads = None
+        self.drawn_selected_block = None
+        world.listeners.append(self.on_block_changed)
+
+    def on_block_changed(self, x, y, old_block, new_block):
+        self.dirty.add((x * TILE_SIZE - self.camera_x, y * TILE_SIZE, TILE_SIZE, TILE_SIZE))
+
+    def handle_event(self, event):
+        world = self.world
+        player = self.player
+        if event.type == pygame.KEYDOWN:
+            # Change selected block
+            if event.key in self.BLOCK_KEYS:
+                self.selected_block = self.BLOCK_KEYS[event.key]
+            # Quick save, only changed chunks are written
+            elif event.key == pygame.K_F5 and self.save_file is not None:
+                world.save(self.save_file)
+        elif event.type == pygame.MOUSEBUTTONDOWN:
+            mouse_x, mouse_y = event.pos
+            grid_x = (mouse_x + self.camera_x) // TILE_SIZE
+            grid_y = mouse_y // TILE_SIZE
+            # Left click to place block if space is empty and not player stands there
+            if event.button == 1:
+                if world.in_bounds(grid_x, grid_y):
+                    if world.get_block(grid_x, grid_y) == BLOCK_AIR and not (grid_x == player.x and grid_y == player.y):
+                        world.set_block(grid_x, grid_y, self.selected_block)
+            # Right click to remove block if block is not air and not under player
+            elif event.button == 3:
+                if world.in_bounds(grid_x, grid_y):
+                    if world.get_block(grid_x, grid_y) != BLOCK_AIR and not (grid_x == player.x and grid_y == player.y):
+                        world.set_block(grid_x, grid_y, BLOCK_AIR)
+
+    def update(self, dt, keys):
+        world = self.world
+        # Chunks finished in the background are installed between ticks
+        if getattr(world, "loader", None) is not None:
+            with self.profiler.section("loader"):
+                world.pump_loader()
+
+        player = self.player
         player.handle_input(keys)
         player.update(dt)
-        
+
+        # Camera follows the player; keep the chunks around it resident
+        self.camera_x = int(player.pos_x) + TILE_SIZE // 2 - SCREEN_WIDTH // 2
+        with self.profiler.section("streaming"):
+            self.world.load_around(player.x, player.y, GRID_COLUMNS)
+
+    def highlight_rect(self):
+        # Grid cell under the mouse in screen coordinates, None if out of bounds
+        mouse_x, mouse_y = pygame.mouse.get_pos()
+        mouse_grid_x, mouse_grid_y = (mouse_x + self.camera_x) // TILE_SIZE, mouse_y // TILE_SIZE
+        if not self.world.in_bounds(mouse_grid_x, mouse_grid_y):
+            return None
+        return pygame.Rect(mouse_grid_x * TILE_SIZE - self.camera_x, mouse_grid_y * TILE_SIZE, TILE_SIZE, TILE_SIZE)
+
+    def draw_scene(self, surface, highlight_rect):
+        camera_x = self.camera_x
+
         # Draw everything
-        SCREEN.fill(COLOR_SKY)
-        world.draw(SCREEN)
-        player.draw(SCREEN)
-        draw_ui(SCREEN, selected_block)
+        surface.fill(COLOR_SKY)
+        self.draw_world(surface)
+        self.player.draw(surface, camera_x)
+        draw_ui(surface, self.selected_block, self.BLOCK_KEYS)
 
         # Draw a highlight box under mouse on grid if in bounds
-        mouse_grid_x, mouse_grid_y = pygame.mouse.get_pos()[0] // TILE_SIZE, pygame.mouse.get_pos()[1] // TILE_SIZE
-        if world.in_bounds(mouse_grid_x, mouse_grid_y):
-            highlight_rect = pygame.Rect(mouse_grid_x * TILE_SIZE, mouse_grid_y * TILE_SIZE, TILE_SIZE, TILE_SIZE)
-            pygame.draw.rect(SCREEN, COLOR_HIGHLIGHT, highlight_rect, 3)
-        
-        pygame.display.flip()
-    
+        if highlight_rect is not None:
+            pygame.draw.rect(surface, COLOR_HIGHLIGHT, highlight_rect, 3)
+
+    def draw_world(self, surface):
+        self.world.draw(surface, self.camera_x)
+
+    def draw(self, surface):
+        dirty = self.dirty
+        player = self.player
+        # Scrolling moves everything on screen, and newly loaded chunks may
+        # fill in parts that were drawn as sky
+        if self.camera_x != self.drawn_camera_x or self.world.chunk_loads != self.drawn_chunk_loads:
+            dirty.invalidate_all()
+            self.drawn_camera_x = self.camera_x
+            self.drawn_chunk_loads = self.world.chunk_loads
+        if self.selected_block != self.drawn_selected_block:
+            dirty.add(PANEL_RECT)
+            self.drawn_selected_block = self.selected_block
+        dirty.track("player", player.screen_rect(self.camera_x))
+        highlight_rect = self.highlight_rect()
+        dirty.track("highlight", highlight_rect)
+
+        # Redraw the scene clipped to each changed region
+        rects = dirty.collect()
+        for rect in rects:
+            surface.set_clip(rect)
+            self.draw_scene(surface, highlight_rect)
+        surface.set_clip(None)
+        return rects
+
+    def close(self):
+        if self.save_file is not None:
+            self.world.save(self.save_file)
+        self.world.close()
+
+def terrain_block(surface_y, y, rows):
+    # Block at height y of a column whose grass is at surface_y, cell by cell
+    if y == rows - 1 or y >= surface_y + 4:
+        return BLOCK_STONE
+    if y > surface_y:
+        return BLOCK_DIRT
+    if y == surface_y:
+        return BLOCK_GRASS
+    return BLOCK_AIR
+
+def check_terrain(rows_options=(15, 40, 64, 128), columns=256, seed=WORLD_SEED):
+    # Compares the chunked generator with the terrain rules applied to the
+    # whole column at once; returns the number of mismatched cells
+    mismatched = 0
+    for rows in rows_options:
+        world = InfiniteWorld(rows, seed=seed, max_chunks=(columns // CHUNK_SIZE + 1) * (rows // CHUNK_SIZE + 1))
+        reference = World(columns, rows)
+        for x in range(columns):
+            surface_y = rows - terrain_height(seed, x, rows)
+            for y in range(rows):
+                reference.grid.set_block(x, y, terrain_block(surface_y, y, rows))
+        wrong = sum(1 for x in range(columns) for y in range(rows) if world.get_block(x, y) != reference.get_block(x, y))
+        print(f"rows {rows:>4}: {wrong} mismatched cells")
+        mismatched += wrong
+    return mismatched
+
+def main():
+    engine.run(Game())
     pygame.quit()
     sys.exit()
 
 if __name__ == "__main__":
+    if "--check-terrain" in sys.argv[1:]:
+        sys.exit(1 if check_terrain() else 0)
     main()
-
@@ -0,0 +1,327 @@
+import sys
+import time
+from array import array
+from contextlib import contextmanager
+
+import pygame
+
+import engine
+import fakemc
+from blockgrid import BlockGrid
+
+# Undo/redo for fakemc block edits, plus bulk edit tools.
+#
+# EditJournal listens to the world's set_block calls and records each change
+# as (x, y, old block, new block) in four preallocated arrays used as a ring
+# buffer, so recording a change stores four numbers and allocates nothing.
+# Changes are grouped into transactions, (first, end) ranges of change
+# numbers:
+#
+#   with journal.transaction():
+#       fill_rect(world, 0, 0, 100, 10, fakemc.BLOCK_STONE)
+#   journal.undo()
+#   journal.redo()
+#
+# A set_block outside a transaction is a transaction of its own, so every
+# click is one undo step. Undo walks a transaction's changes backwards
+# writing the old blocks and redo walks them forwards writing the new ones,
+# so both cost one set_block per changed cell, never a copy of the world.
+# When the ring fills up the oldest transactions are forgotten; a single
+# transaction bigger than the whole ring cannot be undone.
+
+JOURNAL_CAPACITY = 1 << 20
+# Most cells one flood fill changes, the world may be endless
+FLOOD_LIMIT = 100000
+
+class EditJournal:
+    def __init__(self, world, capacity=JOURNAL_CAPACITY):
+        self.world = world
+        self.capacity = capacity
+        self.xs = array("i", bytes(4 * capacity))
+        self.ys = array("i", bytes(4 * capacity))
+        self.old = array("B", bytes(capacity))
+        self.new = array("B", bytes(capacity))
+        # Number of the next change; change n is stored at n % capacity
+        self.head = 0
+        # [first, end) change numbers of each transaction, oldest first
+        self.transactions = []
+        # Transactions at the end of the list that are undone and can be redone
+        self.undone = 0
+        # Start of the open transaction and how deeply it is nested
+        self.start = None
+        self.depth = 0
+        self.replaying = False
+        world.listeners.append(self.on_block_changed)
+
+    def on_block_changed(self, x, y, old_block, new_block):
+        if self.replaying:
+            return
+        if self.start is None:
+            # A single edit is a transaction of its own
+            self.begin()
+            self.record(x, y, old_block, new_block)
+            self.commit()
+        else:
+            self.record(x, y, old_block, new_block)
+
+    def record(self, x, y, old_block, new_block):
+        i = self.head % self.capacity
+        self.xs[i] = x
+        self.ys[i] = y
+        self.old[i] = old_block
+        self.new[i] = new_block
+        self.head += 1
+
+    def begin(self):
+        # Redo history is dropped by a new edit
+        if self.undone:
+            del self.transactions[-self.undone:]
+            self.undone = 0
+            self.head = self.transactions[-1][1] if self.transactions else self.head
+        self.start = self.head
+
+    def commit(self):
+        start, self.start = self.start, None
+        if self.head == start:
+            return
+        if self.head - start > self.capacity:
+            # Overwrote its own first changes, nothing left can be undone
+            self.transactions.clear()
+            return
+        self.transactions.append((start, self.head))
+        # Forget transactions whose changes have been overwritten
+        oldest = self.head - self.capacity
+        dropped = 0
+        while self.transactions[dropped][0] < oldest:
+            dropped += 1
+        del self.transactions[:dropped]
+
+    @contextmanager
+    def transaction(self):
+        if self.depth == 0:
+            self.begin()
+        self.depth += 1
+        try:
+            yield self
+        finally:
+            self.depth -= 1
+            if self.depth == 0:
+                self.commit()
+
+    def can_undo(self):
+        return self.undone < len(self.transactions)
+
+    def can_redo(self):
+        return self.undone > 0
+
+    def undo(self):
+        # Returns the number of cells changed back
+        if self.start is not None or not self.can_undo():
+            return 0
+        start, end = self.transactions[-1 - self.undone]
+        self.undone += 1
+        self.replay(range(end - 1, start - 1, -1), self.old)
+        return end - start
+
+    def redo(self):
+        if self.start is not None or not self.can_redo():
+            return 0
+        start, end = self.transactions[-self.undone]
+        self.undone -= 1
+        self.replay(range(start, end), self.new)
+        return end - start
+
+    def replay(self, changes, blocks):
+        capacity = self.capacity
+        xs = self.xs
+        ys = self.ys
+        set_block = self.world.set_block
+        self.replaying = True
+        try:
+            for n in changes:
+                i = n % capacity
+                set_block(xs[i], ys[i], blocks[i])
+        finally:
+            self.replaying = False
+
+    def stats(self):
+        return {
+            "transactions": len(self.transactions),
+            "undone": self.undone,
+            "changes": sum(end - start for start, end in self.transactions),
+        }
+
+# Bulk edits; wrap them in journal.transaction() to undo them in one step.
+# Each returns the number of cells it changed.
+
+def fill_rect(world, x, y, width, height, block_type):
+    get_block = world.get_block
+    set_block = world.set_block
+    changed = 0
+    for cell_x in range(x, x + width):
+        for cell_y in range(y, y + height):
+            old_block = get_block(cell_x, cell_y)
+            if old_block is not None and old_block != block_type:
+                set_block(cell_x, cell_y, block_type)
+                changed += 1
+    return changed
+
+def flood_fill(world, x, y, block_type, limit=FLOOD_LIMIT):
+    # Replaces the area of same blocks connected to (x, y). Cells are
+    # filled as they are found, so the filled block marks them as visited.
+    target = world.get_block(x, y)
+    if target is None or target == block_type:
+        return 0
+    get_block = world.get_block
+    set_block = world.set_block
+    set_block(x, y, block_type)
+    changed = 1
+    stack_x = array("i", [x])
+    stack_y = array("i", [y])
+    while stack_x and changed < limit:
+        x = stack_x.pop()
+        y = stack_y.pop()
+        for next_x, next_y in ((x - 1, y), (x + 1, y), (x, y - 1), (x, y + 1)):
+            if get_block(next_x, next_y) == target and changed < limit:
+                set_block(next_x, next_y, block_type)
+                changed += 1
+                stack_x.append(next_x)
+                stack_y.append(next_y)
+    return changed
+
+def copy_region(world, x, y, width, height):
+    # BlockGrid of the region; cells outside the world come back as air
+    if hasattr(world, "grid"):
+        return world.grid.copy_region(x, y, width, height)
+    region = BlockGrid(width, height)
+    for local_x in range(width):
+        for local_y in range(height):
+            block = world.get_block(x + local_x, y + local_y)
+            if block is not None:
+                region.data[local_x * height + local_y] = block
+    return region
+
+def paste_region(world, region, x, y, skip_air=False):
+    get_block = world.get_block
+    set_block = world.set_block
+    data = region.data
+    height = region.rows
+    changed = 0
+    for local_x in range(region.columns):
+        for local_y in range(height):
+            block = data[local_x * height + local_y]
+            if skip_air and block == fakemc.BLOCK_AIR:
+                continue
+            old_block = get_block(x + local_x, y + local_y)
+            if old_block is not None and old_block != block:
+                set_block(x + local_x, y + local_y, block)
+                changed += 1
+    return changed
+
+class EditGame(fakemc.Game):
+    # fakemc with undo and bulk tools:
+    #   Ctrl+Z / Ctrl+Y        undo / redo
+    #   Shift + drag           fill the rectangle with the selected block
+    #                          (left button) or clear it (right button)
+    #   F                      flood fill the area under the mouse
+    #   Ctrl+C / Ctrl+V        copy the last rectangle / paste it at the mouse
+    caption = "Mini Minecraft - Editor"
+
+    def __init__(self, world=None, save_file=fakemc.SAVE_FILE, seed=None, loader_threads=fakemc.LOADER_THREADS):
+        super().__init__(world=world, save_file=save_file, seed=seed, loader_threads=loader_threads)
+        self.journal = EditJournal(self.world)
+        # Shift is tracked from key events so recordings replay the same
+        self.shift = False
+        self.drag_start = None
+        self.selection = None
+        self.clipboard = None
+        self.mouse_cell = (0, 0)
+
+    def cell_at(self, pos):
+        return (pos[0] + self.camera_x) // fakemc.TILE_SIZE, pos[1] // fakemc.TILE_SIZE
+
+    def handle_event(self, event):
+        if event.type in (pygame.KEYDOWN, pygame.KEYUP) and event.key in (pygame.K_LSHIFT, pygame.K_RSHIFT):
+            self.shift = event.type == pygame.KEYDOWN
+        if event.type == pygame.MOUSEMOTION:
+            self.mouse_cell = self.cell_at(event.pos)
+        elif event.type == pygame.KEYDOWN and event.mod & pygame.KMOD_CTRL:
+            if event.key == pygame.K_z:
+                self.journal.undo()
+            elif event.key == pygame.K_y:
+                self.journal.redo()
+            elif event.key == pygame.K_c and self.selection is not None:
+                self.clipboard = copy_region(self.world, *self.selection)
+            elif event.key == pygame.K_v and self.clipboard is not None:
+                with self.journal.transaction():
+                    paste_region(self.world, self.clipboard, *self.mouse_cell)
+            return
+        elif event.type == pygame.KEYDOWN and event.key == pygame.K_f:
+            with self.journal.transaction():
+                flood_fill(self.world, *self.mouse_cell, self.selected_block)
+            return
+        elif event.type == pygame.MOUSEBUTTONDOWN and self.shift and event.button in (1, 3):
+            self.drag_start = self.cell_at(event.pos)
+            return
+        elif event.type == pygame.MOUSEBUTTONUP and self.drag_start is not None:
+            (start_x, start_y), (end_x, end_y) = self.drag_start, self.cell_at(event.pos)
+            self.drag_start = None
+            x, y = min(start_x, end_x), min(start_y, end_y)
+            self.selection = (x, y, abs(end_x - start_x) + 1, abs(end_y - start_y) + 1)
+            block_type = self.selected_block if event.button == 1 else fakemc.BLOCK_AIR
+            with self.journal.transaction():
+                fill_rect(self.world, *self.selection, block_type)
+            return
+        super().handle_event(event)
+
+def benchmark(columns=1200, rows=128):
+    # Fill, undo and redo of about 100k cells compared with copying the grid
+    world = fakemc.World(columns, rows)
+    journal = EditJournal(world)
+    before = bytes(world.grid.data)
+    width, height = 1000, 100
+
+    start = time.perf_counter()
+    with journal.transaction():
+        changed = fill_rect(world, 0, 0, width, height, fakemc.BLOCK_STONE)
+    fill = time.perf_counter() - start
+    after = bytes(world.grid.data)
+    start = time.perf_counter()
+    journal.undo()
+    undo = time.perf_counter() - start
+    assert bytes(world.grid.data) == before
+    start = time.perf_counter()
+    journal.redo()
+    redo = time.perf_counter() - start
+    assert bytes(world.grid.data) == after
+
+    start = time.perf_counter()
+    journal.undo()
+    with journal.transaction():
+        flooded = flood_fill(world, 0, 0, fakemc.BLOCK_DIRT)
+    flood = time.perf_counter() - start
+
+    print(f"world {columns} x {rows}, journal of {journal.capacity:,} changes ({journal.capacity * 10 / 2 ** 20:.0f} MiB)")
+    print(f"  fill   {changed:,} cells {fill * 1000:7.1f} ms")
+    print(f"  undo   {changed:,} cells {undo * 1000:7.1f} ms")
+    print(f"  redo   {changed:,} cells {redo * 1000:7.1f} ms")
+    print(f"  flood  {flooded:,} cells {flood * 1000:7.1f} ms (including an undo)")
+
+    # One undo step on a single cell costs the same however big the world is
+    world.set_block(5, 5, fakemc.BLOCK_GRASS)
+    start = time.perf_counter()
+    for _ in range(1000):
+        journal.undo()
+        journal.redo()
+    print(f"  single cell undo + redo {(time.perf_counter() - start) * 1000:.3f} us")
+
+def main():
+    engine.run(EditGame())
+    pygame.quit()
+    sys.exit()
+
+if __name__ == "__main__":
+    if "--benchmark" in sys.argv[1:]:
+        benchmark()
+    else:
+        main()
@@ -0,0 +1,493 @@
+import sys
+import time
+from collections import deque
+
+import pygame
+
+import engine
+import fakemc
+
+# Lighting for fakemc worlds. Every cell has two light levels from 0 to
+# MAX_LIGHT, kept in bytearrays laid out like the world's BlockGrid
+# (x * rows + y):
+#
+#   sky light    MAX_LIGHT straight down from the top of the world until the
+#                first opaque block, then spreading like any other light
+#   block light  from emitting blocks (torches)
+#
+# Light spreads to the four neighbours, losing one level per step, and never
+# enters opaque blocks. When a block changes only the affected region is
+# updated: a removal BFS clears the light that came through or from the
+# changed cell and collects the still lit cells on its border, then an add
+# BFS spreads light from those cells (and from a new emitter) again.
+#
+# A finite World is lit as a whole. An endless InfiniteWorld is lit in a
+# window of whole chunk columns around what is drawn: columns coming into
+# view are lit from their blocks (plus LIGHT_MARGIN columns on each side,
+# since light cannot travel further) and columns far from the view are
+# dropped again. An edit too close to the edge of the window to be updated
+# incrementally drops the columns it can reach instead, so they are lit from
+# scratch when they are drawn next.
+#
+# Drawing darkens each chunk with a cached tint surface that is rebuilt only
+# when light in or next to the chunk changed. Opaque blocks are shaded by the
+# brightest light reaching one of their faces.
+
+MAX_LIGHT = 15
+# Columns past which a block cannot change the light, and the other way round
+LIGHT_MARGIN = MAX_LIGHT + 1
+# Alpha of the tint over completely dark cells
+MAX_DARKNESS = 210
+# Most columns of an endless world kept lit
+LIGHT_WINDOW_COLUMNS = 256
+
+# Light given off by each block type
+EMISSION = {
+    fakemc.BLOCK_TORCH: 14,
+}
+
+# Block types light does not pass through
+OPAQUE = {fakemc.BLOCK_GRASS, fakemc.BLOCK_DIRT, fakemc.BLOCK_STONE, fakemc.BLOCK_SAND}
+
+# Lookup tables by block type
+OPAQUE_TABLE = bytes(1 if block in OPAQUE else 0 for block in range(256))
+EMISSION_TABLE = bytes(EMISSION.get(block, 0) for block in range(256))
+
+def column_blocks(world, first, end, chunk_size=fakemc.CHUNK_SIZE):
+    # Blocks of columns [first, end) laid out ((x - first) * rows + y)
+    rows = world.rows
+    data = bytearray((end - first) * rows)
+    for chunk_x in range(first // chunk_size, (end - 1) // chunk_size + 1):
+        for chunk_y in range((rows - 1) // chunk_size + 1):
+            blocks = world.chunk_blocks(chunk_x, chunk_y, chunk_size).data
+            top = chunk_y * chunk_size
+            height = min(chunk_size, rows - top)
+            for local_x in range(chunk_size):
+                x = chunk_x * chunk_size + local_x
+                if first <= x < end:
+                    start = (x - first) * rows + top
+                    data[start:start + height] = blocks[local_x * chunk_size:local_x * chunk_size + height]
+    return data
+
+class LightGrid:
+    # Light of the columns [x0, x0 + columns) of a world whose blocks are in
+    # `data`, both laid out ((x - x0) * rows + y). Light from outside the
+    # columns is not seen. on_change(x, y) is called for every cell whose
+    # light changes after the grid was created.
+    def __init__(self, x0, columns, rows, data, sky=None, block=None, on_change=None):
+        self.x0 = x0
+        self.columns = columns
+        self.rows = rows
+        self.data = data
+        self.opaque = OPAQUE_TABLE
+        self.emission = EMISSION_TABLE
+        self.on_change = None
+        if sky is None:
+            self.sky = bytearray(columns * rows)
+            self.block = bytearray(columns * rows)
+            self.compute()
+        else:
+            self.sky = sky
+            self.block = block
+        self.on_change = on_change
+
+    def contains(self, x):
+        return self.x0 <= x < self.x0 + self.columns
+
+    def index(self, x, y):
+        return (x - self.x0) * self.rows + y
+
+    def level(self, x, y):
+        i = (x - self.x0) * self.rows + y
+        return max(self.sky[i], self.block[i])
+
+    def neighbours(self, i):
+        rows = self.rows
+        y = i % rows
+        if y > 0:
+            yield i - 1
+        if y < rows - 1:
+            yield i + 1
+        if i >= rows:
+            yield i - rows
+        if i < len(self.sky) - rows:
+            yield i + rows
+
+    def compute(self):
+        # Full light calculation
+        data = self.data
+        opaque = self.opaque
+        rows = self.rows
+        sky = self.sky
+        block = self.block
+        sky[:] = bytes(len(sky))
+        block[:] = bytes(len(block))
+        sky_queue = deque()
+        block_queue = deque()
+        for x in range(self.columns):
+            column = x * rows
+            for y in range(rows):
+                i = column + y
+                if opaque[data[i]]:
+                    break
+                sky[i] = MAX_LIGHT
+                sky_queue.append(i)
+        for i, block_type in enumerate(data):
+            if self.emission[block_type]:
+                block[i] = self.emission[block_type]
+                block_queue.append(i)
+        self.spread(sky, sky_queue, True)
+        self.spread(block, block_queue, False)
+
+    def spread(self, light, queue, sky):
+        # Add BFS: every queued cell passes its light on to its neighbours
+        data = self.data
+        opaque = self.opaque
+        while queue:
+            i = queue.popleft()
+            level = light[i]
+            if level <= 1:
+                continue
+            for n in self.neighbours(i):
+                if opaque[data[n]]:
+                    continue
+                # Full sky light keeps going straight down
+                new_level = level if sky and level == MAX_LIGHT and n == i + 1 else level - 1
+                if light[n] < new_level:
+                    light[n] = new_level
+                    self.mark(n)
+                    queue.append(n)
+
+    def unspread(self, light, start, sky):
+        # Removal BFS from `start`: clears every cell lit through it and
+        # returns the cells around the cleared region that keep their light
+        # from elsewhere, to spread from again
+        removal = deque([(start, light[start])])
+        light[start] = 0
+        self.mark(start)
+        relight = deque()
+        while removal:
+            i, level = removal.popleft()
+            for n in self.neighbours(i):
+                neighbour_level = light[n]
+                if neighbour_level == 0:
+                    continue
+                # Below full sky light the level does not drop, so it still
+                # depends on this cell
+                sky_below = sky and level == MAX_LIGHT and neighbour_level == MAX_LIGHT and n == i + 1
+                if neighbour_level < level or sky_below:
+                    light[n] = 0
+                    self.mark(n)
+                    removal.append((n, neighbour_level))
+                else:
+                    relight.append(n)
+        return relight
+
+    def update(self, x, y, old_block, new_block):
+        # The block at (x, y) in `data` changed from old_block to new_block
+        i = (x - self.x0) * self.rows + y
+        self.mark(i)
+        now_opaque = self.opaque[new_block]
+        was_opaque = self.opaque[old_block]
+        for light, sky in ((self.sky, True), (self.block, False)):
+            if light[i] and (now_opaque or not sky and self.emission[old_block]):
+                # The cell stops passing on (or giving off) its light
+                queue = self.unspread(light, i, sky)
+            else:
+                queue = deque()
+            if was_opaque and not now_opaque:
+                # Light flows into the opened cell from its neighbours; the
+                # top row gets full sky light itself
+                queue.extend(self.neighbours(i))
+                if sky and y == 0:
+                    light[i] = MAX_LIGHT
+                    queue.append(i)
+            if not sky and self.emission[new_block] > light[i]:
+                light[i] = self.emission[new_block]
+                queue.append(i)
+            self.spread(light, queue, sky)
+
+    def mark(self, i):
+        if self.on_change is not None:
+            x, y = divmod(i, self.rows)
+            self.on_change(self.x0 + x, y)
+
+    def shade(self, x, y):
+        # Light a cell is drawn with
+        i = (x - self.x0) * self.rows + y
+        if not self.opaque[self.data[i]]:
+            return max(self.sky[i], self.block[i])
+        level = 0
+        for n in self.neighbours(i):
+            level = max(level, self.sky[n], self.block[n])
+        return level
+
+    def columns_slice(self, first, end):
+        # (data, sky, block) of columns [first, end)
+        start = (first - self.x0) * self.rows
+        stop = (end - self.x0) * self.rows
+        return self.data[start:stop], self.sky[start:stop], self.block[start:stop]
+
+class LightField:
+    def __init__(self, world, chunk_size=fakemc.CHUNK_SIZE, window_columns=LIGHT_WINDOW_COLUMNS):
+        self.world = world
+        self.rows = world.rows
+        self.chunk_size = chunk_size
+        self.chunk_pixels = chunk_size * fakemc.TILE_SIZE
+        self.window_columns = window_columns
+
+        # Tint surface per chunk (None when fully lit) and the chunks whose
+        # tint is out of date
+        self.tints = {}
+        self.changed_chunks = set()
+        # Cells whose light changed during the last update
+        self.touched = 0
+
+        if world.columns is None:
+            # Lit as it is drawn, see light_columns
+            self.grid = None
+        else:
+            self.grid = LightGrid(0, world.columns, world.rows, world.grid.data, on_change=self.mark)
+        world.listeners.append(self.on_block_changed)
+
+    def level(self, x, y):
+        # 0 for cells that are not lit (yet)
+        if self.grid is None or not self.grid.contains(x):
+            return 0
+        return self.grid.level(x, y)
+
+    def lit_grid(self, first, end):
+        # LightGrid of columns [first, end) of an endless world, lit with the
+        # blocks LIGHT_MARGIN columns around them
+        data = column_blocks(self.world, first - LIGHT_MARGIN, end + LIGHT_MARGIN, self.chunk_size)
+        around = LightGrid(first - LIGHT_MARGIN, end - first + 2 * LIGHT_MARGIN, self.rows, data)
+        return LightGrid(first, end - first, self.rows, *around.columns_slice(first, end), on_change=self.mark)
+
+    def light_columns(self, first, end):
+        # Makes sure columns [first, end) of an endless world are lit. The
+        # window only grows by whole chunk columns and never past
+        # window_columns; the side away from [first, end) gives way.
+        grid = self.grid
+        if grid is not None and grid.x0 <= first and end <= grid.x0 + grid.columns:
+            return
+        size = self.chunk_size
+        first = first // size * size
+        end = -(-end // size) * size
+        if grid is None or end < grid.x0 or first > grid.x0 + grid.columns:
+            self.set_window(self.lit_grid(first, end))
+            return
+        parts = []
+        if first < grid.x0:
+            parts.append(self.lit_grid(first, grid.x0))
+        parts.append(grid)
+        if end > grid.x0 + grid.columns:
+            parts.append(self.lit_grid(grid.x0 + grid.columns, end))
+        new_first = parts[0].x0
+        new_end = parts[-1].x0 + parts[-1].columns
+        data, sky, block = (bytearray().join(pieces) for pieces in zip(*(part.columns_slice(part.x0, part.x0 + part.columns) for part in parts)))
+        grid = LightGrid(new_first, new_end - new_first, self.rows, data, sky, block, on_change=self.mark)
+        if grid.columns > self.window_columns:
+            if first > new_first:
+                keep_first = min(first, new_end - self.window_columns)
+                grid = LightGrid(keep_first, new_end - keep_first, self.rows, *grid.columns_slice(keep_first, new_end), on_change=self.mark)
+            else:
+                keep_end = max(end, new_first + self.window_columns)
+                grid = LightGrid(new_first, keep_end - new_first, self.rows, *grid.columns_slice(new_first, keep_end), on_change=self.mark)
+        self.set_window(grid)
+
+    def set_window(self, grid):
+        # Tints of chunks that are no longer lit go
+        size = self.chunk_size
+        if grid is None:
+            self.tints.clear()
+        else:
+            first_chunk = grid.x0 // size
+            end_chunk = (grid.x0 + grid.columns) // size
+            for key in [key for key in self.tints if not first_chunk <= key[0] < end_chunk]:
+                del self.tints[key]
+        self.grid = grid
+
+    def drop_columns(self, first, end):
+        # Columns [first, end) of the window lose their light, which is
+        # worked out again when they are drawn next
+        grid = self.grid
+        size = self.chunk_size
+        first = max(first // size * size, grid.x0)
+        end = min(-(-end // size) * size, grid.x0 + grid.columns)
+        for chunk_x in range(first // size, end // size):
+            for chunk_y in range((self.rows - 1) // size + 1):
+                self.changed_chunks.add((chunk_x, chunk_y))
+        if first == grid.x0 and end == grid.x0 + grid.columns:
+            self.set_window(None)
+        elif first == grid.x0:
+            self.set_window(LightGrid(end, grid.x0 + grid.columns - end, self.rows, *grid.columns_slice(end, grid.x0 + grid.columns), on_change=self.mark))
+        else:
+            self.set_window(LightGrid(grid.x0, first - grid.x0, self.rows, *grid.columns_slice(grid.x0, first), on_change=self.mark))
+
+    def on_block_changed(self, x, y, old_block, new_block):
+        self.touched = 0
+        grid = self.grid
+        if self.world.columns is not None:
+            # The grid covers the world and works on its own blocks
+            grid.update(x, y, old_block, new_block)
+            return
+        if grid is None or not grid.x0 - LIGHT_MARGIN < x < grid.x0 + grid.columns + LIGHT_MARGIN:
+            # Too far away to change any lit cell
+            return
+        if grid.contains(x):
+            grid.data[grid.index(x, y)] = new_block
+        if x - LIGHT_MARGIN < grid.x0:
+            self.drop_columns(grid.x0, x + LIGHT_MARGIN)
+        elif x + LIGHT_MARGIN >= grid.x0 + grid.columns:
+            self.drop_columns(x - LIGHT_MARGIN + 1, grid.x0 + grid.columns)
+        else:
+            grid.update(x, y, old_block, new_block)
+
+    def mark(self, x, y):
+        # Light at (x, y) changed: its chunk and the chunks of its
+        # neighbours (which shade their faces by it) need a new tint
+        self.touched += 1
+        size = self.chunk_size
+        chunk_x, chunk_y = x // size, y // size
+        self.changed_chunks.add((chunk_x, chunk_y))
+        local_x, local_y = x % size, y % size
+        if local_x == 0:
+            self.changed_chunks.add((chunk_x - 1, chunk_y))
+        elif local_x == size - 1:
+            self.changed_chunks.add((chunk_x + 1, chunk_y))
+        if local_y == 0:
+            self.changed_chunks.add((chunk_x, chunk_y - 1))
+        elif local_y == size - 1:
+            self.changed_chunks.add((chunk_x, chunk_y + 1))
+
+    def render_tint(self, chunk_x, chunk_y):
+        size = self.chunk_size
+        grid = self.grid
+        tint = None
+        for local_x in range(size):
+            x = chunk_x * size + local_x
+            if grid is None or not grid.contains(x):
+                continue
+            for local_y in range(size):
+                y = chunk_y * size + local_y
+                if not 0 <= y < self.rows:
+                    continue
+                darkness = (MAX_LIGHT - grid.shade(x, y)) * MAX_DARKNESS // MAX_LIGHT
+                if darkness == 0:
+                    continue
+                if tint is None:
+                    tint = pygame.Surface((self.chunk_pixels, self.chunk_pixels), pygame.SRCALPHA)
+                tint.fill((0, 0, 0, darkness), (local_x * fakemc.TILE_SIZE, local_y * fakemc.TILE_SIZE, fakemc.TILE_SIZE, fakemc.TILE_SIZE))
+        return tint
+
+    def take_changed_chunks(self):
+        # Chunks whose tint changed since the last call, e.g. to redraw them
+        for key in self.changed_chunks:
+            self.tints.pop(key, None)
+        changed, self.changed_chunks = self.changed_chunks, set()
+        return changed
+
+    def draw(self, surface, camera_x=0, camera_y=0):
+        for key in self.changed_chunks:
+            self.tints.pop(key, None)
+        self.changed_chunks.clear()
+        visible = list(self.world.render_cache.visible_chunks(surface, camera_x, camera_y))
+        if not visible:
+            return
+        if self.world.columns is None:
+            # Edits on screen are then always far enough from the edge of the
+            # window to be updated incrementally
+            size = self.chunk_size
+            self.light_columns(visible[0][0] * size - LIGHT_MARGIN, (visible[-1][0] + 1) * size + LIGHT_MARGIN)
+        pixels = self.chunk_pixels
+        blits = []
+        for chunk_x, chunk_y in visible:
+            key = (chunk_x, chunk_y)
+            if key not in self.tints:
+                self.tints[key] = self.render_tint(chunk_x, chunk_y)
+            tint = self.tints[key]
+            if tint is not None:
+                blits.append((tint, (chunk_x * pixels - camera_x, chunk_y * pixels - camera_y)))
+        surface.blits(blits, doreturn=False)
+
+class LitGame(fakemc.Game):
+    # fakemc with lighting; place torches with key 4
+    caption = "Mini Minecraft - Lighting"
+    BLOCK_KEYS = {**fakemc.Game.BLOCK_KEYS, pygame.K_4: fakemc.BLOCK_TORCH}
+
+    def __init__(self, world=None, save_file=fakemc.SAVE_FILE, seed=None, loader_threads=fakemc.LOADER_THREADS):
+        super().__init__(world=world, save_file=save_file, seed=seed, loader_threads=loader_threads)
+        self.light = LightField(self.world)
+
+    def draw_world(self, surface):
+        super().draw_world(surface)
+        self.light.draw(surface, self.camera_x)
+
+    def draw(self, surface):
+        # Light from an edit can reach well past the edited block
+        pixels = self.light.chunk_pixels
+        for chunk_x, chunk_y in self.light.take_changed_chunks():
+            self.dirty.add((chunk_x * pixels - self.camera_x, chunk_y * pixels, pixels, pixels))
+        return super().draw(surface)
+
+def time_edits(world, light, cases, xs):
+    # Mean cells touched and time per edit for each (name, y of x, block)
+    for name, y_of, block_type in cases:
+        touched = 0
+        elapsed = 0.0
+        for x in xs:
+            y = y_of(x)
+            old_block = world.get_block(x, y)
+            start = time.perf_counter()
+            world.set_block(x, y, block_type)
+            elapsed += time.perf_counter() - start
+            touched += light.touched
+            # Undo, so every edit starts from the same light
+            world.set_block(x, y, old_block)
+        print(f"{name:>28}: {touched / len(xs):6.0f} cells touched, {elapsed / len(xs) * 1e6:8.1f} us per edit")
+
+def benchmark(columns=4096, rows=128, edits=200):
+    # Light work per block edit compared with recomputing the whole field
+    world = fakemc.World(columns, rows)
+    # A cave under the surface so torches have somewhere to shine
+    ground_top = rows - rows // 3
+    world.grid.fill_region(0, ground_top + 4, columns, 6, fakemc.BLOCK_AIR)
+    start = time.perf_counter()
+    light = LightField(world)
+    full = time.perf_counter() - start
+    print(f"world {columns} x {rows} ({columns * rows:,} cells): full light calculation {full * 1000:.1f} ms")
+    step = columns // edits
+    time_edits(world, light, [
+        ("place block on the surface", lambda x: ground_top - 1, fakemc.BLOCK_STONE),
+        ("dig into the surface", lambda x: ground_top, fakemc.BLOCK_AIR),
+        ("place torch in the cave", lambda x: ground_top + 6, fakemc.BLOCK_TORCH),
+    ], [n * step + step // 2 for n in range(edits)])
+
+    # The same on an endless world, lit a window at a time
+    world = fakemc.InfiniteWorld(rows, max_chunks=1024)
+    light = LightField(world)
+    window = light.window_columns - 2 * LIGHT_MARGIN
+    start = time.perf_counter()
+    light.light_columns(0, window)
+    full = time.perf_counter() - start
+    print(f"endless world, {rows} rows: lighting a window of {light.grid.columns} columns {full * 1000:.1f} ms")
+
+    def surface_y(x):
+        return next(y for y in range(rows) if world.get_block(x, y) != fakemc.BLOCK_AIR)
+
+    time_edits(world, light, [
+        ("place block on the surface", lambda x: surface_y(x) - 1, fakemc.BLOCK_STONE),
+        ("dig into the surface", surface_y, fakemc.BLOCK_AIR),
+        ("place torch on the surface", lambda x: surface_y(x) - 1, fakemc.BLOCK_TORCH),
+    ], range(LIGHT_MARGIN, window - LIGHT_MARGIN, max((window - 2 * LIGHT_MARGIN) // edits, 1)))
+
+def main():
+    engine.run(LitGame())
+    pygame.quit()
+    sys.exit()
+
+if __name__ == "__main__":
+    if "--benchmark" in sys.argv[1:]:
+        benchmark()
+    else:
+        main()
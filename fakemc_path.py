@@ -0,0 +1,350 @@
+import heapq
+import random
+import sys
+import time
+from collections import OrderedDict, deque
+
+import fakemc
+
+# Pathfinding over a fakemc World with the player's movement rules (see
+# fakemc.can_move): one tile left, right, up or down into air, either
+# sideways or onto a cell with a block below it. Those rules are not
+# symmetric (a step down cannot always be walked back up), so the graph is
+# directed and searched with plain A*.
+#
+# The graph is kept as one byte of move bits per cell, laid out like the
+# world's BlockGrid (x * rows + y). For a finite World it is built once; an
+# endless InfiniteWorld has no end to build to, so its moves are built a
+# chunk column at a time when a search first reaches them and kept in an LRU
+# of MovePages (x may be negative there, which the index arithmetic does not
+# mind). Either way the moves are patched around a cell when set_block
+# changes whether it is air; the revision is bumped only when a move
+# actually changed, so edits that do not matter for walking keep the caches
+# warm.
+#
+#   paths.find_path(start, goal)   tuple of (x, y) from start to goal, or None
+#   paths.next_step(start, goal)   first step towards goal, for crowds that
+#                                  all chase the same target
+#
+# Paths are kept in an LRU cache keyed by the endpoints and the graph
+# revision. next_step answers from a distance field (reverse BFS from the
+# goal) that is cached the same way, so hundreds of mobs following the
+# player cost one BFS per revision and a few lookups each.
+
+# (dx, dy) of each move, its bit is 1 << position
+DIRECTIONS = ((-1, 0), (1, 0), (0, -1), (0, 1))
+
+# Most nodes one A* search expands before giving up, so a goal that cannot
+# be reached does not flood the whole world
+MAX_EXPANDED = 20000
+# Steps a distance field reaches out from its goal
+FIELD_RADIUS = 256
+
+PATH_CACHE_SIZE = 4096
+FIELD_CACHE_SIZE = 16
+# Chunk columns of moves kept for an endless world, enough for a search that
+# gives up after MAX_EXPANDED nodes in a world only a few chunks high
+MOVE_PAGES = 2048
+
+class MovePages:
+    # Move bits of an endless world by cell index, built one chunk column
+    # (a page) at a time. Pages are rebuilt from the blocks when they are
+    # needed again after dropping out of the LRU.
+    def __init__(self, graph, page_columns=fakemc.CHUNK_SIZE, max_pages=MOVE_PAGES):
+        self.graph = graph
+        self.page_columns = page_columns
+        self.page_cells = page_columns * graph.rows
+        self.max_pages = max_pages
+        self.pages = OrderedDict()
+
+    def page(self, page_x):
+        page = self.pages.get(page_x)
+        if page is None:
+            page = self.pages[page_x] = bytearray(self.page_cells)
+            rows = self.graph.rows
+            first = page_x * self.page_columns
+            for x in range(first, first + self.page_columns):
+                for y in range(rows):
+                    page[(x - first) * rows + y] = self.graph.cell_moves(x, y)
+            if len(self.pages) > self.max_pages:
+                self.pages.popitem(last=False)
+        else:
+            self.pages.move_to_end(page_x)
+        return page
+
+    def __contains__(self, i):
+        return i // self.page_cells in self.pages
+
+    def __getitem__(self, i):
+        page_x, offset = divmod(i, self.page_cells)
+        return self.page(page_x)[offset]
+
+    def __setitem__(self, i, bits):
+        page_x, offset = divmod(i, self.page_cells)
+        self.page(page_x)[offset] = bits
+
+class NavGraph:
+    def __init__(self, world, path_cache_size=PATH_CACHE_SIZE, field_cache_size=FIELD_CACHE_SIZE):
+        self.world = world
+        # None for an endless world
+        self.columns = world.columns
+        self.rows = world.rows
+        rows = self.rows
+        # Index offset of each direction
+        self.offsets = tuple(dx * rows + dy for dx, dy in DIRECTIONS)
+        if self.columns is None:
+            self.moves = MovePages(self)
+        else:
+            self.moves = bytearray(self.columns * rows)
+        self.revision = 0
+
+        self.path_cache = OrderedDict()
+        self.path_cache_size = path_cache_size
+        self.field_cache = OrderedDict()
+        self.field_cache_size = field_cache_size
+        self.hits = 0
+        self.misses = 0
+        self.expanded = 0
+
+        self.build()
+        world.listeners.append(self.on_block_changed)
+
+    def cell_moves(self, x, y):
+        bits = 0
+        for bit, (dx, dy) in enumerate(DIRECTIONS):
+            if fakemc.can_move(self.world, x, y, x + dx, y + dy):
+                bits |= 1 << bit
+        return bits
+
+    def build(self):
+        moves = self.moves
+        rows = self.rows
+        if self.columns is None:
+            # Pages are built as they are reached
+            self.revision += 1
+            return
+        for x in range(self.columns):
+            for y in range(rows):
+                moves[x * rows + y] = self.cell_moves(x, y)
+        self.revision += 1
+
+    def on_block_changed(self, x, y, old_block, new_block):
+        if (old_block == fakemc.BLOCK_AIR) == (new_block == fakemc.BLOCK_AIR):
+            return
+        # Moves into the cell, and moves into the cell above (which may have
+        # lost or gained its floor), start at most one tile around them
+        changed = False
+        rows = self.rows
+        first_x, end_x = x - 1, x + 2
+        if self.columns is not None:
+            first_x, end_x = max(first_x, 0), min(end_x, self.columns)
+        for cell_x in range(first_x, end_x):
+            for cell_y in range(max(y - 2, 0), min(y + 2, rows)):
+                i = cell_x * rows + cell_y
+                if self.columns is None and i not in self.moves:
+                    # Searches may have been through the page before it was
+                    # dropped; it is built with the new blocks when needed
+                    changed = True
+                    continue
+                bits = self.cell_moves(cell_x, cell_y)
+                if self.moves[i] != bits:
+                    self.moves[i] = bits
+                    changed = True
+        if changed:
+            self.revision += 1
+
+    def in_bounds(self, x, y):
+        return (self.columns is None or 0 <= x < self.columns) and 0 <= y < self.rows
+
+    def find_path(self, start, goal):
+        key = (start, goal, self.revision)
+        cache = self.path_cache
+        if key in cache:
+            cache.move_to_end(key)
+            self.hits += 1
+            return cache[key]
+        self.misses += 1
+        path = self.search(start, goal)
+        cache[key] = path
+        if len(cache) > self.path_cache_size:
+            cache.popitem(last=False)
+        return path
+
+    def search(self, start, goal):
+        # A* with the Manhattan distance, which never overestimates since
+        # every move is one tile
+        if not self.in_bounds(*start) or not self.in_bounds(*goal):
+            return None
+        rows = self.rows
+        moves = self.moves
+        offsets = self.offsets
+        start_i = start[0] * rows + start[1]
+        goal_i = goal[0] * rows + goal[1]
+        goal_x, goal_y = goal
+        came_from = {start_i: None}
+        cost = {start_i: 0}
+        heap = [(abs(start[0] - goal_x) + abs(start[1] - goal_y), 0, start_i)]
+        expanded = 0
+        while heap:
+            _, g, i = heapq.heappop(heap)
+            if i == goal_i:
+                break
+            if g > cost[i]:
+                continue
+            expanded += 1
+            if expanded > MAX_EXPANDED:
+                break
+            bits = moves[i]
+            g += 1
+            for bit in range(4):
+                if not bits >> bit & 1:
+                    continue
+                n = i + offsets[bit]
+                if g < cost.get(n, g + 1):
+                    cost[n] = g
+                    came_from[n] = i
+                    x, y = divmod(n, rows)
+                    heapq.heappush(heap, (g + abs(x - goal_x) + abs(y - goal_y), g, n))
+        self.expanded += expanded
+        if goal_i not in came_from:
+            return None
+        path = []
+        i = goal_i
+        while i is not None:
+            path.append(divmod(i, rows))
+            i = came_from[i]
+        path.reverse()
+        # Shared through the cache, so it must not be changed by callers
+        return tuple(path)
+
+    def distance_field(self, goal):
+        # Steps from every cell within FIELD_RADIUS to `goal`, by walking the
+        # moves backwards from the goal
+        key = (goal, self.revision)
+        cache = self.field_cache
+        if key in cache:
+            cache.move_to_end(key)
+            return cache[key]
+        rows = self.rows
+        moves = self.moves
+        offsets = self.offsets
+        # Endless worlds have no cells to run off; a move off the top or
+        # bottom of a column is never set, so wrapping into the next column
+        # cannot be followed either
+        size = len(moves) if self.columns is not None else None
+        distances = {}
+        if self.in_bounds(*goal):
+            goal_i = goal[0] * rows + goal[1]
+            distances[goal_i] = 0
+            queue = deque([goal_i])
+            while queue:
+                i = queue.popleft()
+                distance = distances[i] + 1
+                if distance > FIELD_RADIUS:
+                    continue
+                for bit in range(4):
+                    # Cell that reaches i with this move
+                    n = i - offsets[bit]
+                    if size is not None and not 0 <= n < size or n in distances or not moves[n] >> bit & 1:
+                        continue
+                    distances[n] = distance
+                    queue.append(n)
+        cache[key] = distances
+        if len(cache) > self.field_cache_size:
+            cache.popitem(last=False)
+        return distances
+
+    def next_step(self, start, goal):
+        # Neighbour of start one step closer to goal, start itself at the
+        # goal and None if the goal is out of reach
+        if start == goal:
+            return start
+        distances = self.distance_field(goal)
+        rows = self.rows
+        i = start[0] * rows + start[1]
+        distance = distances.get(i)
+        if distance is None:
+            return None
+        bits = self.moves[i]
+        for bit in range(4):
+            if bits >> bit & 1:
+                n = i + self.offsets[bit]
+                if distances.get(n) == distance - 1:
+                    return divmod(n, rows)
+        return None
+
+    def stats(self):
+        return {
+            "revision": self.revision,
+            "hits": self.hits,
+            "misses": self.misses,
+            "expanded": self.expanded,
+            "cached_paths": len(self.path_cache),
+            "cached_fields": len(self.field_cache),
+        }
+
+def walk(world, path):
+    # True if every step of path follows the movement rules
+    return all(fakemc.can_move(world, x, y, next_x, next_y) for (x, y), (next_x, next_y) in zip(path, path[1:]))
+
+def benchmark(columns=512, mobs=300, frames=60, seed=0):
+    # A crowd of mobs chasing a goal, with a block edit now and then
+    rng = random.Random(seed)
+    world = fakemc.World(columns, fakemc.GRID_ROWS)
+    ground_top = world.rows - world.rows // 3
+    # Pits and pillars so paths have to climb and drop
+    for x in range(4, columns - 4, 6):
+        height = rng.randint(1, 3)
+        if rng.random() < 0.5:
+            world.grid.fill_region(x, ground_top - height, 1, height, fakemc.BLOCK_STONE)
+        else:
+            world.grid.fill_region(x, ground_top, 2, height, fakemc.BLOCK_AIR)
+
+    start = time.perf_counter()
+    paths = NavGraph(world)
+    print(f"world {columns} x {world.rows}: graph built in {(time.perf_counter() - start) * 1000:.1f} ms")
+
+    goal = (columns // 2, ground_top - 1)
+    crowd = [(rng.randrange(columns // 2 - 60, columns // 2 + 60), ground_top - 1) for _ in range(mobs)]
+    edits = [(rng.randrange(columns), ground_top - 1) for _ in range(frames // 10)]
+    time_queries(world, paths, goal, crowd, edits, frames)
+
+    # The same crowd on the hills of an endless world, whose moves are built
+    # by the first searches that reach them
+    world = fakemc.InfiniteWorld(fakemc.GRID_ROWS)
+    paths = NavGraph(world)
+
+    def surface(x):
+        return x, next(y for y in range(world.rows) if world.get_block(x, y) != fakemc.BLOCK_AIR) - 1
+
+    print(f"endless world, {world.rows} rows:")
+    crowd = [surface(rng.randrange(-60, 60)) for _ in range(mobs)]
+    edits = [surface(rng.randrange(-60, 60)) for _ in range(frames // 10)]
+    time_queries(world, paths, surface(0), crowd, edits, frames)
+
+def time_queries(world, paths, goal, crowd, edits, frames):
+    # Every mob queries once per frame; every tenth frame toggles a block
+    for name, query in (("find_path", paths.find_path), ("next_step", paths.next_step)):
+        paths.path_cache.clear()
+        paths.field_cache.clear()
+        worst = total = 0.0
+        for frame in range(frames):
+            if frame % 10 == 9:
+                x, y = edits[frame // 10]
+                world.set_block(x, y, fakemc.BLOCK_STONE if world.get_block(x, y) == fakemc.BLOCK_AIR else fakemc.BLOCK_AIR)
+            start = time.perf_counter()
+            for mob in crowd:
+                query(mob, goal)
+            elapsed = time.perf_counter() - start
+            total += elapsed
+            worst = max(worst, elapsed)
+        print(f"{name:>10}: {len(crowd)} queries per frame, {total / frames * 1000:6.2f} ms mean, {worst * 1000:6.2f} ms worst frame")
+
+    # Uncached searches, for comparison
+    start = time.perf_counter()
+    for mob in crowd:
+        paths.search(mob, goal)
+    print(f"{'uncached':>10}: {len(crowd)} A* searches {(time.perf_counter() - start) * 1000:6.2f} ms")
+
+if __name__ == "__main__":
+    benchmark(*(int(arg) for arg in sys.argv[1:]))
@@ -0,0 +1,574 @@
+import argparse
+import asyncio
+import random
+import struct
+import time
+import zlib
+from collections import OrderedDict, deque
+
+import fakemc
+from replay import percentile
+
+# Authoritative multiplayer server for fakemc over TCP, built on asyncio.
+#
+#   python fakemc_server.py serve --port 25575
+#   python fakemc_server.py loadtest --clients 300 --seconds 20
+#
+# The server owns the world, an endless InfiniteWorld like fakemc's unless a
+# width is given. Clients only send inputs (a one tile move or a block
+# edit); the server checks them with the game's rules and applies them at
+# the start of its next tick.
+#
+# Every chunk has a revision that goes up with each block change in it, and
+# the last changes of each chunk are kept in a change log. Each tick every
+# client gets one frame with only what changed in the chunks near it:
+#
+#   full chunks    chunks that came into view, or whose changes have already
+#                  dropped out of the log
+#   unloads        chunks that went out of view
+#   deltas         the new revision and the changed cells since the
+#                  revision the client has, one entry per cell
+#   players        players in view whose position changed, and the ids of
+#                  players that left the view
+#
+# Frames with nothing in them are not sent, and frame bodies are zlib
+# compressed when that makes them smaller.
+#
+# Frames are a little-endian uint32 length followed by the payload, whose
+# first byte is the message type.
+
+TICK_RATE = 20
+HOST = "127.0.0.1"
+PORT = 25575
+# Columns players of an endless world spawn across
+SPAWN_COLUMNS = 1024
+# Chunks an endless world keeps resident, enough for the views of a few
+# hundred players spread over SPAWN_COLUMNS
+SERVER_RESIDENT_CHUNKS = 1024
+# Chunk columns a player sees on each side of the one it is in
+VIEW_CHUNKS = 3
+# Changes kept per chunk; clients further behind get the whole chunk again
+CHANGE_LOG_SIZE = 64
+# Inputs applied per player and tick, and most inputs waiting per player
+MAX_INPUTS_PER_TICK = 4
+MAX_QUEUED_INPUTS = 32
+# Clients that let this much outgoing data pile up are disconnected
+MAX_SEND_BUFFER = 1 << 20
+# Bodies shorter than this are not worth compressing
+COMPRESS_MIN = 64
+# Encoded chunks kept for sending to the next client that needs them
+CHUNK_DATA_CACHE_SIZE = 1024
+
+FRAME = struct.Struct("<I")
+# Client to server
+MSG_MOVE = 1
+MSG_SET_BLOCK = 2
+MOVE = struct.Struct("<Bbb")
+SET_BLOCK = struct.Struct("<BiiB")
+# Server to client
+MSG_WELCOME = 10
+MSG_TICK = 11
+# type, player id, columns (0 for an endless world), rows, chunk size, tick rate
+WELCOME = struct.Struct("<BIIHHH")
+# type, tick, server time when sent, body compressed
+TICK = struct.Struct("<BIdB")
+COUNT = struct.Struct("<H")
+# chunk x, chunk y, revision, then chunk_size * chunk_size blocks
+CHUNK = struct.Struct("<ihI")
+CHUNK_KEY = struct.Struct("<ih")
+# chunk x, chunk y, revision, number of changes
+DELTA = struct.Struct("<ihIH")
+# local x, local y, block
+CHANGE = struct.Struct("<BBB")
+# player id, x, y
+PLAYER = struct.Struct("<IiH")
+PLAYER_ID = struct.Struct("<I")
+
+VALID_BLOCKS = {fakemc.BLOCK_AIR, *fakemc.BLOCK_TYPES}
+
+class ProtocolError(Exception):
+    pass
+
+def frame(payload):
+    return FRAME.pack(len(payload)) + payload
+
+async def read_frame(reader, limit=None):
+    (length,) = FRAME.unpack(await reader.readexactly(FRAME.size))
+    if limit is not None and length > limit:
+        raise ProtocolError(f"frame of {length} bytes, at most {limit} expected")
+    return await reader.readexactly(length)
+
+def decode_input(payload):
+    # Client message as a tuple, checked for shape but not for game rules
+    kind = payload[0] if payload else None
+    if kind == MSG_MOVE and len(payload) == MOVE.size:
+        return MOVE.unpack(payload)
+    if kind == MSG_SET_BLOCK and len(payload) == SET_BLOCK.size:
+        return SET_BLOCK.unpack(payload)
+    raise ProtocolError(f"bad client message {payload[:8]!r}")
+
+class RemotePlayer:
+    def __init__(self, player_id, writer, x, y):
+        self.id = player_id
+        self.writer = writer
+        self.x = x
+        self.y = y
+        self.inputs = deque(maxlen=MAX_QUEUED_INPUTS)
+        # Revision of each chunk the client has
+        self.known = {}
+        # Positions of the players the client was last told about
+        self.seen = {}
+        self.bytes_sent = 0
+
+class Server:
+    def __init__(self, world, tick_rate=TICK_RATE, view_chunks=VIEW_CHUNKS, log_size=CHANGE_LOG_SIZE):
+        self.world = world
+        self.tick_rate = tick_rate
+        self.view_chunks = view_chunks
+        self.log_size = log_size
+        self.chunk_size = world.render_cache.chunk_size
+        # None for an endless world
+        self.chunk_columns = None if world.columns is None else (world.columns - 1) // self.chunk_size + 1
+        self.chunk_rows = (world.rows - 1) // self.chunk_size + 1
+
+        # Chunks never changed are at revision 0 and have no log
+        self.revisions = {}
+        self.change_log = {}
+        # Encoded blocks of the latest revision of recently sent chunks (an
+        # LRU), shared by every client that needs them
+        self.chunk_data = OrderedDict()
+        world.listeners.append(self.on_block_changed)
+
+        self.players = {}
+        # Connection handler tasks, waited for by stop()
+        self.handlers = set()
+        self.next_id = 1
+        self.tick = 0
+        self.tick_times = deque(maxlen=100000)
+        self.bytes_sent = 0
+        self.frames_sent = 0
+        self.server = None
+
+    def on_block_changed(self, x, y, old_block, new_block):
+        size = self.chunk_size
+        key = (x // size, y // size)
+        revision = self.revisions.get(key, 0) + 1
+        self.revisions[key] = revision
+        log = self.change_log.get(key)
+        if log is None:
+            log = self.change_log[key] = deque(maxlen=self.log_size)
+        log.append((revision, x % size, y % size, new_block))
+
+    def spawn_point(self, player_id):
+        # Players spawn spread over the world, standing on the surface
+        world = self.world
+        x = player_id * 7919 % (world.columns or SPAWN_COLUMNS)
+        for y in range(world.rows):
+            if world.get_block(x, y) != fakemc.BLOCK_AIR:
+                return x, max(y - 1, 0)
+        return x, world.rows - 1
+
+    async def start(self, host=HOST, port=PORT):
+        # Returns the port, useful with port 0
+        self.server = await asyncio.start_server(self.connect, host, port)
+        return self.server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        self.server.close()
+        for player in list(self.players.values()):
+            player.writer.close()
+        await asyncio.gather(*self.handlers, return_exceptions=True)
+        await self.server.wait_closed()
+
+    async def connect(self, reader, writer):
+        handler = asyncio.current_task()
+        self.handlers.add(handler)
+        player_id = self.next_id
+        self.next_id += 1
+        player = RemotePlayer(player_id, writer, *self.spawn_point(player_id))
+        self.players[player_id] = player
+        writer.write(frame(WELCOME.pack(MSG_WELCOME, player_id, self.world.columns or 0, self.world.rows, self.chunk_size, self.tick_rate)))
+        try:
+            while True:
+                player.inputs.append(decode_input(await read_frame(reader, SET_BLOCK.size)))
+        except (asyncio.IncompleteReadError, ConnectionError, ProtocolError):
+            pass
+        finally:
+            self.players.pop(player_id, None)
+            self.handlers.discard(handler)
+            writer.close()
+
+    async def run(self, stop):
+        # Ticks at a fixed rate until the `stop` event is set
+        loop = asyncio.get_running_loop()
+        interval = 1 / self.tick_rate
+        next_tick = loop.time()
+        while not stop.is_set():
+            self.step()
+            next_tick += interval
+            delay = next_tick - loop.time()
+            if delay < 0:
+                # Fell behind, do not try to catch up with a burst of ticks
+                next_tick = loop.time()
+                delay = 0
+            try:
+                await asyncio.wait_for(stop.wait(), delay)
+            except asyncio.TimeoutError:
+                pass
+
+    def step(self):
+        start = time.perf_counter()
+        self.tick += 1
+        players = list(self.players.values())
+        for player in players:
+            for _ in range(min(MAX_INPUTS_PER_TICK, len(player.inputs))):
+                self.apply_input(player, player.inputs.popleft())
+
+        # Players by chunk column, so each client only looks at the columns
+        # it can see
+        columns = {}
+        size = self.chunk_size
+        for player in players:
+            columns.setdefault(player.x // size, []).append(player)
+
+        now = time.time()
+        for player in players:
+            body = self.encode_update(player, columns)
+            if body is not None:
+                self.send(player, body, now)
+        self.tick_times.append(time.perf_counter() - start)
+
+    def apply_input(self, player, message):
+        world = self.world
+        if message[0] == MSG_MOVE:
+            _, dx, dy = message
+            if abs(dx) + abs(dy) == 1 and fakemc.can_move(world, player.x, player.y, player.x + dx, player.y + dy):
+                player.x += dx
+                player.y += dy
+        else:
+            _, x, y, block_type = message
+            if not world.in_bounds(x, y) or block_type not in VALID_BLOCKS:
+                return
+            # Like fakemc.Game, blocks are not placed where a player stands
+            if block_type != fakemc.BLOCK_AIR and any(other.x == x and other.y == y for other in self.players.values()):
+                return
+            world.set_block(x, y, block_type)
+
+    def view(self, player):
+        # First and last chunk column the player sees
+        center = player.x // self.chunk_size
+        first, last = center - self.view_chunks, center + self.view_chunks
+        if self.chunk_columns is None:
+            return first, last
+        return max(first, 0), min(last, self.chunk_columns - 1)
+
+    def encode_update(self, player, columns):
+        # Body of the player's next tick frame, None if nothing changed
+        first, last = self.view(player)
+        known = player.known
+        unloads = [key for key in known if not first <= key[0] <= last]
+        for key in unloads:
+            del known[key]
+
+        full = []
+        deltas = []
+        for chunk_x in range(first, last + 1):
+            for chunk_y in range(self.chunk_rows):
+                key = (chunk_x, chunk_y)
+                revision = self.revisions.get(key, 0)
+                have = known.get(key)
+                if have == revision:
+                    continue
+                known[key] = revision
+                if have is not None:
+                    log = self.change_log[key]
+                    if log[0][0] <= have + 1:
+                        # Only the latest block of each changed cell
+                        changes = {}
+                        for entry_revision, local_x, local_y, block_type in log:
+                            if entry_revision > have:
+                                changes[(local_x, local_y)] = block_type
+                        deltas.append((key, revision, changes))
+                        continue
+                full.append((key, revision))
+
+        visible = {}
+        for chunk_x in range(first, last + 1):
+            for other in columns.get(chunk_x, ()):
+                visible[other.id] = (other.x, other.y)
+        seen = player.seen
+        moved = [(player_id, position) for player_id, position in visible.items() if seen.get(player_id) != position]
+        gone = [player_id for player_id in seen if player_id not in visible]
+        player.seen = visible
+
+        if not (full or unloads or deltas or moved or gone):
+            return None
+        parts = [COUNT.pack(len(full))]
+        for key, revision in full:
+            parts.append(CHUNK.pack(*key, revision))
+            parts.append(self.encode_chunk(key, revision))
+        parts.append(COUNT.pack(len(unloads)))
+        parts.extend(CHUNK_KEY.pack(*key) for key in unloads)
+        parts.append(COUNT.pack(len(deltas)))
+        for key, revision, changes in deltas:
+            parts.append(DELTA.pack(*key, revision, len(changes)))
+            parts.extend(CHANGE.pack(local_x, local_y, block_type) for (local_x, local_y), block_type in changes.items())
+        parts.append(COUNT.pack(len(moved)))
+        parts.extend(PLAYER.pack(player_id, x, y) for player_id, (x, y) in moved)
+        parts.append(COUNT.pack(len(gone)))
+        parts.extend(PLAYER_ID.pack(player_id) for player_id in gone)
+        return b"".join(parts)
+
+    def encode_chunk(self, key, revision):
+        cache = self.chunk_data
+        cached = cache.get(key)
+        if cached is None or cached[0] != revision:
+            blocks = self.world.chunk_blocks(key[0], key[1], self.chunk_size)
+            cached = cache[key] = (revision, bytes(blocks.data))
+            if len(cache) > CHUNK_DATA_CACHE_SIZE:
+                cache.popitem(last=False)
+        cache.move_to_end(key)
+        return cached[1]
+
+    def send(self, player, body, now):
+        compressed = 0
+        if len(body) >= COMPRESS_MIN:
+            packed = zlib.compress(body, 1)
+            if len(packed) < len(body):
+                body = packed
+                compressed = 1
+        data = frame(TICK.pack(MSG_TICK, self.tick, now, compressed) + body)
+        writer = player.writer
+        if writer.is_closing():
+            return
+        if writer.transport.get_write_buffer_size() > MAX_SEND_BUFFER:
+            # The client does not keep up; its reader sees the connection end
+            writer.close()
+            return
+        writer.write(data)
+        player.bytes_sent += len(data)
+        self.bytes_sent += len(data)
+        self.frames_sent += 1
+
+class ClientWorld:
+    # The part of the world a client has been sent, kept up to date from the
+    # server's tick frames
+    def __init__(self, welcome):
+        if welcome[0] != MSG_WELCOME or len(welcome) != WELCOME.size:
+            raise ProtocolError("expected a welcome message")
+        _, self.player_id, columns, self.rows, self.chunk_size, self.tick_rate = WELCOME.unpack(welcome)
+        # None for an endless world, like World.columns
+        self.columns = columns or None
+        self.chunks = {}
+        self.revisions = {}
+        self.players = {}
+        self.tick = 0
+
+    @property
+    def position(self):
+        return self.players.get(self.player_id)
+
+    def get_block(self, x, y):
+        # None for cells in chunks the client does not have
+        size = self.chunk_size
+        blocks = self.chunks.get((x // size, y // size))
+        if blocks is None:
+            return None
+        return blocks[x % size * size + y % size]
+
+    def apply(self, payload):
+        # Applies a tick frame, returns the server time it was sent at
+        if payload[0] != MSG_TICK:
+            raise ProtocolError(f"unexpected message type {payload[0]}")
+        _, self.tick, sent, compressed = TICK.unpack_from(payload)
+        body = payload[TICK.size:]
+        if compressed:
+            body = zlib.decompress(body)
+        chunk_bytes = self.chunk_size * self.chunk_size
+        offset = 0
+
+        def count():
+            nonlocal offset
+            (value,) = COUNT.unpack_from(body, offset)
+            offset += COUNT.size
+            return value
+
+        for _ in range(count()):
+            chunk_x, chunk_y, revision = CHUNK.unpack_from(body, offset)
+            offset += CHUNK.size
+            self.chunks[(chunk_x, chunk_y)] = bytearray(body[offset:offset + chunk_bytes])
+            self.revisions[(chunk_x, chunk_y)] = revision
+            offset += chunk_bytes
+        for _ in range(count()):
+            key = CHUNK_KEY.unpack_from(body, offset)
+            offset += CHUNK_KEY.size
+            self.chunks.pop(key, None)
+            self.revisions.pop(key, None)
+        for _ in range(count()):
+            chunk_x, chunk_y, revision, changes = DELTA.unpack_from(body, offset)
+            offset += DELTA.size
+            blocks = self.chunks[(chunk_x, chunk_y)]
+            for local_x, local_y, block_type in CHANGE.iter_unpack(body[offset:offset + changes * CHANGE.size]):
+                blocks[local_x * self.chunk_size + local_y] = block_type
+            offset += changes * CHANGE.size
+            self.revisions[(chunk_x, chunk_y)] = revision
+        for _ in range(count()):
+            player_id, x, y = PLAYER.unpack_from(body, offset)
+            offset += PLAYER.size
+            self.players[player_id] = (x, y)
+        for _ in range(count()):
+            (player_id,) = PLAYER_ID.unpack_from(body, offset)
+            offset += PLAYER_ID.size
+            self.players.pop(player_id, None)
+        return sent
+
+class LoadReport:
+    def __init__(self):
+        self.connected = 0
+        self.frames = 0
+        self.bytes = 0
+        self.latencies = []
+
+class SimulatedPlayer:
+    # Load test client: wanders about and now and then edits a block next to
+    # itself
+    def __init__(self, rng, report, move_interval=0.25, edit_chance=0.05):
+        self.rng = rng
+        self.report = report
+        self.move_interval = move_interval
+        self.edit_chance = edit_chance
+        self.world = None
+
+    async def run(self, host, port):
+        reader, writer = await asyncio.open_connection(host, port)
+        self.world = ClientWorld(await read_frame(reader))
+        self.report.connected += 1
+        sender = asyncio.ensure_future(self.send_inputs(writer))
+        try:
+            while True:
+                payload = await read_frame(reader)
+                sent = self.world.apply(payload)
+                self.report.frames += 1
+                self.report.bytes += FRAME.size + len(payload)
+                self.report.latencies.append(time.time() - sent)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            sender.cancel()
+            writer.close()
+
+    async def send_inputs(self, writer):
+        rng = self.rng
+        direction = rng.choice((-1, 1))
+        while True:
+            await asyncio.sleep(self.move_interval * rng.uniform(0.5, 1.5))
+            position = self.world.position
+            if position is None:
+                continue
+            if rng.random() < self.edit_chance:
+                x = position[0] + rng.randint(-3, 3)
+                y = position[1] + rng.randint(-2, 2)
+                block_type = fakemc.BLOCK_AIR if self.world.get_block(x, y) else rng.choice(list(fakemc.BLOCK_TYPES))
+                writer.write(frame(SET_BLOCK.pack(MSG_SET_BLOCK, x, y, block_type)))
+            else:
+                if rng.random() < 0.1:
+                    direction = -direction
+                dx, dy = rng.choice(((direction, 0), (direction, 0), (0, 1), (0, -1)))
+                writer.write(frame(MOVE.pack(MSG_MOVE, dx, dy)))
+
+def make_world(columns=None):
+    # The world a server holds: endless like fakemc's unless a width is given
+    if columns is None:
+        return fakemc.InfiniteWorld(fakemc.GRID_ROWS, max_chunks=SERVER_RESIDENT_CHUNKS)
+    return fakemc.World(columns, fakemc.GRID_ROWS)
+
+async def load_test(clients=300, seconds=20.0, host=HOST, port=None, seed=0, columns=None):
+    # Connects `clients` simulated players, to a server started here unless
+    # a port is given
+    server = None
+    stop = asyncio.Event()
+    if port is None:
+        server = Server(make_world(columns))
+        port = await server.start(host, 0)
+        ticking = asyncio.ensure_future(server.run(stop))
+
+    report = LoadReport()
+    players = [SimulatedPlayer(random.Random(seed + i), report) for i in range(clients)]
+    tasks = []
+    for player in players:
+        tasks.append(asyncio.ensure_future(player.run(host, port)))
+        # Do not hit the listen backlog all at once
+        await asyncio.sleep(0.002)
+    start = time.perf_counter()
+    await asyncio.sleep(seconds)
+    elapsed = time.perf_counter() - start
+    frames, received = report.frames, report.bytes
+
+    if server is not None:
+        stop.set()
+        await ticking
+        # Let the last frames arrive, then compare the clients' copies with
+        # the server's world
+        await asyncio.sleep(0.5)
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+    latencies = sorted(report.latencies)
+    lines = [
+        f"{report.connected} clients for {elapsed:.1f} s",
+        f"  received   {received / elapsed / 1024:,.1f} KiB/s in total, {received / elapsed / max(report.connected, 1):,.0f} B/s per client, "
+        f"{frames / elapsed:,.0f} frames/s",
+        f"  latency    mean {sum(latencies) / max(len(latencies), 1) * 1000:.2f} ms, p50 {percentile(latencies, 0.5) * 1000:.2f} ms, "
+        f"p99 {percentile(latencies, 0.99) * 1000:.2f} ms (tick sent to frame applied)",
+    ]
+    if server is not None:
+        await server.stop()
+        ticks = sorted(server.tick_times)
+        lines.append(
+            f"  server     {server.tick} ticks, mean {sum(ticks) / max(len(ticks), 1) * 1000:.2f} ms, p99 {percentile(ticks, 0.99) * 1000:.2f} ms, "
+            f"max {ticks[-1] * 1000 if ticks else 0:.2f} ms per tick (budget {1000 / server.tick_rate:.0f} ms)"
+        )
+        mismatches = sum(1 for player in players if player.world is not None and not mirrors(player.world, server.world))
+        lines.append(f"  sync       {mismatches} of {len(players)} client copies differ from the server")
+    print("\n".join(lines))
+    return report
+
+def mirrors(client, world):
+    # True if every chunk the client has matches the world
+    size = client.chunk_size
+    return all(
+        bytes(blocks) == bytes(world.chunk_blocks(chunk_x, chunk_y, size).data)
+        for (chunk_x, chunk_y), blocks in client.chunks.items()
+    )
+
+async def serve(host, port, columns=None):
+    server = Server(make_world(columns))
+    port = await server.start(host, port)
+    size = "endless" if columns is None else columns
+    print(f"fakemc server on {host}:{port}, {size} x {fakemc.GRID_ROWS} world, {server.tick_rate} ticks/s")
+    await server.run(asyncio.Event())
+
+def main():
+    parser = argparse.ArgumentParser(description="fakemc multiplayer server and load test.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    serve_parser = commands.add_parser("serve", help="run a server")
+    serve_parser.add_argument("--host", default=HOST)
+    serve_parser.add_argument("--port", type=int, default=PORT)
+    serve_parser.add_argument("--columns", type=int, help="world width in tiles (default: endless)")
+    load_parser = commands.add_parser("loadtest", help="connect simulated players and report bandwidth and latency")
+    load_parser.add_argument("--clients", type=int, default=300)
+    load_parser.add_argument("--seconds", type=float, default=20.0)
+    load_parser.add_argument("--host", default=HOST)
+    load_parser.add_argument("--port", type=int, help="server to test (default: start one in this process)")
+    load_parser.add_argument("--seed", type=int, default=0)
+    load_parser.add_argument("--columns", type=int, help="width of the world of a server started here (default: endless)")
+    args = parser.parse_args()
+
+    if args.command == "serve":
+        asyncio.run(serve(args.host, args.port, args.columns))
+    else:
+        asyncio.run(load_test(args.clients, args.seconds, args.host, args.port, args.seed, args.columns))
+
+if __name__ == "__main__":
+    main()
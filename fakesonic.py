@@ -1,15 +1,16 @@
 import pygame
 import sys
-import random
 
-# Başlat
-pygame.init()
-clock = pygame.time.Clock()
+import cores
+import engine
+import levels
+from spatial import SortedXIndex
 
-# Ekran
-WIDTH, HEIGHT = 800, 600
-screen = pygame.display.set_mode((WIDTH, HEIGHT))
-pygame.display.set_caption("Python Mania - Boss Fight")
+# Bölüm dosyası
+LEVEL_FILE = cores.SONIC_LEVEL_FILE
+
+# Ekran; oyunun kuralları cores.py'de
+WIDTH, HEIGHT = cores.SONIC_VIEW_WIDTH, 600
 
 # Renkler
 WHITE = (255, 255, 255)
@@ -20,176 +21,156 @@ RED = (255, 0, 0)
 BLACK = (0, 0, 0)
 PURPLE = (160, 0, 200)
 
-# Kamera
-camera_x = 0
-
-# Oyuncu
-player = pygame.Rect(100, 500, 40, 40)
-vel_x = 0
-vel_y = 0
-acceleration = 0.5
-max_speed = 8
-friction = 0.3
-on_ground = False
-jump_power = -12
-gravity = 0.6
-lives = 3
-score = 0
-
-# Platformlar
-platforms = []
-for i in range(25):
-    platforms.append(pygame.Rect(i * 200, 550, 200, 50))
-
-platforms += [
-    pygame.Rect(1200, 450, 100, 20),
-    pygame.Rect(1500, 350, 100, 20),
-    pygame.Rect(1900, 300, 100, 20),
-    pygame.Rect(2200, 250, 100, 20)
-]
-
-# Yüzükler
-rings = [pygame.Rect(random.randint(300, 2000), random.randint(200, 500), 20, 20) for _ in range(20)]
-
-# Düşmanlar
-enemies = [pygame.Rect(800 + i * 400, 520, 40, 40) for i in range(3)]
-
-# Boss
-boss = pygame.Rect(2400, 450, 80, 80)
-boss_alive = True
-boss_health = 3
-boss_fireballs = []
-boss_timer = 0
-fight_started = False
-win = False
-
-# Fonksiyonlar
-def reset_player():
-    global vel_x, vel_y
-    player.x, player.y = 100, 500
-    vel_x = vel_y = 0
-
-# Ana oyun döngüsü
-while True:
-    screen.fill(WHITE)
-
-    # Etkinlikler
-    for event in pygame.event.get():
-        if event.type == pygame.QUIT:
-            pygame.quit()
-            sys.exit()
-
-    # Tuşlar
-    keys = pygame.key.get_pressed()
-    if keys[pygame.K_RIGHT]: vel_x += acceleration
-    elif keys[pygame.K_LEFT]: vel_x -= acceleration
-    else:
-        vel_x -= friction if vel_x > 0 else -friction if vel_x < 0 else 0
-
-    vel_x = max(-max_speed, min(max_speed, vel_x))
-
-    if keys[pygame.K_SPACE] and on_ground:
-        vel_y = jump_power
-
-    # Yerçekimi ve hareket
-    vel_y += gravity
-    player.x += vel_x
-    player.y += vel_y
-    on_ground = False
-
-    for plat in platforms:
-        if player.colliderect(plat):
-            if vel_y > 0 and player.bottom <= plat.bottom:
-                player.bottom = plat.top
-                vel_y = 0
-                on_ground = True
-
-    # Kamera
-    camera_x = player.x - WIDTH // 2
-
-    # Yüzük toplama
-    for ring in rings[:]:
-        if player.colliderect(ring):
-            rings.remove(ring)
-            score += 1
-
-    # Düşman
-    for enemy in enemies:
-        enemy.x += 2 if pygame.time.get_ticks() // 500 % 2 == 0 else -2
-        if player.colliderect(enemy):
-            lives -= 1
-            reset_player()
-
-    # Ölüm hattı
-    if player.y > 1000:
-        lives -= 1
-        reset_player()
-
-    # Boss savaş alanına giriş
-    if player.x >= 2300:
-        fight_started = True
-
-    # Boss davranışı
-    if fight_started and boss_alive:
-        boss_timer += 1
-        boss.x += 2 if boss_timer // 60 % 2 == 0 else -2
-
-        # Ateş topları
-        if boss_timer % 90 == 0:
-            fireball = pygame.Rect(boss.centerx, boss.centery, 15, 15)
-            boss_fireballs.append(fireball)
-
-        # Ateş topu hareketi
-        for fireball in boss_fireballs[:]:
-            fireball.x -= 6
-            if fireball.colliderect(player):
-                boss_fireballs.remove(fireball)
-                lives -= 1
-                reset_player()
-            elif fireball.x < player.x - 500:
-                boss_fireballs.remove(fireball)
-
-        # Oyuncu boss'a zıplarsa hasar
-        if player.colliderect(boss) and vel_y > 0:
-            vel_y = jump_power
-            boss_health -= 1
-            if boss_health <= 0:
-                boss_alive = False
-                win = True
-
-    # Çizimler
-    for plat in platforms:
-        pygame.draw.rect(screen, GREEN, (plat.x - camera_x, plat.y, plat.width, plat.height))
-
-    for ring in rings:
-        pygame.draw.ellipse(screen, YELLOW, (ring.x - camera_x, ring.y, 20, 20))
-
-    for enemy in enemies:
-        pygame.draw.rect(screen, RED, (enemy.x - camera_x, enemy.y, 40, 40))
-
-    for fireball in boss_fireballs:
-        pygame.draw.circle(screen, PURPLE, (fireball.x - camera_x, fireball.y), 8)
-
-    pygame.draw.rect(screen, BLUE, (player.x - camera_x, player.y, 40, 40))
-
-    if boss_alive and fight_started:
-        pygame.draw.rect(screen, BLACK, (boss.x - camera_x, boss.y, boss.width, boss.height))
-        # Boss canı
-        pygame.draw.rect(screen, RED, (boss.x - camera_x, boss.y - 20, boss.width * boss_health / 3, 10))
-
-    # UI
-    font = pygame.font.SysFont(None, 30)
-    screen.blit(font.render(f"Yüzük: {score}", True, BLACK), (10, 10))
-    screen.blit(font.render(f"Can: {lives}", True, BLACK), (10, 40))
-
-    if win:
-        screen.blit(font.render("YOU WIN!", True, BLUE), (WIDTH // 2 - 60, HEIGHT // 2))
-    if lives <= 0:
-        screen.blit(font.render("GAME OVER", True, RED), (WIDTH // 2 - 80, HEIGHT // 2))
-        pygame.display.flip()
-        pygame.time.wait(2000)
-        pygame.quit()
-        sys.exit()
-
-    pygame.display.update()
-    clock.tick(60)
+# Sabit platform katmanı bu genişlikte şeritler halinde önceden çizilir
+STRIP_WIDTH = 512
+
+# Çemberler merkezden çizildiği için görüş alanına eklenen pay
+CULL_MARGIN = 16
+
+class StaticLayer:
+    # Platformlar hiç hareket etmediği için şeritlere bir kez çizilir; her
+    # karede sadece kameranın gördüğü şeritler blit edilir. Şeritler sadece
+    # platformların bulunduğu yükseklik bandını kapsar.
+    def __init__(self, platforms, color, background):
+        self.color = color
+        self.background = background
+        self.index = SortedXIndex()
+        self.top = HEIGHT
+        self.bottom = 0
+        self.strips = {}
+        for plat in platforms:
+            self.add(plat)
+
+    def invalidate(self, plat):
+        for strip in range(plat.left // STRIP_WIDTH, (plat.right - 1) // STRIP_WIDTH + 1):
+            self.strips.pop(strip, None)
+
+    def add(self, plat):
+        self.index.insert(plat, plat)
+        if plat.top < self.top or plat.bottom > self.bottom:
+            # Bant genişledi, bütün şeritler yeniden çizilmeli
+            self.top = min(self.top, plat.top)
+            self.bottom = max(self.bottom, plat.bottom)
+            self.strips.clear()
+        else:
+            self.invalidate(plat)
+
+    def remove(self, plat):
+        self.index.remove(plat, plat)
+        self.invalidate(plat)
+
+    def render_strip(self, strip):
+        surface = pygame.Surface((STRIP_WIDTH, max(self.bottom - self.top, 1)))
+        surface.fill(self.background)
+        left = strip * STRIP_WIDTH
+        for plat in self.index.query(left, left + STRIP_WIDTH):
+            pygame.draw.rect(surface, self.color, (plat.x - left, plat.y - self.top, plat.width, plat.height))
+        # Ekranla aynı piksel formatında tutulursa blit en hızlı yoldan gider
+        if pygame.display.get_surface() is not None:
+            surface = surface.convert()
+        return surface
+
+    def draw(self, screen, camera_x):
+        if self.top >= self.bottom:
+            screen.fill(self.background)
+            return
+        # Bandın dışı düz arka plan, bandın içini şeritler tamamen kaplar
+        screen.fill(self.background, (0, 0, WIDTH, self.top))
+        screen.fill(self.background, (0, self.bottom, WIDTH, HEIGHT - self.bottom))
+        first = camera_x // STRIP_WIDTH
+        last = (camera_x + WIDTH - 1) // STRIP_WIDTH
+        blits = []
+        for strip in range(first, last + 1):
+            surface = self.strips.get(strip)
+            if surface is None:
+                surface = self.strips[strip] = self.render_strip(strip)
+            blits.append((surface, (strip * STRIP_WIDTH - camera_x, self.top)))
+        screen.blits(blits, doreturn=False)
+        # Görüşten uzaklaşan şeritleri bırak
+        for strip in list(self.strips):
+            if strip < first - 1 or strip > last + 1:
+                del self.strips[strip]
+
+class Game(engine.Game):
+    size = (WIDTH, HEIGHT)
+    caption = "Python Mania - Boss Fight"
+
+    def __init__(self, level_file=LEVEL_FILE, seed=None):
+        super().__init__(seed)
+        # Çizim: sabit katman ve yüzükler için x'e göre sıralı indeks,
+        # bölüm parçaları yüklenip bırakıldıkça on_object_changed ile güncellenir.
+        # HUD yazıları sadece değişince yeniden çizilir
+        self.platform_layer = StaticLayer([], GREEN, WHITE)
+        self.ring_x_index = SortedXIndex()
+        self.score_text = engine.CachedText(None, 30, BLACK)
+        self.lives_text = engine.CachedText(None, 30, BLACK)
+        self.win_text = engine.CachedText(None, 30, BLUE)
+        self.game_over_text = engine.CachedText(None, 30, RED)
+        self.core = cores.SonicState(level_file, self.seed, listeners=[self.on_object_changed])
+
+    def on_object_changed(self, kind, box, added):
+        if kind == levels.PLATFORM:
+            if added:
+                self.platform_layer.add(box)
+            else:
+                self.platform_layer.remove(box)
+        elif added:
+            self.ring_x_index.insert(box, box)
+        else:
+            self.ring_x_index.remove(box, box)
+
+    def update(self, dt, keys):
+        inputs = cores.Input(keys[pygame.K_LEFT], keys[pygame.K_RIGHT], keys[pygame.K_SPACE])
+        cores.sonic_step(self.core, inputs, self.profiler)
+        if not self.core.running:
+            self.running = False
+
+    def draw(self, screen):
+        core = self.core
+        camera_x = core.camera_x
+        boss = core.boss
+        # Kameranın gördüğü alan, dışındaki nesneler hiç çizilmez
+        view = (camera_x - CULL_MARGIN, -CULL_MARGIN, WIDTH + 2 * CULL_MARGIN, HEIGHT + 2 * CULL_MARGIN)
+
+        # Çizimler (arka plan ve platformlar hazır şeritlerden gelir)
+        self.platform_layer.draw(screen, camera_x)
+
+        for ring in self.ring_x_index.query(camera_x, camera_x + WIDTH):
+            pygame.draw.ellipse(screen, YELLOW, (ring.x - camera_x, ring.y, 20, 20))
+
+        for enemy in core.enemy_index.query(view):
+            pygame.draw.rect(screen, RED, (enemy.x - camera_x, enemy.y, 40, 40))
+
+        for fireball in core.fireball_index.query(view):
+            pygame.draw.circle(screen, PURPLE, (fireball.x - camera_x, fireball.y), 8)
+
+        pygame.draw.rect(screen, BLUE, (core.player.x - camera_x, core.player.y, 40, 40))
+
+        if core.boss_alive and core.fight_started and boss is not None:
+            pygame.draw.rect(screen, BLACK, (boss.x - camera_x, boss.y, boss.width, boss.height))
+            # Boss canı
+            pygame.draw.rect(screen, RED, (boss.x - camera_x, boss.y - 20, boss.width * core.boss_health / 3, 10))
+
+        # UI
+        screen.blit(self.score_text.render(f"Yüzük: {core.score}"), (10, 10))
+        screen.blit(self.lives_text.render(f"Can: {core.lives}"), (10, 40))
+
+        if core.win:
+            screen.blit(self.win_text.render("YOU WIN!"), (WIDTH // 2 - 60, HEIGHT // 2))
+        if core.lives <= 0:
+            screen.blit(self.game_over_text.render("GAME OVER"), (WIDTH // 2 - 80, HEIGHT // 2))
+
+    def stats(self):
+        core = self.core
+        return {"score": core.score, "collisions": core.collisions, "lives": core.lives, "boss_health": core.boss_health, "win": core.win}
+
+    def close(self):
+        self.core.close()
+
+def main():
+    engine.run(Game())
+    pygame.quit()
+    sys.exit()
+
+if __name__ == "__main__":
+    main()
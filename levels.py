@@ -0,0 +1,221 @@
+import hashlib
+import json
+import os
+import struct
+import sys
+from collections import OrderedDict
+
+# Level files. Levels are authored as JSON and can be built into a packed
+# binary file next to the JSON (same name, .lvl) for shipping:
+#
+#   python levels.py build levels/sonic_1.json
+#
+# Objects are bucketed into fixed-width horizontal segments by their left
+# edge. LevelStream keeps only the segments around the camera loaded. A packed
+# level keeps its most recently read segments in a small LRU cache, so moving
+# back and forth near a segment border does not read them again, while a long
+# level never ends up fully in memory. JSON levels are parsed whole; the last
+# few parsed ones are cached keyed by their content hash so reloading a level
+# does not parse it again.
+#
+# JSON layout:
+#   {"name": ..., "segment_width": 1024, "spawn": [x, y],
+#    "objects": [[kind, x, y, width, height, extra], ...], ...}
+# Any other top-level keys are kept as level metadata.
+
+PLATFORM = 0
+RING = 1
+COIN = 2
+ENEMY = 3
+BOSS = 4
+
+KINDS = {
+    "platform": PLATFORM,
+    "ring": RING,
+    "coin": COIN,
+    "enemy": ENEMY,
+    "boss": BOSS,
+}
+
+SEGMENT_WIDTH = 1024
+
+# Segments a packed level keeps cached, about two streaming windows at the
+# default margin
+SEGMENT_CACHE_SIZE = 8
+# Parsed JSON levels kept, keyed by content hash
+JSON_CACHE_SIZE = 4
+
+MAGIC = b"LVL1"
+# magic, segment width, segment count, widest object, content hash, metadata length
+HEADER = struct.Struct("<4sIIi20sI")
+SEGMENT_ENTRY = struct.Struct("<iII")
+RECORD = struct.Struct("<Biiiii")
+
+class LevelError(Exception):
+    pass
+
+def parse_record(item):
+    kind = KINDS.get(item[0])
+    if kind is None:
+        raise LevelError(f"unknown level object kind {item[0]!r}")
+    x, y, width, height = (int(v) for v in item[1:5])
+    extra = int(item[5]) if len(item) > 5 else 0
+    return (kind, x, y, width, height, extra)
+
+def split_segments(records, segment_width):
+    segments = {}
+    for record in records:
+        segments.setdefault(record[1] // segment_width, []).append(record)
+    return segments
+
+class LevelData:
+    # Everything about a level except the object records themselves
+    def __init__(self, digest, segment_width, max_width, metadata, segments):
+        self.digest = digest
+        self.segment_width = segment_width
+        self.max_width = max_width
+        self.metadata = metadata
+        # Sorted numbers of the segments that hold objects
+        self.segments = segments
+
+# Content hash -> (LevelData, segment number -> records) of parsed JSON levels
+_json_cache = OrderedDict()
+
+class JsonSource:
+    def __init__(self, path):
+        with open(path, "rb") as file:
+            raw = file.read()
+        self.digest = hashlib.sha1(raw).digest()
+        cached = _json_cache.get(self.digest)
+        if cached is None:
+            level = json.loads(raw)
+            segment_width = level.pop("segment_width", SEGMENT_WIDTH)
+            records = [parse_record(item) for item in level.pop("objects", [])]
+            max_width = max((record[3] for record in records), default=0)
+            segments = split_segments(records, segment_width)
+            cached = _json_cache[self.digest] = (LevelData(self.digest, segment_width, max_width, level, sorted(segments)), segments)
+            if len(_json_cache) > JSON_CACHE_SIZE:
+                _json_cache.popitem(last=False)
+        else:
+            _json_cache.move_to_end(self.digest)
+        self.level, self.segments = cached
+
+    def read_segment(self, segment):
+        return self.segments.get(segment, [])
+
+    def close(self):
+        pass
+
+class PackedSource:
+    # Only the header and segment index are read when opening; a segment's
+    # records are read and unpacked when it is streamed in and not cached
+    def __init__(self, path, cache_size=SEGMENT_CACHE_SIZE):
+        self.file = open(path, "rb")
+        header = self.file.read(HEADER.size)
+        if len(header) < HEADER.size:
+            raise LevelError(f"{path}: file too short for a level header")
+        magic, segment_width, segment_count, max_width, digest, metadata_length = HEADER.unpack(header)
+        if magic != MAGIC:
+            raise LevelError(f"{path}: not a packed level file")
+        metadata = json.loads(self.file.read(metadata_length))
+        index_data = self.file.read(segment_count * SEGMENT_ENTRY.size)
+        self.index = {segment: (offset, count) for segment, offset, count in SEGMENT_ENTRY.iter_unpack(index_data)}
+        self.level = LevelData(digest, segment_width, max_width, metadata, sorted(self.index))
+        self.cache = OrderedDict()
+        self.cache_size = cache_size
+
+    def read_segment(self, segment):
+        cache = self.cache
+        records = cache.get(segment)
+        if records is not None:
+            cache.move_to_end(segment)
+            return records
+        entry = self.index.get(segment)
+        if entry is None:
+            return []
+        offset, count = entry
+        self.file.seek(offset)
+        records = cache[segment] = list(RECORD.iter_unpack(self.file.read(count * RECORD.size)))
+        if len(cache) > self.cache_size:
+            cache.popitem(last=False)
+        return records
+
+    def close(self):
+        self.cache.clear()
+        self.file.close()
+
+def packed_path(path):
+    return os.path.splitext(path)[0] + ".lvl"
+
+def open_level(path):
+    # Prefer an up to date packed build of a JSON level
+    if path.endswith(".json"):
+        packed = packed_path(path)
+        if os.path.exists(packed) and os.path.getmtime(packed) >= os.path.getmtime(path):
+            return PackedSource(packed)
+        return JsonSource(path)
+    return PackedSource(path)
+
+def build(path, output=None):
+    source = JsonSource(path)
+    level = source.level
+    segments = level.segments
+    metadata = json.dumps(level.metadata).encode("utf-8")
+    offset = HEADER.size + len(metadata) + len(segments) * SEGMENT_ENTRY.size
+    index = []
+    payload = []
+    for segment in segments:
+        records = source.read_segment(segment)
+        index.append(SEGMENT_ENTRY.pack(segment, offset, len(records)))
+        payload.extend(RECORD.pack(*record) for record in records)
+        offset += len(records) * RECORD.size
+    output = output or packed_path(path)
+    with open(output, "wb") as file:
+        file.write(HEADER.pack(MAGIC, level.segment_width, len(segments), level.max_width, level.digest, len(metadata)))
+        file.write(metadata)
+        file.write(b"".join(index))
+        file.write(b"".join(payload))
+    return output
+
+class LevelStream:
+    # Streams segments in and out as the camera moves. update() returns the
+    # segments that became resident and the ones that were dropped, as lists
+    # of (segment number, records).
+    def __init__(self, path, view_width, margin=SEGMENT_WIDTH):
+        self.source = open_level(path)
+        self.level = self.source.level
+        self.metadata = self.level.metadata
+        self.view_width = view_width
+        self.margin = margin
+        self.resident = {}
+
+    def wanted_segments(self, camera_x):
+        width = self.level.segment_width
+        # Objects are bucketed by left edge, so look back by the widest object
+        first = (camera_x - self.margin - self.level.max_width) // width
+        last = (camera_x + self.view_width + self.margin) // width
+        return range(first, last + 1)
+
+    def update(self, camera_x):
+        wanted = self.wanted_segments(int(camera_x))
+        loaded = []
+        for segment in wanted:
+            if segment not in self.resident:
+                records = self.source.read_segment(segment)
+                self.resident[segment] = records
+                loaded.append((segment, records))
+        unloaded = []
+        for segment in list(self.resident):
+            if segment not in wanted:
+                unloaded.append((segment, self.resident.pop(segment)))
+        return loaded, unloaded
+
+    def close(self):
+        self.source.close()
+
+if __name__ == "__main__":
+    if len(sys.argv) < 3 or sys.argv[1] != "build":
+        print("usage: python levels.py build LEVEL.json [...]")
+        sys.exit(1)
+    for level_path in sys.argv[2:]:
+        print(f"{level_path} -> {build(level_path)}")
@@ -0,0 +1,69 @@
+# Fixed-capacity pool for short-lived entities (enemy cars, fireballs, ...).
+# Released entities go on a free list and are reinitialized on the next
+# acquire instead of being allocated again. Live entities are kept packed in
+# a list; releasing one moves the last live entity into its slot (swap-remove)
+# so there is no O(n) list.remove and no copy of the list per frame.
+
+class EntityPool:
+    def __init__(self, factory, reset, capacity):
+        # factory() makes a new entity, reset(entity, *args) reinitializes one
+        self.factory = factory
+        self.reset = reset
+        self.capacity = capacity
+        self.active = []
+        self.free = []
+        # id(entity) -> index in active
+        self.slots = {}
+        self.created = 0
+        self.recycled = 0
+        self.peak = 0
+
+    def __len__(self):
+        return len(self.active)
+
+    def __iter__(self):
+        # Walks backwards, so the entity being visited may be released during
+        # the loop: swap-remove only moves an already visited entity
+        active = self.active
+        for i in range(len(active) - 1, -1, -1):
+            if i < len(active):
+                yield active[i]
+
+    def acquire(self, *args):
+        # Returns None when the pool is full
+        if len(self.active) >= self.capacity:
+            return None
+        if self.free:
+            entity = self.free.pop()
+            self.recycled += 1
+        else:
+            entity = self.factory()
+            self.created += 1
+        self.reset(entity, *args)
+        self.slots[id(entity)] = len(self.active)
+        self.active.append(entity)
+        self.peak = max(self.peak, len(self.active))
+        return entity
+
+    def release(self, entity):
+        index = self.slots.pop(id(entity))
+        last = self.active.pop()
+        if last is not entity:
+            self.active[index] = last
+            self.slots[id(last)] = index
+        self.free.append(entity)
+
+    def clear(self):
+        for entity in self.active:
+            self.free.append(entity)
+        self.active.clear()
+        self.slots.clear()
+
+    def stats(self):
+        return {
+            "live": len(self.active),
+            "peak": self.peak,
+            "created": self.created,
+            "recycled": self.recycled,
+            "capacity": self.capacity,
+        }
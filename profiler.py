@@ -0,0 +1,283 @@
+import array
+import csv
+import json
+import time
+
+# Frame profiler. Code is split into named sections:
+#
+#   with profiler.section("collisions"):
+#       ...
+#
+# The engine times input, update, draw and flip; games add their own
+# sections (physics, collisions, level streaming, ...) inside update. Section
+# times are summed per frame and the last `capacity` frames are kept in
+# fixed-size ring buffers, from which percentiles and histograms are
+# computed. Every section run is also logged as a trace event (again in a
+# fixed-size ring buffer) for the Chrome trace export.
+#
+# Games always have a profiler: NULL_PROFILER does nothing, so the sections
+# cost a method call and an empty with block when profiling is off. pygame is
+# only imported to draw the overlay, so pygame-free code (cores.py) can take a
+# profiler too.
+
+FRAME_BUDGET = 1 / 60
+
+class RingBuffer:
+    # The last `capacity` values pushed, oldest overwritten first
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.values = array.array("d", bytes(8 * capacity))
+        self.count = 0
+
+    def __len__(self):
+        return min(self.count, self.capacity)
+
+    def push(self, value):
+        self.values[self.count % self.capacity] = value
+        self.count += 1
+
+    def ordered(self):
+        # Values oldest first
+        if self.count <= self.capacity:
+            return self.values[:self.count].tolist()
+        start = self.count % self.capacity
+        return (self.values[start:] + self.values[:start]).tolist()
+
+    def percentiles(self, *fractions):
+        values = sorted(self.values[:len(self)])
+        if not values:
+            return [0.0] * len(fractions)
+        return [values[min(len(values) - 1, int(fraction * len(values)))] for fraction in fractions]
+
+    def histogram(self, bucket_size, buckets):
+        # Counts per bucket of bucket_size seconds, the last bucket holds
+        # everything above the range
+        counts = [0] * buckets
+        for value in self.values[:len(self)]:
+            counts[min(buckets - 1, int(value / bucket_size))] += 1
+        return counts
+
+class Section:
+    # Reused for every run of a section, so sections with the same name must
+    # not be nested
+    __slots__ = ("profiler", "name", "start")
+
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+        self.start = 0.0
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.profiler.add(self.name, self.start, time.perf_counter() - self.start)
+
+class NullSection:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+class NullProfiler:
+    enabled = False
+
+    def __init__(self):
+        self.null_section = NullSection()
+
+    def section(self, name):
+        return self.null_section
+
+    def add(self, name, start, duration):
+        pass
+
+    def start_frame(self):
+        pass
+
+    def end_frame(self):
+        pass
+
+    def draw(self, surface):
+        return None
+
+NULL_PROFILER = NullProfiler()
+
+class Profiler:
+    enabled = True
+
+    def __init__(self, capacity=600, trace_capacity=100000, budget=FRAME_BUDGET):
+        self.capacity = capacity
+        self.budget = budget
+        self.sections = {}
+        # name -> RingBuffer of per-frame totals, "frame" is the whole frame
+        self.history = {"frame": RingBuffer(capacity)}
+        self.totals = {}
+        self.frames = 0
+        self.origin = time.perf_counter()
+        self.frame_start = self.origin
+
+        # Trace events: section id, frame, start and duration per entry
+        self.trace_capacity = trace_capacity
+        self.trace_names = []
+        self.trace_ids = {}
+        self.trace_section = array.array("I", bytes(4 * trace_capacity))
+        self.trace_frame = array.array("I", bytes(4 * trace_capacity))
+        self.trace_start = array.array("d", bytes(8 * trace_capacity))
+        self.trace_duration = array.array("d", bytes(8 * trace_capacity))
+        self.trace_count = 0
+
+        # Overlay text is only rendered again every overlay_interval frames
+        self.overlay_interval = 30
+        self.overlay = None
+        self.font = None
+
+    def section(self, name):
+        section = self.sections.get(name)
+        if section is None:
+            section = self.sections[name] = Section(self, name)
+        return section
+
+    def add(self, name, start, duration):
+        self.totals[name] = self.totals.get(name, 0.0) + duration
+        section_id = self.trace_ids.get(name)
+        if section_id is None:
+            section_id = self.trace_ids[name] = len(self.trace_names)
+            self.trace_names.append(name)
+        i = self.trace_count % self.trace_capacity
+        self.trace_section[i] = section_id
+        self.trace_frame[i] = self.frames
+        self.trace_start[i] = start
+        self.trace_duration[i] = duration
+        self.trace_count += 1
+
+    def start_frame(self):
+        # Time before this (e.g. waiting for the next frame) is not part of the frame
+        self.frame_start = time.perf_counter()
+
+    def end_frame(self):
+        now = time.perf_counter()
+        self.add("frame", self.frame_start, now - self.frame_start)
+        totals = self.totals
+        for name in totals:
+            if name not in self.history:
+                self.history[name] = RingBuffer(self.capacity)
+        # Sections that did not run this frame took no time
+        for name, history in self.history.items():
+            history.push(totals.get(name, 0.0))
+        totals.clear()
+        self.frames += 1
+        self.frame_start = now
+
+    def summary(self):
+        # name -> statistics in seconds over the buffered frames
+        result = {}
+        for name, history in self.history.items():
+            p50, p95, p99 = history.percentiles(0.50, 0.95, 0.99)
+            values = history.values[:len(history)]
+            result[name] = {
+                "mean": sum(values) / len(values) if values else 0.0,
+                "p50": p50,
+                "p95": p95,
+                "p99": p99,
+                "max": max(values, default=0.0),
+                "over_budget": sum(1 for value in values if value > self.budget),
+            }
+        return result
+
+    def histogram(self, name, bucket_size=0.001, buckets=20):
+        return self.history[name].histogram(bucket_size, buckets)
+
+    def report(self):
+        lines = [f"{'section':>12} {'mean':>8} {'p50':>8} {'p95':>8} {'p99':>8} {'max':>8}   (ms, last {len(self.history['frame'])} frames)"]
+        for name, stats in self.summary().items():
+            columns = " ".join(f"{stats[key] * 1000:>8.2f}" for key in ("mean", "p50", "p95", "p99", "max"))
+            lines.append(f"{name:>12} {columns}")
+        frame = self.summary()["frame"]
+        lines.append(f"{frame['over_budget']} frames over the {self.budget * 1000:.1f} ms budget")
+        return "\n".join(lines)
+
+    def render_overlay(self):
+        import pygame
+
+        if self.font is None:
+            if not pygame.font.get_init():
+                pygame.font.init()
+            self.font = pygame.font.Font(None, 18)
+        summary = self.summary()
+        lines = []
+        for name, stats in summary.items():
+            # Sections whose worst frames blow the budget are shown in red
+            color = (255, 80, 80) if stats["p99"] > self.budget else (255, 255, 255)
+            text = f"{name:<10} p50 {stats['p50'] * 1000:5.2f}  p95 {stats['p95'] * 1000:5.2f}  p99 {stats['p99'] * 1000:5.2f} ms"
+            lines.append(self.font.render(text, True, color))
+        width = max(line.get_width() for line in lines) + 10
+        height = sum(line.get_height() for line in lines) + 10
+        overlay = pygame.Surface((width, height))
+        overlay.fill((0, 0, 0))
+        y = 5
+        for line in lines:
+            overlay.blit(line, (5, y))
+            y += line.get_height()
+        return overlay
+
+    def draw(self, surface):
+        # Draws the overlay in the top left corner and returns its rect
+        if self.overlay is None or self.frames % self.overlay_interval == 0:
+            self.overlay = self.render_overlay()
+        return surface.blit(self.overlay, (0, 0))
+
+    def trace_events(self):
+        # (name, frame, start, duration) oldest first
+        count = min(self.trace_count, self.trace_capacity)
+        first = self.trace_count - count
+        for n in range(first, self.trace_count):
+            i = n % self.trace_capacity
+            yield self.trace_names[self.trace_section[i]], self.trace_frame[i], self.trace_start[i], self.trace_duration[i]
+
+    def export_csv(self, path):
+        # One row per frame with the time of every section in ms
+        names = list(self.history)
+        columns = [self.history[name].ordered() for name in names]
+        first_frame = self.frames - len(columns[0])
+        with open(path, "w", newline="") as file:
+            writer = csv.writer(file)
+            writer.writerow(["frame"] + [f"{name}_ms" for name in names])
+            for row, values in enumerate(zip(*columns)):
+                writer.writerow([first_frame + row] + [f"{value * 1000:.4f}" for value in values])
+
+    def export_json(self, path):
+        with open(path, "w") as file:
+            json.dump({
+                "frames": self.frames,
+                "budget_ms": self.budget * 1000,
+                "summary_ms": {
+                    name: {key: value * 1000 if key != "over_budget" else value for key, value in stats.items()}
+                    for name, stats in self.summary().items()
+                },
+                "frames_ms": {name: [value * 1000 for value in history.ordered()] for name, history in self.history.items()},
+            }, file)
+
+    def export_chrome_trace(self, path):
+        # Loads in chrome://tracing and Perfetto; nested sections show up as
+        # nested slices
+        events = [
+            {"name": name, "ph": "X", "pid": 0, "tid": 0, "ts": (start - self.origin) * 1e6, "dur": duration * 1e6, "args": {"frame": frame}}
+            for name, frame, start, duration in self.trace_events()
+        ]
+        with open(path, "w") as file:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, file)
+
+    def export(self, path):
+        # Format from the file name: .trace.json, .json or .csv
+        if path.endswith(".trace.json"):
+            self.export_chrome_trace(path)
+        elif path.endswith(".json"):
+            self.export_json(path)
+        elif path.endswith(".csv"):
+            self.export_csv(path)
+        else:
+            raise ValueError(f"unknown profile format for {path!r}, use .csv, .json or .trace.json")
@@ -0,0 +1,251 @@
+import argparse
+import importlib
+import json
+import struct
+import time
+import zlib
+
+import pygame
+
+import engine
+
+# Recorded game sessions. A recording holds the game module, the seed of the
+# game's random number generator and the input of every tick, so a session
+# played for real can be replayed headlessly tick for tick:
+#
+#   python replay.py record car_game session.rpl
+#   python replay.py play session.rpl other.rpl
+#
+# Playing reports per-tick timing percentiles for update and draw
+# separately, which makes a set of recordings a regression benchmark built
+# from real gameplay.
+#
+# File layout:
+#   header   magic, version, tick rate, seed, tick count, metadata length
+#   metadata JSON {"game": module name, "options": Game() keyword arguments}
+#   body     zlib-compressed input records
+#
+# Each input record is (tick, kind, payload length) followed by the payload.
+# Key state is only stored on the ticks where it changes, as the pressed key
+# codes; the events of a tick are stored together as JSON.
+
+MAGIC = b"RPL1"
+VERSION = 1
+HEADER = struct.Struct("<4sHHQII")
+RECORD = struct.Struct("<IBI")
+
+KEYS = 0
+EVENTS = 1
+
+# Only these events reach the game while recording or replaying
+RECORDED_EVENTS = (
+    pygame.KEYDOWN,
+    pygame.KEYUP,
+    pygame.MOUSEBUTTONDOWN,
+    pygame.MOUSEBUTTONUP,
+    pygame.MOUSEMOTION,
+)
+
+class ReplayError(Exception):
+    pass
+
+def encode_event(event):
+    attributes = {name: value for name, value in event.dict.items() if isinstance(value, (bool, int, float, str, tuple))}
+    return [event.type, attributes]
+
+def decode_event(item):
+    event_type, attributes = item
+    # JSON turns tuples such as pos into lists
+    attributes = {name: tuple(value) if isinstance(value, list) else value for name, value in attributes.items()}
+    return pygame.event.Event(event_type, attributes)
+
+class Recording:
+    def __init__(self, game, seed, tick_rate=engine.TICK_RATE, options=None):
+        self.game = game
+        self.seed = seed
+        self.tick_rate = tick_rate
+        self.options = options or {}
+        self.ticks = 0
+        # tick -> frozenset of pressed keys, only where it changed
+        self.keys = {}
+        # tick -> list of encoded events
+        self.events = {}
+
+    def new_game(self):
+        module = importlib.import_module(self.game)
+        return module.Game(seed=self.seed, **self.options)
+
+    def inputs(self):
+        # Input callable for Engine.run_headless and play()
+        state = {"keys": engine.NO_KEYS}
+
+        def inputs(tick, game):
+            pressed = self.keys.get(tick)
+            if pressed is not None:
+                state["keys"] = engine.KeyState(pressed)
+            events = [decode_event(item) for item in self.events.get(tick, ())]
+            return state["keys"], events
+
+        return inputs
+
+    def save(self, path):
+        body = []
+        for tick in sorted(set(self.keys) | set(self.events)):
+            pressed = self.keys.get(tick)
+            if pressed is not None:
+                payload = struct.pack(f"<{len(pressed)}I", *sorted(pressed))
+                body.append(RECORD.pack(tick, KEYS, len(payload)) + payload)
+            events = self.events.get(tick)
+            if events:
+                payload = json.dumps(events, separators=(",", ":")).encode("utf-8")
+                body.append(RECORD.pack(tick, EVENTS, len(payload)) + payload)
+        metadata = json.dumps({"game": self.game, "options": self.options}).encode("utf-8")
+        with open(path, "wb") as file:
+            file.write(HEADER.pack(MAGIC, VERSION, self.tick_rate, self.seed, self.ticks, len(metadata)))
+            file.write(metadata)
+            file.write(zlib.compress(b"".join(body), 9))
+
+    @classmethod
+    def load(cls, path):
+        with open(path, "rb") as file:
+            data = file.read()
+        if len(data) < HEADER.size:
+            raise ReplayError(f"{path}: file too short for a recording header")
+        magic, version, tick_rate, seed, ticks, metadata_length = HEADER.unpack_from(data)
+        if magic != MAGIC:
+            raise ReplayError(f"{path}: not a recording")
+        if version != VERSION:
+            raise ReplayError(f"{path}: unsupported recording version {version}")
+        metadata = json.loads(data[HEADER.size:HEADER.size + metadata_length])
+        recording = cls(metadata["game"], seed, tick_rate, metadata["options"])
+        recording.ticks = ticks
+        body = zlib.decompress(data[HEADER.size + metadata_length:])
+        offset = 0
+        while offset < len(body):
+            tick, kind, length = RECORD.unpack_from(body, offset)
+            offset += RECORD.size
+            payload = body[offset:offset + length]
+            offset += length
+            if kind == KEYS:
+                recording.keys[tick] = frozenset(struct.unpack(f"<{length // 4}I", payload))
+            elif kind == EVENTS:
+                recording.events[tick] = json.loads(payload)
+            else:
+                raise ReplayError(f"{path}: unknown record kind {kind}")
+        return recording
+
+class Recorder:
+    # Plugged into Engine.run: filters the events of each tick, keeps the key
+    # state from key events and writes both into the recording
+    def __init__(self, recording):
+        self.recording = recording
+        self.pressed = set()
+        self.keys = engine.NO_KEYS
+
+    def record(self, tick, events):
+        kept = []
+        for event in events:
+            if event.type not in RECORDED_EVENTS:
+                continue
+            if event.type == pygame.KEYDOWN:
+                self.pressed.add(event.key)
+            elif event.type == pygame.KEYUP:
+                self.pressed.discard(event.key)
+            kept.append(event)
+        if kept:
+            self.recording.events[tick] = [encode_event(event) for event in kept]
+        if self.pressed != self.keys.pressed:
+            self.keys = engine.KeyState(self.pressed)
+            self.recording.keys[tick] = self.keys.pressed
+        self.recording.ticks = tick + 1
+        return self.keys, kept
+
+def record(game_name, path, seed=None):
+    engine.init()
+    module = importlib.import_module(game_name)
+    options = dict(module.Game.replay_options)
+    game = module.Game(seed=seed, **options)
+    recording = Recording(game_name, game.seed, engine.TICK_RATE, options)
+    stats = engine.Engine(game, recording.tick_rate).run(recorder=Recorder(recording))
+    recording.save(path)
+    return recording, stats
+
+def percentile(values, fraction):
+    # Nearest-rank percentile of sorted values
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+class Timings:
+    # Per-tick durations in seconds
+    def __init__(self, name):
+        self.name = name
+        self.samples = []
+
+    def summary(self):
+        values = sorted(self.samples)
+        mean = sum(values) / len(values) if values else 0.0
+        return {
+            "mean": mean,
+            "p50": percentile(values, 0.50),
+            "p90": percentile(values, 0.90),
+            "p99": percentile(values, 0.99),
+            "max": values[-1] if values else 0.0,
+        }
+
+    def __str__(self):
+        summary = self.summary()
+        columns = " ".join(f"{name} {value * 1e6:>9.1f}" for name, value in summary.items())
+        return f"{self.name:>8} {columns}   (us)"
+
+def play(recording, render=True):
+    # Replays a recording as fast as possible, timing update and draw
+    game = recording.new_game()
+    runner = engine.Engine(game, recording.tick_rate)
+    inputs = recording.inputs()
+    surface = pygame.Surface(game.size) if render else None
+    update = Timings("update")
+    draw = Timings("draw")
+    clock = time.perf_counter
+    for tick in range(recording.ticks):
+        if not game.running:
+            break
+        keys, events = inputs(tick, game)
+        start = clock()
+        runner.step(keys, events)
+        update.samples.append(clock() - start)
+        if surface is not None:
+            start = clock()
+            game.draw(surface)
+            draw.samples.append(clock() - start)
+    game.close()
+    return game, update, draw
+
+def main():
+    parser = argparse.ArgumentParser(description="Record game sessions and replay them as a benchmark.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    record_parser = commands.add_parser("record", help="play a game in a window and record the input")
+    record_parser.add_argument("game", help="game module, e.g. car_game, fakemario, fakesonic, fakemc")
+    record_parser.add_argument("path", help="recording file to write")
+    record_parser.add_argument("--seed", type=int, help="seed for the game's random number generator")
+    play_parser = commands.add_parser("play", help="replay recordings headlessly and report tick timings")
+    play_parser.add_argument("paths", nargs="+", help="recording files")
+    play_parser.add_argument("--no-render", action="store_true", help="only time update, skip drawing")
+    args = parser.parse_args()
+
+    if args.command == "record":
+        recording, stats = record(args.game, args.path, args.seed)
+        print(f"{args.path}: {recording.game}, seed {recording.seed}, {stats}")
+    else:
+        engine.init(headless=True)
+        for path in args.paths:
+            recording = Recording.load(path)
+            _, update, draw = play(recording, render=not args.no_render)
+            print(f"{path}: {recording.game}, seed {recording.seed}, {len(update.samples)}/{recording.ticks} ticks")
+            print(update)
+            if draw.samples:
+                print(draw)
+    pygame.quit()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,204 @@
+import argparse
+import importlib
+import os
+import random
+import struct
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+import pygame
+
+import engine
+import car_game
+import cores
+
+# Runs many independent headless sessions (episodes) of a game across a
+# process pool, e.g. for balancing or for collecting training data:
+#
+#   python runner.py car_game --episodes 256 --workers 8 --policy scripted
+#
+# Every episode gets its own seed (base seed + episode number) and an input
+# policy. Workers write each episode's result into a slot of a shared memory
+# buffer, so results are not pickled back through the pool.
+
+# Result slot per episode: score, survived ticks, collisions, CPU seconds
+RESULT = struct.Struct("<qqqd")
+
+# Keys the random policy picks from
+GAME_KEYS = {
+    "car_game": (pygame.K_LEFT, pygame.K_RIGHT),
+    "fakemario": (pygame.K_LEFT, pygame.K_RIGHT, pygame.K_SPACE),
+}
+
+class IdlePolicy:
+    def __init__(self, game_name, rng):
+        pass
+
+    def __call__(self, tick, game):
+        return engine.NO_KEYS, ()
+
+class RandomPolicy:
+    # Presses a random key (or none) every `interval` ticks and holds it
+    def __init__(self, game_name, rng, interval=15):
+        self.keys = GAME_KEYS.get(game_name, ())
+        self.rng = rng
+        self.interval = interval
+        self.held = None
+        self.state = engine.NO_KEYS
+
+    def __call__(self, tick, game):
+        if tick % self.interval != 0:
+            return self.state, ()
+        events = []
+        if self.held is not None:
+            events.append(pygame.event.Event(pygame.KEYUP, key=self.held))
+        self.held = self.rng.choice(self.keys + (None,))
+        if self.held is None:
+            self.state = engine.NO_KEYS
+        else:
+            events.append(pygame.event.Event(pygame.KEYDOWN, key=self.held))
+            self.state = engine.KeyState((self.held,))
+        return self.state, events
+
+class CarDodgePolicy:
+    # cores.car_policy as key events: changes lane when a car is coming down
+    # the player's lane
+    KEYS = {cores.LEFT: pygame.K_LEFT, cores.RIGHT: pygame.K_RIGHT}
+
+    def __init__(self, game_name, rng, lookahead=car_game.CAR_HEIGHT):
+        self.lookahead = lookahead
+
+    def __call__(self, tick, game):
+        presses = cores.car_policy(game.core, tick, self.lookahead).presses
+        return engine.NO_KEYS, [pygame.event.Event(pygame.KEYDOWN, key=self.KEYS[press]) for press in presses]
+
+class MarioRunPolicy:
+    # Runs right and jumps every `interval` ticks
+    def __init__(self, game_name, rng, interval=40):
+        self.interval = interval
+        self.keys = engine.KeyState((pygame.K_RIGHT,))
+
+    def __call__(self, tick, game):
+        if tick % self.interval == 0:
+            return self.keys, [pygame.event.Event(pygame.KEYDOWN, key=pygame.K_SPACE)]
+        return self.keys, ()
+
+SCRIPTED_POLICIES = {
+    "car_game": CarDodgePolicy,
+    "fakemario": MarioRunPolicy,
+}
+
+def make_policy(name, game_name, rng):
+    if name == "idle":
+        return IdlePolicy(game_name, rng)
+    if name == "random":
+        return RandomPolicy(game_name, rng)
+    if name == "scripted":
+        return SCRIPTED_POLICIES.get(game_name, IdlePolicy)(game_name, rng)
+    raise ValueError(f"unknown policy {name!r}")
+
+# Per-worker settings, set by init_worker in each pool process
+_config = {}
+
+def init_worker(config):
+    engine.init(headless=True)
+    _config.update(config)
+
+def run_episodes(episodes):
+    # Runs a batch of episodes in a worker, returns the worker's busy time
+    config = _config
+    module = importlib.import_module(config["game"])
+    results = shared_memory.SharedMemory(name=config["results"])
+    start = time.perf_counter()
+    try:
+        for episode in episodes:
+            seed = config["seed"] + episode
+            game = module.Game(seed=seed, **module.Game.replay_options)
+            policy = make_policy(config["policy"], config["game"], random.Random(seed))
+            runner = engine.Engine(game)
+            # CPU time, so workers sharing a core do not look slower
+            cpu_start = time.process_time()
+            stats = runner.run_headless(config["ticks"], inputs=policy)
+            cpu_seconds = time.process_time() - cpu_start
+            result = game.stats()
+            RESULT.pack_into(results.buf, episode * RESULT.size, result["score"], stats.ticks, result["collisions"], cpu_seconds)
+    finally:
+        results.close()
+    return os.getpid(), time.perf_counter() - start
+
+class RunReport:
+    def __init__(self, game, policy, workers, results, seconds):
+        self.game = game
+        self.policy = policy
+        self.workers = workers
+        # (score, ticks, collisions, CPU seconds) per episode
+        self.results = results
+        self.seconds = seconds
+
+    @property
+    def ticks(self):
+        return sum(result[1] for result in self.results)
+
+    @property
+    def ticks_per_second(self):
+        return self.ticks / self.seconds if self.seconds > 0 else 0.0
+
+    @property
+    def ticks_per_second_per_core(self):
+        return self.ticks_per_second / self.workers
+
+    @property
+    def single_core_rate(self):
+        # Ticks per CPU second inside the episodes, what one core can do
+        # without any pool overhead
+        busy = sum(result[3] for result in self.results)
+        return self.ticks / busy if busy > 0 else 0.0
+
+    def __str__(self):
+        count = len(self.results)
+        scores = [result[0] for result in self.results]
+        ticks = [result[1] for result in self.results]
+        collisions = sum(result[2] for result in self.results)
+        scaling = self.ticks_per_second / (self.single_core_rate * self.workers) if self.single_core_rate else 0.0
+        return "\n".join([
+            f"{self.game}, {self.policy} policy: {count} episodes on {self.workers} workers in {self.seconds:.2f} s",
+            f"  score      mean {sum(scores) / count:.1f}, min {min(scores)}, max {max(scores)}",
+            f"  survived   mean {sum(ticks) / count:.0f} ticks, min {min(ticks)}, max {max(ticks)}",
+            f"  collisions {collisions}",
+            f"  throughput {self.ticks_per_second:,.0f} ticks/s, {self.ticks_per_second_per_core:,.0f} ticks/s per core "
+            f"({scaling:.0%} of {self.workers} x {self.single_core_rate:,.0f} ticks/s)",
+        ])
+
+def run(game_name, episodes, workers=None, policy="scripted", ticks=3600, seed=0, batch_size=None):
+    workers = workers or os.cpu_count() or 1
+    # A few batches per worker keeps the load balanced without paying pool
+    # overhead per episode
+    batch_size = batch_size or max(1, episodes // (workers * 4))
+    batches = [range(first, min(first + batch_size, episodes)) for first in range(0, episodes, batch_size)]
+    results = shared_memory.SharedMemory(create=True, size=episodes * RESULT.size)
+    try:
+        config = {"game": game_name, "policy": policy, "ticks": ticks, "seed": seed, "results": results.name}
+        start = time.perf_counter()
+        with ProcessPoolExecutor(workers, initializer=init_worker, initargs=(config,)) as pool:
+            list(pool.map(run_episodes, batches))
+        seconds = time.perf_counter() - start
+        rows = [RESULT.unpack_from(results.buf, episode * RESULT.size) for episode in range(episodes)]
+    finally:
+        results.close()
+        results.unlink()
+    return RunReport(game_name, policy, workers, rows, seconds)
+
+def main():
+    parser = argparse.ArgumentParser(description="Run many headless game sessions in parallel.")
+    parser.add_argument("game", help="game module, e.g. car_game or fakemario")
+    parser.add_argument("--episodes", type=int, default=64, help="number of sessions to run")
+    parser.add_argument("--workers", type=int, help="worker processes (default: one per core)")
+    parser.add_argument("--policy", choices=("idle", "random", "scripted"), default="scripted", help="how the player is driven")
+    parser.add_argument("--ticks", type=int, default=3600, help="longest episode in ticks")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the first episode")
+    args = parser.parse_args()
+    print(run(args.game, args.episodes, args.workers, args.policy, args.ticks, args.seed))
+
+if __name__ == "__main__":
+    main()
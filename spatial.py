@@ -0,0 +1,158 @@
+import random
+import sys
+import time
+from bisect import bisect_left, bisect_right
+
+# Uniform grid broad-phase for collisions. Objects are bucketed by the cells
+# their bounding box covers, so a query only looks at objects in the cells
+# around the query box instead of every object in the level.
+#
+# Boxes are (x, y, width, height) sequences, so pygame.Rect works as is.
+# Objects are tracked by identity because pygame.Rect is not hashable.
+
+CELL_SIZE = 128
+
+class SpatialHash:
+    def __init__(self, cell_size=CELL_SIZE):
+        self.cell_size = cell_size
+        self.cells = {}
+        # id(obj) -> (obj, cell range)
+        self.objects = {}
+
+    def __len__(self):
+        return len(self.objects)
+
+    def __contains__(self, obj):
+        return id(obj) in self.objects
+
+    def cell_range(self, box):
+        x, y, width, height = box
+        size = self.cell_size
+        return (
+            int(x // size), int(y // size),
+            int((x + max(width, 1) - 1) // size), int((y + max(height, 1) - 1) // size),
+        )
+
+    def insert(self, obj, box):
+        key = id(obj)
+        if key in self.objects:
+            self.remove(obj)
+        cells = self.cell_range(box)
+        self.objects[key] = (obj, cells)
+        x0, y0, x1, y1 = cells
+        for cell_x in range(x0, x1 + 1):
+            for cell_y in range(y0, y1 + 1):
+                bucket = self.cells.get((cell_x, cell_y))
+                if bucket is None:
+                    bucket = self.cells[(cell_x, cell_y)] = {}
+                bucket[key] = obj
+
+    def remove(self, obj):
+        key = id(obj)
+        entry = self.objects.pop(key, None)
+        if entry is None:
+            return
+        x0, y0, x1, y1 = entry[1]
+        for cell_x in range(x0, x1 + 1):
+            for cell_y in range(y0, y1 + 1):
+                bucket = self.cells[(cell_x, cell_y)]
+                del bucket[key]
+                if not bucket:
+                    del self.cells[(cell_x, cell_y)]
+
+    def move(self, obj, box):
+        # Re-bucket a dynamic object; cheap when it stays in the same cells
+        entry = self.objects.get(id(obj))
+        if entry is not None and entry[1] == self.cell_range(box):
+            return
+        self.insert(obj, box)
+
+    def clear(self):
+        self.cells.clear()
+        self.objects.clear()
+
+    def query(self, box):
+        # Candidates whose cells overlap the box; callers still do the exact test
+        x0, y0, x1, y1 = self.cell_range(box)
+        cells = self.cells
+        if x0 == x1 and y0 == y1:
+            bucket = cells.get((x0, y0))
+            return list(bucket.values()) if bucket else []
+        found = {}
+        for cell_x in range(x0, x1 + 1):
+            for cell_y in range(y0, y1 + 1):
+                bucket = cells.get((cell_x, cell_y))
+                if bucket:
+                    found.update(bucket)
+        return list(found.values())
+
+class SortedXIndex:
+    # Boxes kept sorted by their left edge. A horizontal span query (e.g. the
+    # camera view) is two bisects plus a walk over the boxes inside it.
+    def __init__(self):
+        self.xs = []
+        self.boxes = []
+        self.objects = []
+        self.max_width = 0
+
+    def __len__(self):
+        return len(self.objects)
+
+    def insert(self, obj, box):
+        x, y, width, height = box
+        i = bisect_right(self.xs, x)
+        self.xs.insert(i, x)
+        self.boxes.insert(i, (x, y, width, height))
+        self.objects.insert(i, obj)
+        self.max_width = max(self.max_width, width)
+
+    def remove(self, obj, box):
+        x = box[0]
+        for i in range(bisect_left(self.xs, x), bisect_right(self.xs, x)):
+            if self.objects[i] is obj:
+                del self.xs[i], self.boxes[i], self.objects[i]
+                return
+
+    def query(self, left, right):
+        # Objects overlapping [left, right) horizontally
+        xs = self.xs
+        start = bisect_left(xs, left - self.max_width)
+        stop = bisect_left(xs, right)
+        boxes = self.boxes
+        return [self.objects[i] for i in range(start, stop) if boxes[i][0] + boxes[i][2] > left]
+
+# Benchmark: collision cost per frame as the level gets longer
+
+def benchmark(lengths=(10, 100, 1000), frames=2000):
+    import pygame
+
+    print(f"{'platforms':>10} {'brute force':>14} {'spatial hash':>14}   (per frame)")
+    for length in lengths:
+        rng = random.Random(length)
+        platforms = []
+        for i in range(length):
+            platforms.append(pygame.Rect(i * 200, 550, 200, 50))
+            platforms.append(pygame.Rect(i * 200 + rng.randint(0, 100), rng.randint(200, 500), 100, 20))
+        index = SpatialHash()
+        for platform in platforms:
+            index.insert(platform, platform)
+        players = [pygame.Rect(rng.randint(0, length * 200), rng.randint(200, 560), 40, 40) for _ in range(frames)]
+
+        start = time.perf_counter()
+        for player in players:
+            for platform in platforms:
+                if player.colliderect(platform):
+                    pass
+        brute = (time.perf_counter() - start) / frames
+
+        start = time.perf_counter()
+        for player in players:
+            for platform in index.query(player):
+                if player.colliderect(platform):
+                    pass
+        hashed = (time.perf_counter() - start) / frames
+
+        print(f"{len(platforms):>10} {brute * 1e6:>11.1f} us {hashed * 1e6:>11.1f} us")
+
+if __name__ == "__main__":
+    benchmark(tuple(int(arg) for arg in sys.argv[1:]) or (10, 100, 1000))
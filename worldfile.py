@@ -0,0 +1,186 @@
+import mmap
+import os
+import struct
+import tempfile
+import zlib
+
+# Binary save file for chunked worlds.
+#
+#   header   magic, version, chunk size, rows, seed, index offset, index count
+#   payloads zlib-compressed chunk blocks, appended as chunks get saved
+#   index    (chunk_x, chunk_y, payload offset, payload length) per chunk
+#
+# The live index is the last thing in the file and the header points at it.
+# Saving appends only the dirty chunks plus a fresh index past the end of the
+# file, syncs them to disk and only then rewrites the header, so neither
+# earlier payloads nor the index the header points at are ever touched: a
+# save that is interrupted leaves the previous save intact. compact() drops
+# the payloads and old indexes that newer saves have replaced; a commit
+# runs it by itself once less than 1 / COMPACT_RATIO of the file is live.
+#
+# append_chunks() writes payloads the same way but leaves the header alone:
+# the chunks can be read back at once, and become part of the save with the
+# next commit(). Worlds put chunks they evict there, so until the player
+# saves, the file on disk still opens as the last save.
+
+MAGIC = b"FMCW"
+VERSION = 1
+HEADER = struct.Struct("<4sHHIqQI")
+INDEX_ENTRY = struct.Struct("<iiQI")
+# Files bigger than COMPACT_MIN_SIZE are compacted when they are this many
+# times the size they would be compacted
+COMPACT_RATIO = 2
+COMPACT_MIN_SIZE = 64 * 1024
+
+class WorldFileError(Exception):
+    pass
+
+class WorldFile:
+    def __init__(self, path, file=None):
+        # path is None for a temporary file, see create_temporary
+        self.path = path
+        self.file = open(path, "r+b") if file is None else file
+        self.map = None
+        self.index = {}
+        # Keys of the chunks appended since the last commit
+        self.uncommitted = set()
+        self.read_header()
+
+    @classmethod
+    def create(cls, path, chunk_size, rows, seed):
+        with open(path, "wb") as file:
+            file.write(HEADER.pack(MAGIC, VERSION, chunk_size, rows, seed, HEADER.size, 0))
+        return cls(path)
+
+    @classmethod
+    def create_temporary(cls, chunk_size, rows, seed):
+        # Unnamed file for a world that is not being saved; it is gone once
+        # it is closed or the process ends
+        file = tempfile.TemporaryFile()
+        file.write(HEADER.pack(MAGIC, VERSION, chunk_size, rows, seed, HEADER.size, 0))
+        file.flush()
+        return cls(None, file)
+
+    def read_header(self):
+        # Only the header and the index are read up front, payloads are
+        # decompressed from the memory map when a chunk is first needed
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        if len(self.map) < HEADER.size:
+            raise WorldFileError(f"{self.path}: file too short for a world header")
+        magic, version, chunk_size, rows, seed, index_offset, index_count = HEADER.unpack_from(self.map)
+        if magic != MAGIC:
+            raise WorldFileError(f"{self.path}: not a world file")
+        if version != VERSION:
+            raise WorldFileError(f"{self.path}: unsupported world file version {version}")
+        self.chunk_size = chunk_size
+        self.rows = rows
+        self.seed = seed
+        index_end = index_offset + index_count * INDEX_ENTRY.size
+        index_data = self.map[index_offset:index_end]
+        self.index = {
+            (chunk_x, chunk_y): (offset, length)
+            for chunk_x, chunk_y, offset, length in INDEX_ENTRY.iter_unpack(index_data)
+        }
+        self.index_offset = index_offset
+        self.uncommitted = set()
+
+    def __contains__(self, key):
+        return key in self.index
+
+    def __len__(self):
+        return len(self.index)
+
+    def read_chunk(self, key):
+        # Raw (uncompressed) block bytes for a chunk, or None if it was never saved
+        entry = self.index.get(key)
+        if entry is None:
+            return None
+        offset, length = entry
+        return zlib.decompress(self.map[offset:offset + length])
+
+    def append_chunks(self, payloads):
+        # payloads maps chunk key -> zlib-compressed block bytes. They go
+        # after the end of the file, past the old index, and are not saved
+        # until commit().
+        if not payloads:
+            return
+        self.map.close()
+        offset = self.file.seek(0, os.SEEK_END)
+        for key, payload in payloads.items():
+            self.file.write(payload)
+            self.index[key] = (offset, len(payload))
+            offset += len(payload)
+        self.file.flush()
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        self.uncommitted.update(payloads)
+        # Compacting commits, so a save file waits for the next commit
+        if self.path is None:
+            self.compact_if_wasteful()
+
+    def commit(self):
+        # Saves every chunk appended so far with a new index at the end
+        self.map.close()
+        self.write_index(self.file.seek(0, os.SEEK_END))
+        self.compact_if_wasteful()
+
+    def compact_if_wasteful(self):
+        # Every save leaves the payloads it replaced and the previous index
+        # behind; compacting once they make up most of the file keeps it in
+        # proportion to the world at a constant cost per byte written
+        live = HEADER.size + sum(length for _, length in self.index.values()) + len(self.index) * INDEX_ENTRY.size
+        size = len(self.map)
+        if size > COMPACT_MIN_SIZE and size > live * COMPACT_RATIO:
+            self.compact()
+
+    def write_chunks(self, payloads):
+        # Appends and commits in one go
+        if not payloads:
+            return
+        self.append_chunks(payloads)
+        self.commit()
+
+    def write_index(self, index_offset):
+        self.file.seek(index_offset)
+        for (chunk_x, chunk_y), (offset, length) in self.index.items():
+            self.file.write(INDEX_ENTRY.pack(chunk_x, chunk_y, offset, length))
+        # Payloads and index must be on disk before the header points at them
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.file.seek(0)
+        self.file.write(HEADER.pack(MAGIC, VERSION, self.chunk_size, self.rows, self.seed, index_offset, len(self.index)))
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.read_header()
+
+    def save_as(self, path):
+        # Writes every live payload, appended ones included, to a new file
+        # (a temporary one if path is None) and returns it open. This file
+        # is closed.
+        payloads = {key: self.map[offset:offset + length] for key, (offset, length) in self.index.items()}
+        if path is None:
+            copy = WorldFile.create_temporary(self.chunk_size, self.rows, self.seed)
+        else:
+            copy = WorldFile.create(path, self.chunk_size, self.rows, self.seed)
+        copy.write_chunks(payloads)
+        self.close()
+        return copy
+
+    def compact(self):
+        # Rewrite the file with only the live payloads. Appended chunks are
+        # committed along the way.
+        if self.path is None:
+            copy = self.save_as(None)
+            copy.map.close()
+            self.file = copy.file
+        else:
+            temp_path = self.path + ".tmp"
+            self.save_as(temp_path).close()
+            os.replace(temp_path, self.path)
+            self.file = open(self.path, "r+b")
+        self.read_header()
+
+    def close(self):
+        if self.map is not None:
+            self.map.close()
+            self.map = None
+        self.file.close()